@@ -0,0 +1,56 @@
+# adcards.py
+# "Ad cards": every ad with the profile that posted it and that profile's
+# schedules (and service details on the animal side), in place of the three
+# full listings the frontend used to download and join by id.
+#
+# Paged like the listings (limit, after_id and X-Next-After-Id, see
+# pagination.py), newest ad first. A page costs one JOIN of the ads with
+# their profiles, walking the ads' primary key, plus one lookup per attached
+# table by the profile ids of the page (indexes in
+# migrations/008_ad_card_indexes.sql). The attached rows keep the encoding
+# of their own listings.
+from thumbnails import thumbnail_urls
+
+PROFILE_PREFIX = "profile_"
+
+
+def ad_cards(cursor, ads, fk, profiles, profile_fields, attached, limit, after_id=None):
+    # cursor must return dict rows. fk is the column of `ads` holding the
+    # profile id. attached is {card key: (table, column holding the profile
+    # id, columns to return)}. Returns (cards, rows); rows are the ad rows
+    # of the page, for the cursor header.
+    conditions = []
+    params = []
+    if after_id is not None:
+        conditions.append("a.id < %s")
+        params.append(after_id)
+    params.append(limit)
+
+    cursor.execute(
+        f"SELECT a.*, {', '.join(f'p.{field} AS {PROFILE_PREFIX}{field}' for field in profile_fields)} "
+        f"FROM {ads} a JOIN {profiles} p ON p.id = a.{fk} "
+        + (f"WHERE {' AND '.join(conditions)} " if conditions else "")
+        + "ORDER BY a.id DESC LIMIT %s", params)
+    rows = cursor.fetchall()
+
+    profile_ids = list({row[fk] for row in rows})
+    related = {}
+    for key, (table, column, columns) in attached.items():
+        related[key] = {}
+        if not profile_ids:
+            continue
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {column} = ANY(%s) "
+                       "ORDER BY id DESC", (profile_ids,))
+        for item in cursor.fetchall():
+            related[key].setdefault(item[column], []).append(item)
+
+    cards = []
+    for row in rows:
+        card = {name: value for name, value in row.items() if not name.startswith(PROFILE_PREFIX)}
+        profile = {field: row[PROFILE_PREFIX + field] for field in profile_fields}
+        profile["thumbnails"] = thumbnail_urls(profile["imageurl"])
+        card["profile"] = profile
+        for key in attached:
+            card[key] = related[key].get(row[fk], [])
+        cards.append(card)
+    return cards, rows
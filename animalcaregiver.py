@@ -1,16 +1,44 @@
 import json
 from flask import Blueprint, jsonify, request, make_response, current_app
-from psycopg2.extras import DictCursor
-from db import close_db, get_db
+from psycopg.rows import dict_row
+from db import db_cursor
+from uploads import UploadError, resolve_image_key
+from thumbnails import thumbnail_urls
+from cache import cached, invalidates
+from etags import conditional
+from streaming import streamable
+from pagination import ANIMAL_PROFILE_FILTERS, page_query, page_window, search_query, set_next_cursor
+from adcards import ad_cards
+from availability import availability_window, available_profiles
 
 animalcaregiver_bp = Blueprint('animalcaregiver', __name__)
 
+# Fields returned by the animal caregiver listing
+ANIMAL_CAREGIVER_FIELDS = ["id", "name", "years_of_experience", "age", "education",
+                           "gender", "phone", "imageurl", "location"]
+
+# Prepared, hence explicit columns (see caregiver.py)
+ANIMAL_CAREGIVER_BY_ID_QUERY = (f"SELECT {', '.join(ANIMAL_CAREGIVER_FIELDS)} FROM animalcaregiverform "
+                                "WHERE id = %s")
+ANIMAL_CAREGIVER_BY_PHONE_QUERY = (f"SELECT {', '.join(ANIMAL_CAREGIVER_FIELDS)} FROM animalcaregiverform "
+                                   "WHERE phone = %s ORDER BY id DESC")
+
+# Fields returned by the animal caregiver details listing
+ANIMAL_CAREGIVER_DETAIL_FIELDS = ["id", "animalcaregiverid", "selectedservices",
+                                  "selectedanimals", "hourlycharge"]
+
+# Full-table listings, also served streamed (see streaming.py)
+ALL_SCHEDULES_QUERY = "SELECT * FROM animalcaregiverschedule ORDER BY id DESC"
+ALL_DETAILS_QUERY = (f"SELECT {', '.join(ANIMAL_CAREGIVER_DETAIL_FIELDS)} "
+                     "FROM animalcaregiver ORDER BY id DESC")
+ALL_ADS_QUERY = """SELECT id, title, description, animalcaregiverid
+                   FROM animalcaregiverads ORDER BY id DESC"""
+
 @animalcaregiver_bp.route("/animalcaregiver_details", methods=["POST"])
+@invalidates("animalcaregiver")
 def add_animalcaregiver_detail():
-    conn = None
     try:
         data = request.get_json()
-        print("Received data:", data)
 
         # Define the columns for the INSERT query
         columns = ["\"animalcaregiverid\"", "\"selectedservices\"",
@@ -31,24 +59,15 @@ def add_animalcaregiver_detail():
                 values.append(None)
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f'INSERT INTO animalcaregiver ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id'
-
-        print("Inserting values:", values)  # Debugging line
-        print(f"Executing SQL: {insert_query % tuple(values)}")
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f'INSERT INTO animalcaregiver ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id'
 
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_detail_id = cursor.fetchone()[0]
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_detail_id = cursor.fetchone()[0]
 
         # Create the returned object based on the interface
         new_detail = {
@@ -63,54 +82,48 @@ def add_animalcaregiver_detail():
         return jsonify(new_detail), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()  # Rolling back in case of an error
         current_app.logger.error(
             f"Error adding animalcaregiver detail: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add animalcaregiver detail"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @animalcaregiver_bp.route("/all_animalcaregivers", methods=["POST"])
+@invalidates("animalcaregiverform")
 def add_animalcaregiver():
     try:
         data = request.get_json()
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Define the mandatory columns and values for the INSERT query
-        mandatory_columns = ["name", "phone", "imageurl", "location"]
-        values = [data[field] if field != 'location' else json.dumps(
-            data[field]) for field in mandatory_columns]
-
-        # Optional fields: yearsOfExperience, age, education, gender
-        # Add them to the INSERT query only if they are present in the data
-        optional_fields = ["years_of_experience", "age", "education", "gender"]
-        for field in optional_fields:
-            if field in data:
-                mandatory_columns.append(field)
-                values.append(data[field])
-            else:
-                # If the optional field is missing, set a default value or NULL
-                # For example, set the yearsOfExperience to NULL
-                # You can customize the default values as needed
-                mandatory_columns.append(field)
-                values.append(None)
-
-        # Construct the INSERT query with the appropriate number of placeholders
-        insert_query = f"INSERT INTO animalcaregiverform ({', '.join(mandatory_columns)}) VALUES ({', '.join(['%s'] * len(mandatory_columns))}) RETURNING id"
+        with db_cursor() as cursor:
+            # imageurl, or the image_key of a completed upload
+            resolve_image_key(cursor, data)
+
+            # Define the mandatory columns and values for the INSERT query
+            mandatory_columns = ["name", "phone", "imageurl", "location"]
+            values = [data[field] if field != 'location' else json.dumps(
+                data[field]) for field in mandatory_columns]
+
+            # Optional fields: yearsOfExperience, age, education, gender, and the
+            # lat/lng of the profile (else the centre of its first district)
+            # Add them to the INSERT query only if they are present in the data
+            optional_fields = ["years_of_experience", "age", "education", "gender", "lat", "lng"]
+            for field in optional_fields:
+                if field in data:
+                    mandatory_columns.append(field)
+                    values.append(data[field])
+                else:
+                    # If the optional field is missing, set a default value or NULL
+                    # For example, set the yearsOfExperience to NULL
+                    # You can customize the default values as needed
+                    mandatory_columns.append(field)
+                    values.append(None)
 
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_animalcaregiver_id = cursor.fetchone()[0]
+            # Construct the INSERT query with the appropriate number of placeholders
+            insert_query = f"INSERT INTO animalcaregiverform ({', '.join(mandatory_columns)}) VALUES ({', '.join(['%s'] * len(mandatory_columns))}) RETURNING id"
 
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_animalcaregiver_id = cursor.fetchone()[0]
 
         # Return the newly created caregiver data with the assigned ID
         # imageUrl is possibly from const [imageUrl, setImageUrl] = useState<string | null>(null) in CaregiverForm.tsx
@@ -127,6 +140,8 @@ def add_animalcaregiver():
         }
         return jsonify(new_animalcaregiverform), 201
 
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         current_app.logger.error(
             f"Error adding animalcaregiverform: {str(e)}", exc_info=True)
@@ -134,8 +149,8 @@ def add_animalcaregiver():
 
 
 @animalcaregiver_bp.route("/animalcaregiver_ads", methods=["POST"])
+@invalidates("animalcaregiverads")
 def add_animal_caregiver_ad():
-    conn = None
     try:
         data = request.get_json()
 
@@ -151,21 +166,15 @@ def add_animal_caregiver_ad():
                   data["animalcaregiverid"]]
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f"INSERT INTO animalcaregiverads ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f"INSERT INTO animalcaregiverads ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
 
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_animalcaregiver_id = cursor.fetchone()[0]
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_animalcaregiver_id = cursor.fetchone()[0]
 
         # Create the returned object based on the ad interface
         new_ad = {
@@ -178,17 +187,13 @@ def add_animal_caregiver_ad():
         return jsonify(new_ad), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()  # Rolling back in case of an error
         current_app.logger.error(
             f"Error adding animal caregiver ad: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add animal caregiver ad"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @animalcaregiver_bp.route("/animalcaregiver_schedule", methods=["POST"])
+@invalidates("animalcaregiverschedule")
 def add_animalcaregiver_schedule():
     try:
         data = request.get_json()
@@ -216,21 +221,15 @@ def add_animalcaregiver_schedule():
                 values.append(None)
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f"INSERT INTO animalcaregiverschedule ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
-
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_schedule_id = cursor.fetchone()[0]
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f"INSERT INTO animalcaregiverschedule ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
 
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_schedule_id = cursor.fetchone()[0]
 
         # Create the returned object based on the Schedule interface
         new_schedule = {
@@ -245,48 +244,36 @@ def add_animalcaregiver_schedule():
         return jsonify(new_schedule), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()
         current_app.logger.error(
             f"Error adding schedule: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add schedule"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @animalcaregiver_bp.route('/all_animalcaregiverschedule', methods=['GET'])
+@conditional("animalcaregiverschedule")
+@cached("animalcaregiverschedule")
+@streamable(ALL_SCHEDULES_QUERY)
 def get_all_animalcaregiverschedule():
     current_app.logger.info(
         "Entering GET /all_animalcaregiverschedule request")
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch careneederschedule data from the database
-        cursor.execute(
-            "SELECT * FROM animalcaregiverschedule ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} animalcaregiverschedule records from the database")
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch careneederschedule data from the database
+            cursor.execute(ALL_SCHEDULES_QUERY)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} animalcaregiverschedule records from the database")
 
         if not rows:
             current_app.logger.warning(
                 "No animalcaregiverschedule records found in the database")
             return jsonify({"error": "No animalcaregiverschedule data available"}), 404
 
-        # Format the data for JSON
-
-        caregiverschedule = [dict(row) for row in rows]
-
         current_app.logger.debug(
             "Successfully processed all animalcaregiverschedule data")
 
-        response = make_response(jsonify(caregiverschedule))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -297,99 +284,105 @@ def get_all_animalcaregiverschedule():
 
 
 @animalcaregiver_bp.route('/all_animalcaregivers', methods=['GET'])
+@conditional("animalcaregiverform")
+@cached("animalcaregiverform")
 def get_all_animal_caregivers():
     current_app.logger.info(
         "---------------Entering GET /all_animal_caregivers request")
     try:
-        # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch animal caregivers from the database
-        cursor.execute("SELECT * FROM animalcaregiverform ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} animal caregivers from the database")
+        query, params, limit = page_query(
+            "animalcaregiverform", ANIMAL_PROFILE_FILTERS, request.args, ANIMAL_CAREGIVER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Close the connection
-        cursor.close()
+    try:
+        # Connect to the PostgreSQL database
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch one page (or all) of the animal caregivers from the database
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} animal caregivers from the database")
 
         if not rows:
+            if limit is not None:
+                return jsonify([]), 200
             current_app.logger.warning(
                 "No animal caregivers found in the database")
             return jsonify({"error": "Problem of fetching animal caregivers"}), 404
 
-        # Directly convert the rows into JSON
-        animal_caregivers = [dict(row) for row in rows]
-
-        # Format the data for JSON
-        animal_caregivers = [
-            {
-                "id": row["id"],
-                "name": row["name"],
-                "years_of_experience": row["years_of_experience"],
-                "age": row["age"],
-                "education": row["education"],
-                "gender": row["gender"],
-                "phone": row["phone"],
-                "imageurl": row["imageurl"],
-                "location": row["location"]
-            }
-            for row in rows
-        ]
+        # The rows hold exactly the listed fields, add the URLs of the small
+        # variants of the image and serialize them as they are
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
 
         current_app.logger.debug(
             "Successfully processed all animal caregivers data")
 
-        response = make_response(jsonify(animal_caregivers))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
-        return response
+        return set_next_cursor(response, rows, limit)
     except Exception as e:
         current_app.logger.error(
             "Error fetching all animal caregivers", exc_info=True)
         return jsonify({"error": "Failed to fetch all animal caregivers"}), 500
 
 
+@animalcaregiver_bp.route("/search", methods=["GET"])
+@conditional("animalcaregiverform")
+@cached("animalcaregiverform")
+def search_animal_caregivers():
+    # Animal caregivers by district or around a point (see search_query in pagination.py)
+    try:
+        query, params, limit, nearest = search_query(
+            "animalcaregiverform", ANIMAL_PROFILE_FILTERS, request.args, ANIMAL_CAREGIVER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        # Results around a point are the nearest ones, they have no next page
+        return set_next_cursor(response, rows, None if nearest else limit)
+    except Exception as e:
+        current_app.logger.error("Error searching animal caregivers", exc_info=True)
+        return jsonify({"error": "Failed to search animal caregivers"}), 500
+
+
 @animalcaregiver_bp.route('/all_animal_caregivers_details', methods=['GET'])
+@conditional("animalcaregiver")
+@cached("animalcaregiver")
+@streamable(ALL_DETAILS_QUERY)
 def get_all_animal_caregivers_details():
     current_app.logger.info(
         "---------------Entering GET /all_animal_caregivers details request")
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch animal caregivers from the database
-        cursor.execute("SELECT * FROM animalcaregiver ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} animal caregivers details from the database")
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the listed fields of the animal caregivers details
+            cursor.execute(ALL_DETAILS_QUERY)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} animal caregivers details from the database")
 
         if not rows:
             current_app.logger.warning(
                 "No animal caregivers details found in the database")
             return jsonify({"error": "Problem fetching animal caregivers details"}), 404
 
-        # Directly convert the rows into JSON
-        animal_caregivers = [
-            {
-                "id": row["id"],
-                "animalcaregiverid": row["animalcaregiverid"],
-                "selectedservices": row["selectedservices"],
-                "selectedanimals": row["selectedanimals"],
-                "hourlycharge": row["hourlycharge"]
-            }
-            for row in rows
-        ]
-
         current_app.logger.debug(
             "Successfully processed all animal caregivers details data")
 
-        response = make_response(jsonify(animal_caregivers))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -401,30 +394,19 @@ def get_all_animal_caregivers_details():
 
 
 @animalcaregiver_bp.route('/all_animal_caregiver_ads', methods=['GET'])
+@conditional("animalcaregiverads")
+@cached("animalcaregiverads")
+@streamable(ALL_ADS_QUERY)
 def get_all_animal_caregiver_ads():
     try:
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Using the correct table name
-        cursor.execute("SELECT * FROM animalcaregiverads ORDER BY id DESC")
-        rows = cursor.fetchall()
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(ALL_ADS_QUERY)
+            rows = cursor.fetchall()
 
         if not rows:
             return jsonify({"error": "No animal caregiver ads found"}), 404
 
-        animal_caregiver_ads = [
-            {
-                "id": row["id"],
-                "title": row["title"],
-                "description": row["description"],
-                "animalcaregiverid": row["animalcaregiverid"]
-            }
-            for row in rows
-        ]
-
-        response = make_response(jsonify(animal_caregiver_ads))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -433,20 +415,73 @@ def get_all_animal_caregiver_ads():
         return jsonify({"error": "Failed to fetch animal caregiver ads"}), 500
 
 
+@animalcaregiver_bp.route("/ad_cards", methods=["GET"])
+@conditional("animalcaregiverads", "animalcaregiverform", "animalcaregiverschedule", "animalcaregiver")
+@cached("animalcaregiverads", "animalcaregiverform", "animalcaregiverschedule", "animalcaregiver")
+def get_animal_caregiver_ad_cards():
+    # Ads with their animal caregiver, schedules and details, one page at a time (see adcards.py)
+    try:
+        limit, after_id = page_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cards, rows = ad_cards(
+                cursor, "animalcaregiverads", "animalcaregiverid", "animalcaregiverform", ANIMAL_CAREGIVER_FIELDS,
+                {"schedules": ("animalcaregiverschedule", "animalcaregiverform_id", ["*"]),
+                 "details": ("animalcaregiver", "animalcaregiverid", ANIMAL_CAREGIVER_DETAIL_FIELDS)},
+                limit, after_id)
+
+        response = make_response(jsonify(cards))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_next_cursor(response, rows, limit)
+    except Exception as e:
+        current_app.logger.error("Error fetching animal caregiver ad cards", exc_info=True)
+        return jsonify({"error": "Failed to fetch animal caregiver ad cards"}), 500
+
+
+@animalcaregiver_bp.route("/availability", methods=["GET"])
+@conditional("animalcaregiverform", "animalcaregiverschedule")
+@cached("animalcaregiverform", "animalcaregiverschedule")
+def get_available_animal_caregivers():
+    # Animal caregivers with a schedule in a window of dates, weekdays and hours,
+    # each with those schedules (see availability.py)
+    try:
+        window = availability_window(request.args)
+        limit, after_id = page_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            rows = available_profiles(
+                cursor, "animalcaregiver", "animalcaregiverschedule", "animalcaregiverform_id", "animalcaregiverform", ANIMAL_CAREGIVER_FIELDS,
+                window, limit, after_id)
+
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_next_cursor(response, rows, limit)
+    except Exception as e:
+        current_app.logger.error("Error fetching available animal caregivers", exc_info=True)
+        return jsonify({"error": "Failed to fetch available animal caregivers"}), 500
+
+
 @animalcaregiver_bp.route("/all_animalcaregiverform/<int:animalcaregiverform_id>", methods=["GET"])
+@conditional("animalcaregiverform")
 def get_animalcaregiverform_detail(animalcaregiverform_id):
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch the specific record from the animalcaregiverform table using the id
-        cursor.execute(
-            "SELECT * FROM animalcaregiverform WHERE id = %s", (animalcaregiverform_id,))
-        row = cursor.fetchone()
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the specific record from the animalcaregiverform table using the id
+            cursor.execute(
+                ANIMAL_CAREGIVER_BY_ID_QUERY, (animalcaregiverform_id,), prepare=True)
+            row = cursor.fetchone()
 
         # Check if a record with the given id exists
         if not row:
@@ -473,19 +508,15 @@ def get_animalcaregiverform_detail(animalcaregiverform_id):
 
 
 @animalcaregiver_bp.route("/myanimalcaregiverform/<phone>", methods=["GET"])
+@conditional("animalcaregiverform")
 def get_myanimalcaregiverform(phone):
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch the records related to the phone number from the animalcaregiverform table
-        cursor.execute(
-            "SELECT * FROM animalcaregiverform WHERE phone = %s ORDER BY id DESC", (phone,))
-        rows = cursor.fetchall()
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the records related to the phone number from the animalcaregiverform table
+            cursor.execute(
+                ANIMAL_CAREGIVER_BY_PHONE_QUERY, (phone,), prepare=True)
+            rows = cursor.fetchall()
 
         if not rows:
             return jsonify({"error": "Animal Caregiver Forms not found"}), 404
@@ -513,35 +544,30 @@ def get_myanimalcaregiverform(phone):
 
 
 @animalcaregiver_bp.route("/myanimalcaregiver/<int:id>/ad", methods=["PUT"])
+@invalidates("animalcaregiverads")
 def update_animalcaregiver_ad(id):
     current_app.logger.debug(f"Entering update_animalcaregiver for id {id}")
     try:
         data = request.get_json()
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Define the columns and values for the UPDATE query
-        columns = ["title", "description"]
-        values = [data.get(field, None) for field in columns]
-
-        current_app.logger.debug(f"Prepared values for SQL update: {values}")
+        with db_cursor() as cursor:
+            # Define the columns and values for the UPDATE query
+            columns = ["title", "description"]
+            values = [data.get(field, None) for field in columns]
 
-        # Construct the UPDATE query
-        update_query = "UPDATE animalcaregiverads SET " + \
-            ', '.join([f"{col} = %s" for col in columns]) + \
-            f" WHERE animalcaregiverid = {id}"
+            current_app.logger.debug(f"Prepared values for SQL update: {values}")
 
-        # Execute the UPDATE query with the values
-        cursor.execute(update_query, values)
+            # Construct the UPDATE query
+            update_query = "UPDATE animalcaregiverads SET " + \
+                ', '.join([f"{col} = %s" for col in columns]) + \
+                f" WHERE animalcaregiverid = {id}"
 
-        current_app.logger.info(f"Received data: {data}")
-        current_app.logger.info(f"Executing query: {update_query}")
+            # Execute the UPDATE query with the values
+            cursor.execute(update_query, values)
 
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            current_app.logger.info(f"Received data: {data}")
+            current_app.logger.info(f"Executing query: {update_query}")
 
         return jsonify({"success": "更新成功"}), 200
 
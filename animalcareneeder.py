@@ -1,48 +1,77 @@
 import json
 from flask import Blueprint, jsonify, request, make_response, current_app
-from psycopg2.extras import DictCursor
-from db import close_db, get_db
+from psycopg.rows import dict_row
+from db import db_cursor
+from uploads import UploadError, resolve_image_key
+from thumbnails import thumbnail_urls
+from cache import cached, invalidates
+from etags import conditional
+from streaming import streamable
+from pagination import ANIMAL_PROFILE_FILTERS, page_query, page_window, search_query, set_next_cursor
+from adcards import ad_cards
+from availability import availability_window, available_profiles
+from pgjson import PG_JSON_LISTINGS, aggregate_query, json_body_response, json_columns
 
 animalcareneeder_bp = Blueprint('animalcareneeder', __name__)
 
+# Fields returned by the animal careneeder listing
+ANIMAL_CARENEEDER_FIELDS = ["id", "name", "years_of_experience", "age", "education",
+                            "gender", "phone", "imageurl", "location"]
+
+# Prepared, hence explicit columns (see caregiver.py)
+ANIMAL_CARENEEDER_BY_ID_QUERY = (f"SELECT {', '.join(ANIMAL_CARENEEDER_FIELDS)} FROM animalcareneederform "
+                                 "WHERE id = %s")
+ANIMAL_CARENEEDER_BY_PHONE_QUERY = (f"SELECT {', '.join(ANIMAL_CARENEEDER_FIELDS)} FROM animalcareneederform "
+                                    "WHERE phone = %s ORDER BY id DESC")
+
+# Fields returned by the animal careneeder details listing
+ANIMAL_CARENEEDER_DETAIL_FIELDS = ["id", "animalcareneederid", "selectedservices",
+                                   "selectedanimals", "hourlycharge"]
+
+# Full-table listings, also served streamed (see streaming.py)
+ALL_SCHEDULES_QUERY = "SELECT * FROM animalcareneederschedule ORDER BY id DESC"
+ALL_DETAILS_QUERY = (f"SELECT {', '.join(ANIMAL_CARENEEDER_DETAIL_FIELDS)} "
+                     "FROM animalcareneeder ORDER BY id DESC")
+ALL_ADS_QUERY = """SELECT id, title, description, animalcareneederid
+                   FROM animalcareneederads ORDER BY id DESC"""
+
 @animalcareneeder_bp.route("/all_animalcareneeders", methods=["POST"])
+@invalidates("animalcareneederform")
 def add_animalcareneeder():
     try:
         data = request.get_json()
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Define the mandatory columns and values for the INSERT query
-        mandatory_columns = ["name", "phone", "imageurl", "location"]
-        values = [data[field] if field != 'location' else json.dumps(
-            data[field]) for field in mandatory_columns]
-
-        # Optional fields: yearsOfExperience, age, education, gender
-        # Add them to the INSERT query only if they are present in the data
-        optional_fields = ["years_of_experience", "age", "education", "gender"]
-        for field in optional_fields:
-            if field in data:
-                mandatory_columns.append(field)
-                values.append(data[field])
-            else:
-                # If the optional field is missing, set a default value or NULL
-                # For example, set the yearsOfExperience to NULL
-                # You can customize the default values as needed
-                mandatory_columns.append(field)
-                values.append(None)
-
-        # Construct the INSERT query with the appropriate number of placeholders
-        insert_query = f"INSERT INTO animalcareneederform ({', '.join(mandatory_columns)}) VALUES ({', '.join(['%s'] * len(mandatory_columns))}) RETURNING id"
+        with db_cursor() as cursor:
+            # imageurl, or the image_key of a completed upload
+            resolve_image_key(cursor, data)
+
+            # Define the mandatory columns and values for the INSERT query
+            mandatory_columns = ["name", "phone", "imageurl", "location"]
+            values = [data[field] if field != 'location' else json.dumps(
+                data[field]) for field in mandatory_columns]
+
+            # Optional fields: yearsOfExperience, age, education, gender, and the
+            # lat/lng of the profile (else the centre of its first district)
+            # Add them to the INSERT query only if they are present in the data
+            optional_fields = ["years_of_experience", "age", "education", "gender", "lat", "lng"]
+            for field in optional_fields:
+                if field in data:
+                    mandatory_columns.append(field)
+                    values.append(data[field])
+                else:
+                    # If the optional field is missing, set a default value or NULL
+                    # For example, set the yearsOfExperience to NULL
+                    # You can customize the default values as needed
+                    mandatory_columns.append(field)
+                    values.append(None)
 
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_animalcareneeder_id = cursor.fetchone()[0]
+            # Construct the INSERT query with the appropriate number of placeholders
+            insert_query = f"INSERT INTO animalcareneederform ({', '.join(mandatory_columns)}) VALUES ({', '.join(['%s'] * len(mandatory_columns))}) RETURNING id"
 
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_animalcareneeder_id = cursor.fetchone()[0]
 
         # Return the newly created caregiver data with the assigned ID
         # imageUrl is possibly from const [imageUrl, setImageUrl] = useState<string | null>(null) in CaregiverForm.tsx
@@ -59,6 +88,8 @@ def add_animalcareneeder():
         }
         return jsonify(new_animalcareneederform), 201
 
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         current_app.logger.error(
             f"Error adding animalcareneederform: {str(e)}", exc_info=True)
@@ -66,11 +97,10 @@ def add_animalcareneeder():
 
 
 @animalcareneeder_bp.route("/animalcareneeder_details", methods=["POST"])
+@invalidates("animalcareneeder")
 def add_animalcareneeder_detail():
-    conn = None
     try:
         data = request.get_json()
-        print("Received data:", data)
 
         # Define the columns for the INSERT query
         columns = ["\"animalcareneederid\"", "\"selectedservices\"",
@@ -91,24 +121,15 @@ def add_animalcareneeder_detail():
                 values.append(None)
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f'INSERT INTO animalcareneeder ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id'
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f'INSERT INTO animalcareneeder ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id'
 
-        print("Inserting values:", values)  # Debugging line
-        print(f"Executing SQL: {insert_query % tuple(values)}")
-
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_detail_id = cursor.fetchone()[0]
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_detail_id = cursor.fetchone()[0]
 
         # Create the returned object based on the interface
         new_detail = {
@@ -123,17 +144,13 @@ def add_animalcareneeder_detail():
         return jsonify(new_detail), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()  # Rolling back in case of an error
         current_app.logger.error(
             f"Error adding animalcareneeder detail: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add animalcareneeder detail"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @animalcareneeder_bp.route("/animalcareneeder_schedule", methods=["POST"])
+@invalidates("animalcareneederschedule")
 def add_animalcareneeder_schedule():
     try:
         data = request.get_json()
@@ -161,21 +178,15 @@ def add_animalcareneeder_schedule():
                 values.append(None)
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f"INSERT INTO animalcareneederschedule ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f"INSERT INTO animalcareneederschedule ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
 
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_schedule_id = cursor.fetchone()[0]
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_schedule_id = cursor.fetchone()[0]
 
         # Create the returned object based on the Schedule interface
         new_schedule = {
@@ -190,19 +201,14 @@ def add_animalcareneeder_schedule():
         return jsonify(new_schedule), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()
         current_app.logger.error(
             f"Error adding schedule: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add schedule"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @animalcareneeder_bp.route("/animalcareneeder_ads", methods=["POST"])
+@invalidates("animalcareneederads")
 def add_animal_careneeder_ad():
-    conn = None
     try:
         data = request.get_json()
 
@@ -218,21 +224,15 @@ def add_animal_careneeder_ad():
                   data["animalcareneederid"]]
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f"INSERT INTO animalcareneederads ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
-
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_animalcareneeder_id = cursor.fetchone()[0]
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f"INSERT INTO animalcareneederads ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
 
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_animalcareneeder_id = cursor.fetchone()[0]
 
         # Create the returned object based on the ad interface
         new_ad = {
@@ -245,103 +245,111 @@ def add_animal_careneeder_ad():
         return jsonify(new_ad), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()  # Rolling back in case of an error
         current_app.logger.error(
             f"Error adding animal careneeder ad: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add animal careneeder ad"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @animalcareneeder_bp.route('/all_animalcareneeders', methods=['GET'])
+@conditional("animalcareneederform")
+@cached("animalcareneederform")
 def get_all_animal_careneeders():
     current_app.logger.info(
         "---------------Entering GET /all_animal_careneeders request")
     try:
-        # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch animal caregivers from the database
-        cursor.execute("SELECT * FROM animalcareneederform ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} animal careneeders from the database")
+        query, params, limit = page_query(
+            "animalcareneederform", ANIMAL_PROFILE_FILTERS, request.args, ANIMAL_CARENEEDER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Close the connection
-        cursor.close()
+    try:
+        # Connect to the PostgreSQL database
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch one page (or all) of the animal careneeders from the database
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} animal careneeders from the database")
 
         if not rows:
+            if limit is not None:
+                return jsonify([]), 200
             current_app.logger.warning(
                 "No animal careneeders found in the database")
             return jsonify({"error": "Problem of fetching animal careneeders"}), 404
 
-        # Directly convert the rows into JSON
-        animal_careneeders = [dict(row) for row in rows]
-
-        # Format the data for JSON
-        animal_careneeders = [
-            {
-                "id": row["id"],
-                "name": row["name"],
-                "years_of_experience": row["years_of_experience"],
-                "age": row["age"],
-                "education": row["education"],
-                "gender": row["gender"],
-                "phone": row["phone"],
-                "imageurl": row["imageurl"],
-                "location": row["location"]
-            }
-            for row in rows
-        ]
+        # The rows hold exactly the listed fields, add the URLs of the small
+        # variants of the image and serialize them as they are
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
 
         current_app.logger.debug(
             "Successfully processed all animal careneeders data")
 
-        response = make_response(jsonify(animal_careneeders))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
-        return response
+        return set_next_cursor(response, rows, limit)
     except Exception as e:
         current_app.logger.error(
             "Error fetching all animal careneeders", exc_info=True)
         return jsonify({"error": "Failed to fetch all animal careneeders"}), 500
 
 
+@animalcareneeder_bp.route("/search", methods=["GET"])
+@conditional("animalcareneederform")
+@cached("animalcareneederform")
+def search_animal_careneeders():
+    # Animal careneeders by district or around a point (see search_query in pagination.py)
+    try:
+        query, params, limit, nearest = search_query(
+            "animalcareneederform", ANIMAL_PROFILE_FILTERS, request.args, ANIMAL_CARENEEDER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        # Results around a point are the nearest ones, they have no next page
+        return set_next_cursor(response, rows, None if nearest else limit)
+    except Exception as e:
+        current_app.logger.error("Error searching animal careneeders", exc_info=True)
+        return jsonify({"error": "Failed to search animal careneeders"}), 500
+
+
 @animalcareneeder_bp.route('/all_animalcareneederschedule', methods=['GET'])
+@conditional("animalcareneederschedule")
+@cached("animalcareneederschedule")
+@streamable(ALL_SCHEDULES_QUERY)
 def get_all_animalcareneederschedule():
     current_app.logger.info(
         "Entering GET /all_animalcareneederschedule request")
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch careneederschedule data from the database
-        cursor.execute(
-            "SELECT * FROM animalcareneederschedule ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} animalcareneederschedule records from the database")
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch careneederschedule data from the database
+            cursor.execute(ALL_SCHEDULES_QUERY)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} animalcareneederschedule records from the database")
 
         if not rows:
             current_app.logger.warning(
                 "No animalcareneederschedule records found in the database")
             return jsonify({"error": "No animalcareneederschedule data available"}), 404
 
-        # Format the data for JSON
-
-        caregiverschedule = [dict(row) for row in rows]
-
         current_app.logger.debug(
             "Successfully processed all animalcareneederschedule data")
 
-        response = make_response(jsonify(caregiverschedule))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -352,44 +360,51 @@ def get_all_animalcareneederschedule():
 
 
 @animalcareneeder_bp.route('/all_animal_careneeders_details', methods=['GET'])
+@conditional("animalcareneeder")
+@cached("animalcareneeder")
+@streamable(ALL_DETAILS_QUERY)
 def get_all_animal_careneeders_details():
     current_app.logger.info(
         "---------------Entering GET /all_animal_careneeders details request")
     try:
-        # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch animal caregivers from the database
-        cursor.execute("SELECT * FROM animalcareneeder ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} animal careneeders details from the database")
+        if PG_JSON_LISTINGS:
+            # The body is built by the query (see pgjson.py)
+            query = aggregate_query(
+                f"SELECT {', '.join(json_columns(ANIMAL_CARENEEDER_DETAIL_FIELDS))} "
+                "FROM animalcareneeder ORDER BY id DESC")
+            with db_cursor(binary=True) as cursor:
+                cursor.execute(query)
+                body, count, _ = cursor.fetchone()
+                current_app.logger.debug(
+                    f"Fetched {count} animal careneeders details from the database")
+
+            if not count:
+                current_app.logger.warning(
+                    "No animal careneeders details found in the database")
+                return jsonify({"error": "Problem fetching animal careneeders details"}), 404
+
+            response = json_body_response(body, count, None, None)
+            response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+            response.headers['Pragma'] = 'no-cache'
+            return response
 
-        # Close the connection
-        cursor.close()
+        # Connect to the PostgreSQL database
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the listed fields of the animal careneeders details
+            cursor.execute(ALL_DETAILS_QUERY)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} animal careneeders details from the database")
 
         if not rows:
             current_app.logger.warning(
                 "No animal careneeders details found in the database")
             return jsonify({"error": "Problem fetching animal careneeders details"}), 404
 
-        # Directly convert the rows into JSON
-        animal_caregivers = [
-            {
-                "id": row["id"],
-                "animalcareneederid": row["animalcareneederid"],
-                "selectedservices": row["selectedservices"],
-                "selectedanimals": row["selectedanimals"],
-                "hourlycharge": row["hourlycharge"]
-            }
-            for row in rows
-        ]
-
         current_app.logger.debug(
             "Successfully processed all animal careneeders details data")
 
-        response = make_response(jsonify(animal_caregivers))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -401,30 +416,19 @@ def get_all_animal_careneeders_details():
 
 
 @animalcareneeder_bp.route('/all_animal_careneeder_ads', methods=['GET'])
+@conditional("animalcareneederads")
+@cached("animalcareneederads")
+@streamable(ALL_ADS_QUERY)
 def get_all_animal_careneeder_ads():
     try:
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Using the correct table name
-        cursor.execute("SELECT * FROM animalcareneederads ORDER BY id DESC")
-        rows = cursor.fetchall()
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(ALL_ADS_QUERY)
+            rows = cursor.fetchall()
 
         if not rows:
             return jsonify({"error": "No animal careneeder ads found"}), 404
 
-        animal_careneeder_ads = [
-            {
-                "id": row["id"],
-                "title": row["title"],
-                "description": row["description"],
-                "animalcareneederid": row["animalcareneederid"]
-            }
-            for row in rows
-        ]
-
-        response = make_response(jsonify(animal_careneeder_ads))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -433,36 +437,88 @@ def get_all_animal_careneeder_ads():
         return jsonify({"error": "Failed to fetch animal careneeder ads"}), 500
 
 
+@animalcareneeder_bp.route("/ad_cards", methods=["GET"])
+@conditional("animalcareneederads", "animalcareneederform", "animalcareneederschedule", "animalcareneeder")
+@cached("animalcareneederads", "animalcareneederform", "animalcareneederschedule", "animalcareneeder")
+def get_animal_careneeder_ad_cards():
+    # Ads with their animal careneeder, schedules and details, one page at a time (see adcards.py)
+    try:
+        limit, after_id = page_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cards, rows = ad_cards(
+                cursor, "animalcareneederads", "animalcareneederid", "animalcareneederform", ANIMAL_CARENEEDER_FIELDS,
+                {"schedules": ("animalcareneederschedule", "animalcareneederform_id", ["*"]),
+                 "details": ("animalcareneeder", "animalcareneederid", ANIMAL_CARENEEDER_DETAIL_FIELDS)},
+                limit, after_id)
+
+        response = make_response(jsonify(cards))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_next_cursor(response, rows, limit)
+    except Exception as e:
+        current_app.logger.error("Error fetching animal careneeder ad cards", exc_info=True)
+        return jsonify({"error": "Failed to fetch animal careneeder ad cards"}), 500
+
+
+@animalcareneeder_bp.route("/availability", methods=["GET"])
+@conditional("animalcareneederform", "animalcareneederschedule")
+@cached("animalcareneederform", "animalcareneederschedule")
+def get_available_animal_careneeders():
+    # Animal careneeders with a schedule in a window of dates, weekdays and hours,
+    # each with those schedules (see availability.py)
+    try:
+        window = availability_window(request.args)
+        limit, after_id = page_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            rows = available_profiles(
+                cursor, "animalcareneeder", "animalcareneederschedule", "animalcareneederform_id", "animalcareneederform", ANIMAL_CARENEEDER_FIELDS,
+                window, limit, after_id)
+
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_next_cursor(response, rows, limit)
+    except Exception as e:
+        current_app.logger.error("Error fetching available animal careneeders", exc_info=True)
+        return jsonify({"error": "Failed to fetch available animal careneeders"}), 500
+
+
 @animalcareneeder_bp.route("/myanimalcareneeder/<int:id>/ad", methods=["PUT"])
+@invalidates("animalcareneederads")
 def update_animalcareneeder_ad(id):
     current_app.logger.debug(f"Entering update_animalcareneeder for id {id}")
     try:
         data = request.get_json()
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Define the columns and values for the UPDATE query
-        columns = ["title", "description"]
-        values = [data.get(field, None) for field in columns]
+        with db_cursor() as cursor:
+            # Define the columns and values for the UPDATE query
+            columns = ["title", "description"]
+            values = [data.get(field, None) for field in columns]
 
-        current_app.logger.debug(f"Prepared values for SQL update: {values}")
+            current_app.logger.debug(f"Prepared values for SQL update: {values}")
 
-        # Construct the UPDATE query
-        update_query = "UPDATE animalcareneederads SET " + \
-            ', '.join([f"{col} = %s" for col in columns]) + \
-            f" WHERE animalcareneederid = {id}"
+            # Construct the UPDATE query
+            update_query = "UPDATE animalcareneederads SET " + \
+                ', '.join([f"{col} = %s" for col in columns]) + \
+                f" WHERE animalcareneederid = {id}"
 
-        # Execute the UPDATE query with the values
-        cursor.execute(update_query, values)
+            # Execute the UPDATE query with the values
+            cursor.execute(update_query, values)
 
-        current_app.logger.info(f"Received data: {data}")
-        current_app.logger.info(f"Executing query: {update_query}")
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            current_app.logger.info(f"Received data: {data}")
+            current_app.logger.info(f"Executing query: {update_query}")
 
         return jsonify({"success": "更新成功"}), 200
 
@@ -473,19 +529,15 @@ def update_animalcareneeder_ad(id):
 
 
 @animalcareneeder_bp.route("/all_animalcareneederform/<int:animalcareneederform_id>", methods=["GET"])
+@conditional("animalcareneederform")
 def get_animalcareneederform_detail(animalcareneederform_id):
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch the specific record from the animalcareneederform table using the id
-        cursor.execute(
-            "SELECT * FROM animalcareneederform WHERE id = %s", (animalcareneederform_id,))
-        row = cursor.fetchone()
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the specific record from the animalcareneederform table using the id
+            cursor.execute(
+                ANIMAL_CARENEEDER_BY_ID_QUERY, (animalcareneederform_id,), prepare=True)
+            row = cursor.fetchone()
 
         # Check if a record with the given id exists
         if not row:
@@ -512,19 +564,15 @@ def get_animalcareneederform_detail(animalcareneederform_id):
 
 
 @animalcareneeder_bp.route("/myanimalcareneederform/<phone>", methods=["GET"])
+@conditional("animalcareneederform")
 def get_myanimalcareneederform(phone):
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch the records related to the phone number from the animalcareneederform table
-        cursor.execute(
-            "SELECT * FROM animalcareneederform WHERE phone = %s ORDER BY id DESC", (phone,))
-        rows = cursor.fetchall()
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the records related to the phone number from the animalcareneederform table
+            cursor.execute(
+                ANIMAL_CARENEEDER_BY_PHONE_QUERY, (phone,), prepare=True)
+            rows = cursor.fetchall()
 
         if not rows:
             return jsonify({"error": "Animal Careneeder Forms not found"}), 404
@@ -1,17 +1,28 @@
-from psycopg2.extras import DictCursor  # Assuming you are using psycopg2
 from flask import Flask, g, request, jsonify
 from flask_cors import CORS
 import sys
-import boto3
-from werkzeug.utils import secure_filename
 import os
-from psycopg2.extras import DictCursor
+from psycopg.rows import dict_row
 import logging
 from flask import make_response
-import bcrypt
 from datetime import datetime
 import traceback
-from db import close_db, get_db
+from db import PoolTimeout, close_db, db_cursor, get_db_stats
+from pagination import (NEXT_BEFORE_HEADER, NEXT_CURSOR_HEADER, NEXT_SINCE_HEADER,
+                        message_query, set_message_cursor)
+from passwords import VerifierBusy, get_password_stats, verify_password
+from uploads import (UploadError, presign_upload, public_url, resolve_image_key,
+                     stream_upload, verify_upload)
+from thumbnails import get_thumbnail_stats, schedule_thumbnails
+from realtime import NEW_MESSAGE_EVENT, notify_query, socket_token, user_room
+import presence
+from cache import cached, get_cache_stats
+from matching import get_match_stats
+from etags import conditional
+from serialization import FastJSONProvider
+from batches import BatchError, batch_items
+from textsearch import (AD_TYPES, NEXT_SEARCH_HEADER, SNIPPET_LENGTH, highlight, search_query,
+                        set_search_cursor)
 from caregiver import caregiver_bp
 from careneeder import careneeder_bp
 from animalcaregiver import animalcaregiver_bp
@@ -28,8 +39,12 @@ logging.basicConfig(level=logging.INFO,
 logger = logging.getLogger(__name__)
 
 flask_app = Flask(__name__)
+flask_app.json = FastJSONProvider(flask_app)
 
-CORS(flask_app, resources={r"/*": {"origins": "*"}})
+# Paging headers readable by browsers; asgi.py exposes the same ones
+EXPOSE_HEADERS = [NEXT_CURSOR_HEADER, NEXT_SINCE_HEADER, NEXT_BEFORE_HEADER, NEXT_SEARCH_HEADER]
+
+CORS(flask_app, resources={r"/*": {"origins": "*"}}, expose_headers=EXPOSE_HEADERS)
 
 flask_app.logger.setLevel(logging.DEBUG)
 
@@ -50,24 +65,34 @@ flask_app.logger.addHandler(stream_handler)
 # flask_app.logger.addHandler(file_handler)
 
 
-s3 = boto3.client('s3', region_name='ap-east-1')
-
 flask_app.teardown_appcontext(close_db)
 
 
+@flask_app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    flask_app.logger.warning(f"Database pool exhausted: {e}")
+    return jsonify({"error": "Service busy, please retry"}), 503
+
+
 @flask_app.route('/status')
 def status():
     flask_app.logger.info('Status endpoint was called')
     return "Gunicorn is running good!", 200
 
 
+@flask_app.route('/metrics')
+def metrics():
+    return jsonify({"db_pool": get_db_stats(), "passwords": get_password_stats(),
+                    "thumbnails": get_thumbnail_stats(), "response_cache": get_cache_stats(),
+                    "matching": get_match_stats()})
+
+
 @flask_app.route("/test_connection")
 def test_connection():
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT * FROM caregivers")
-        results = cursor.fetchall()
+        with db_cursor() as cursor:
+            cursor.execute("SELECT * FROM caregivers")
+            results = cursor.fetchall()
         return jsonify({"status": "success", "message": "Connection to PostgreSQL database successful"})
     except Exception as e:
         return jsonify({"status": "error", "message": f"Failed to connect to PostgreSQL database: {str(e)}"})
@@ -88,31 +113,30 @@ def register():
         phone = data["phone"]
         passcode = data["passcode"]  # this is already hashed from the frontend
         name = data["name"]
-        imageurl = data["imageurl"]
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Check if the phone number already exists in the accounts table
-        cursor.execute("SELECT * FROM accounts WHERE phone = %s", (phone,))
-        existing_user = cursor.fetchone()
-        if existing_user:
-            return jsonify({"error": "手机号已被注册"}), 400
-
-        # Insert the new account into the database
-        createtime = datetime.now()
-        cursor.execute("INSERT INTO accounts (phone, passcode, name, imageurl, createtime) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                       (phone, passcode, name, imageurl, createtime))
-        new_user_id = cursor.fetchone()[0]
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+        with db_cursor() as cursor:
+            # Check if the phone number already exists in the accounts table
+            cursor.execute("SELECT 1 FROM accounts WHERE phone = %s", (phone,), prepare=True)
+            existing_user = cursor.fetchone()
+            if existing_user:
+                return jsonify({"error": "手机号已被注册"}), 400
+
+            # imageurl, or the image_key of a completed upload
+            resolve_image_key(cursor, data)
+            imageurl = data["imageurl"]
+
+            # Insert the new account into the database
+            createtime = datetime.now()
+            cursor.execute("INSERT INTO accounts (phone, passcode, name, imageurl, createtime) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                           (phone, passcode, name, imageurl, createtime))
+            new_user_id = cursor.fetchone()[0]
 
         # Return success response
         return jsonify({"success": True, "message": "创建账号成功!", "id": new_user_id}), 201
 
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         flask_app.logger.info(
             f"Error registering user: {str(e)}", exc_info=True)
@@ -124,25 +148,29 @@ def sign_in():
     phone = request.json['phone']
     passcode = request.json['passcode']
 
-    conn = get_db()  # Connection details
-    cursor = conn.cursor()
-
-    # Fetch the hashed passcode and other details from the database
-    cursor.execute(
-        "SELECT id, phone, passcode, createtime, name, imageurl FROM accounts WHERE phone = %s", (phone,))
-    result = cursor.fetchone()
+    with db_cursor() as cursor:
+        # Fetch the hashed passcode and other details from the database
+        cursor.execute(
+            "SELECT id, phone, passcode, createtime, name, imageurl FROM accounts WHERE phone = %s", (phone,), prepare=True)
+        result = cursor.fetchone()
 
     if result:
         id, phone, hashed_passcode, createtime, name, imageurl = result
-        # Verify the hashed passcode
-        if bcrypt.checkpw(passcode.encode('utf-8'), hashed_passcode.encode('utf-8')):
+        # Verify the hashed passcode on the bcrypt worker pool
+        try:
+            valid = verify_password(passcode, hashed_passcode)
+        except VerifierBusy:
+            return jsonify(success=False, message='服务繁忙，请稍后再试'), 503
 
-            # Update the last_seen timestamp to the current time
-            cursor.execute(
-                "UPDATE accounts SET last_seen=NOW() WHERE id=%s", (id,))
-            conn.commit()
+        if valid:
+
+            # Mark the user online, last_seen is written by the next batched
+            # presence flush
+            presence.touch(phone)
 
-            return jsonify(success=True, user={
+            # The client authenticates its Socket.IO connection with it (see
+            # realtime.py)
+            return jsonify(success=True, socket_token=socket_token(phone), user={
                 "id": id,
                 "phone": phone,
                 # Format to a string representation
@@ -164,52 +192,282 @@ def users_status():
     if not phone_numbers:  # Check if phone_numbers list is empty
         return jsonify({}), 200  # Return an empty JSON
 
-    conn = get_db()
-    cursor = conn.cursor()
+    # Answered from the in-memory presence tracker, no database query
+    return jsonify(presence.statuses(phone_numbers)), 200
 
-    # Use the IN clause to match multiple phone numbers
-    placeholders = ', '.join(['%s'] * len(phone_numbers))
-    query = f"SELECT phone, last_seen FROM accounts WHERE phone IN ({placeholders})"
-    cursor.execute(query, tuple(phone_numbers))
-    results = cursor.fetchall()
 
-    online_statuses = {}
-    for phone, last_seen in results:
-        is_online = False
-        if last_seen:
-            time_diff = datetime.now() - last_seen
-            is_online = time_diff.total_seconds() < 10*60
-        online_statuses[phone] = is_online
+@flask_app.route('/api/heartbeat', methods=['POST'])
+def heartbeat():
+    # Sent periodically by clients that are not connected over Socket.IO
+    phone = (request.get_json(silent=True) or {}).get('phone')
+    if not phone:
+        return jsonify({"error": "phone is required"}), 400
 
-    return jsonify(online_statuses), 200
+    presence.touch(phone)
+    return '', 204
 
 
 @flask_app.route('/api/upload', methods=['POST'])
 def upload_file():
     try:
-        if 'file' not in request.files:
-            return jsonify({"error": "No file part"}), 400
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "No selected file"}), 400
-        if file:
-            filename = secure_filename(file.filename)
-            tmp_filepath = os.path.join('/tmp', filename)
-            file.save(tmp_filepath)
-            response = s3.upload_file(
-                tmp_filepath, 'alex-chen-images', filename)
-            url = f"https://alex-chen-images.s3.ap-east-1.amazonaws.com/{filename}"
-            # Cleanup temp file
-            os.remove(tmp_filepath)
-            return jsonify({"url": url})
+        # The body is streamed to S3 as it is read, request.files must not be
+        # touched here since that would buffer the whole upload first
+        key, content_type = stream_upload(request.headers.get('Content-Type', ''), request.stream)
+        url = public_url(key)
+
+        # Record it so that the key can be passed as image_key
+        with db_cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO uploads (key, content_type, status, url, completed_at) VALUES (%s, %s, 'complete', %s, NOW()) ON CONFLICT (key) DO NOTHING",
+                (key, content_type, url))
+
+        # Small variants for the listings are made in the background
+        schedule_thumbnails(key)
+
+        return jsonify({"url": url, "key": key})
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         # You can log the exception for debugging
         logger.error("File upload failed", exc_info=True)
         return jsonify({"error": "File upload failed"}), 500
 
 
+# Direct to S3 uploads: the client asks for a presigned request, sends the
+# image to the bucket itself and then reports the key back
+@flask_app.route('/api/upload/presign', methods=['POST'])
+def presign_image_upload():
+    try:
+        data = request.get_json()
+        presigned = presign_upload(data.get("content_type"), data.get("size"),
+                                   data.get("method", "POST").upper())
+
+        with db_cursor() as cursor:
+            cursor.execute("INSERT INTO uploads (key, content_type) VALUES (%s, %s)",
+                           (presigned["key"], data["content_type"]))
+
+        return jsonify(presigned), 201
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Presigning upload failed", exc_info=True)
+        return jsonify({"error": "Presigning upload failed"}), 500
+
+
+@flask_app.route('/api/upload/complete', methods=['POST'])
+def complete_image_upload():
+    try:
+        key = request.get_json().get("key")
+        if not key:
+            return jsonify({"error": "key is required"}), 400
+
+        with db_cursor() as cursor:
+            cursor.execute("SELECT content_type, status, url FROM uploads WHERE key = %s",
+                           (key,), prepare=True)
+            upload = cursor.fetchone()
+            if upload is None:
+                return jsonify({"error": "Unknown upload"}), 404
+
+            content_type, status, url = upload
+            if status != 'complete':
+                size = verify_upload(key, content_type)
+                url = public_url(key)
+                cursor.execute(
+                    "UPDATE uploads SET status = 'complete', size = %s, url = %s, completed_at = NOW() WHERE key = %s",
+                    (size, url, key))
+                schedule_thumbnails(key)
+
+        return jsonify({"key": key, "url": url})
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Completing upload failed", exc_info=True)
+        return jsonify({"error": "Completing upload failed"}), 500
+
+
 # Chatwindow endpoint for messages
 
+# The chat queries and payload helpers are shared with the async entry point
+# in asgi.py
+
+# Define the mandatory fields required
+MESSAGE_MANDATORY_FIELDS = ["sender_id", "recipient_id",
+                            "content", "ad_id", "ably_message_id"]
+
+FIND_CONVERSATION_QUERY = """SELECT id FROM conversations WHERE (user1_phone = %s AND user2_phone = %s) 
+                   OR (user1_phone = %s AND user2_phone = %s)"""
+
+# A conversation created concurrently by the other participant is returned
+# instead (see migrations/007_message_ingest.sql)
+CREATE_CONVERSATION_QUERY = """INSERT INTO conversations (user1_phone, user2_phone) VALUES (%s, %s)
+                   ON CONFLICT (LEAST(user1_phone, user2_phone), GREATEST(user1_phone, user2_phone))
+                   DO UPDATE SET user1_phone = conversations.user1_phone RETURNING id"""
+
+# Returns no row when the Ably message was stored already
+INSERT_MESSAGE_QUERY = """INSERT INTO messages (sender_id, recipient_id, content, ad_id, ad_type, createtime, conversation_id, ably_message_id)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                   ON CONFLICT (ably_message_id) DO NOTHING RETURNING id"""
+
+FIND_MESSAGE_QUERY = "SELECT id, conversation_id FROM messages WHERE ably_message_id = %s"
+
+# One row per participant and (conversation, ad), kept up to date by
+# handle_message in the same transaction as the message itself, so the inbox is
+# a range scan on (owner_phone, last_createtime) instead of an aggregate over
+# every message of the user. ad_type is stored as '' when there is none so
+# that it can be part of the key.
+UPSERT_SUMMARY_QUERY = """
+        INSERT INTO conversation_summaries AS s (owner_phone, other_user_phone, conversation_id, ad_id,
+            ad_type, last_message_id, last_message, last_createtime, unread_count)
+        VALUES (%s, %s, %s, %s, COALESCE(%s, ''), %s, %s, %s, 0),
+               (%s, %s, %s, %s, COALESCE(%s, ''), %s, %s, %s, 1)
+        ON CONFLICT (owner_phone, conversation_id, ad_id, ad_type) DO UPDATE SET
+            last_message_id = GREATEST(s.last_message_id, EXCLUDED.last_message_id),
+            last_message = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+                THEN EXCLUDED.last_message ELSE s.last_message END,
+            last_createtime = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+                THEN EXCLUDED.last_createtime ELSE s.last_createtime END,
+            unread_count = s.unread_count + EXCLUDED.unread_count
+        """
+
+LIST_CONVERSATIONS_QUERY = """
+        SELECT
+            s.conversation_id,
+            s.other_user_phone,
+            a.name,
+            a.imageurl,
+            s.last_message AS lastMessage,
+            s.last_createtime AS timestamp,
+            s.ad_id,
+            NULLIF(s.ad_type, '') AS ad_type,
+            s.unread_count
+        FROM conversation_summaries s
+        LEFT JOIN accounts a ON a.phone = s.other_user_phone
+        WHERE s.owner_phone = %s
+        ORDER BY s.last_createtime DESC
+        """
+
+# Batched ingest (POST /api/handle_message/batch). Finds or creates the
+# conversations of every pair of phones in the batch in one statement. Rows
+# created by a concurrent transaction after this statement started are
+# neither created nor returned, the caller asks again for those.
+RESOLVE_CONVERSATIONS_QUERY = """
+        WITH pairs AS (
+            SELECT DISTINCT LEAST(a, b) AS low, GREATEST(a, b) AS high
+            FROM unnest(%s::text[], %s::text[]) AS t (a, b)
+        ), created AS (
+            INSERT INTO conversations (user1_phone, user2_phone)
+            SELECT low, high FROM pairs
+            ON CONFLICT (LEAST(user1_phone, user2_phone), GREATEST(user1_phone, user2_phone)) DO NOTHING
+            RETURNING id, user1_phone AS low, user2_phone AS high
+        )
+        SELECT id, low, high FROM created
+        UNION ALL
+        SELECT c.id, p.low, p.high FROM pairs p
+        JOIN conversations c ON LEAST(c.user1_phone, c.user2_phone) = p.low
+                            AND GREATEST(c.user1_phone, c.user2_phone) = p.high
+        """
+
+# Inserts the messages with one multi-row statement, skipping the Ably
+# message ids stored already, and updates the inbox entries of everything
+# inserted the way UPSERT_SUMMARY_QUERY does for a single message
+INGEST_MESSAGES_QUERY = """
+        WITH inserted AS (
+            INSERT INTO messages (sender_id, recipient_id, content, ad_id, ad_type, createtime,
+                conversation_id, ably_message_id)
+            SELECT * FROM unnest(%s::text[], %s::text[], %s::text[], %s::int[], %s::text[],
+                                 %s::timestamp[], %s::int[], %s::text[])
+            ON CONFLICT (ably_message_id) DO NOTHING
+            RETURNING id, sender_id, recipient_id, content, ad_id, ad_type, createtime,
+                conversation_id, ably_message_id
+        ), summaries AS (
+            INSERT INTO conversation_summaries AS s (owner_phone, other_user_phone, conversation_id,
+                ad_id, ad_type, last_message_id, last_message, last_createtime, unread_count)
+            SELECT p.owner_phone, (array_agg(p.other_user_phone ORDER BY i.id DESC))[1],
+                   i.conversation_id, i.ad_id, COALESCE(i.ad_type, ''), max(i.id),
+                   (array_agg(i.content ORDER BY i.id DESC))[1],
+                   (array_agg(i.createtime ORDER BY i.id DESC))[1],
+                   sum(p.unread)
+            FROM inserted i
+            CROSS JOIN LATERAL (VALUES (i.sender_id, i.recipient_id, 0),
+                                       (i.recipient_id, i.sender_id, 1))
+                AS p (owner_phone, other_user_phone, unread)
+            GROUP BY p.owner_phone, i.conversation_id, i.ad_id, COALESCE(i.ad_type, '')
+            ON CONFLICT (owner_phone, conversation_id, ad_id, ad_type) DO UPDATE SET
+                last_message_id = GREATEST(s.last_message_id, EXCLUDED.last_message_id),
+                last_message = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+                    THEN EXCLUDED.last_message ELSE s.last_message END,
+                last_createtime = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+                    THEN EXCLUDED.last_createtime ELSE s.last_createtime END,
+                unread_count = s.unread_count + EXCLUDED.unread_count
+        )
+        SELECT id, ably_message_id FROM inserted
+        """
+
+FIND_MESSAGES_QUERY = """SELECT id, conversation_id, ably_message_id FROM messages
+                   WHERE ably_message_id = ANY(%s::text[])"""
+
+MARK_READ_QUERY = """UPDATE conversation_summaries SET unread_count = 0
+                   WHERE owner_phone = %s AND conversation_id = %s AND ad_id = %s AND ad_type = COALESCE(%s, '')"""
+
+
+def message_values(data, createtime, conversation_id):
+    return [
+        data["sender_id"],
+        data["recipient_id"],
+        data["content"],
+        data["ad_id"],  # This field is now mandatory
+        data.get("ad_type", None),  # Optional field
+        createtime,
+        conversation_id,
+        data["ably_message_id"]
+    ]
+
+
+def summary_values(data, createtime, conversation_id, new_message_id):
+    # The sender's row (read) followed by the recipient's row (one more unread)
+    message = [conversation_id, data["ad_id"], data.get("ad_type", None),
+               new_message_id, data["content"], createtime]
+    return ([data["sender_id"], data["recipient_id"]] + message +
+            [data["recipient_id"], data["sender_id"]] + message)
+
+
+def push_query(data, createtime, new_message_id, conversation_id):
+    # Socket.IO push of the new message to the recipient, sent on commit
+    message = {**new_message_json(data, new_message_id, conversation_id),
+               "createtime": createtime}
+    return notify_query(user_room(data["recipient_id"]), NEW_MESSAGE_EVENT, message)
+
+
+def new_message_json(data, new_message_id, conversation_id):
+    # Create the returned object based on the interface
+    new_messages = {
+        "id": new_message_id,
+        "conversation_id": conversation_id
+    }
+
+    # Include columns in the return object if they exist
+    for column in MESSAGE_MANDATORY_FIELDS + ["ad_type", "createtime"]:
+        if column in data:
+            new_messages[column] = data[column]
+
+    new_messages["ably_message_id"] = data["ably_message_id"]
+    return new_messages
+
+
+def conversations_json(rows):
+    return [{
+        "conversation_id": row[0],
+        "other_user_phone": row[1],
+        "name": row[2],
+        "profileImage": row[3],
+        "lastMessage": row[4],
+        "timestamp": str(row[5]),  # Convert datetime object to string
+        "ad_id": row[6],
+        "ad_type": row[7],
+        "unread_count": row[8]
+    } for row in rows]
+
+
 @flask_app.route("/api/handle_message", methods=['POST'])
 def handle_message():
     try:
@@ -220,78 +478,166 @@ def handle_message():
             return jsonify(success=False, message="Invalid data format"), 400
 
         data = request.json
-        flask_app.logger.info(f"Input Data: {data}")
-
-        # Define the mandatory fields required
-        mandatory_fields = ["sender_id", "recipient_id",
-                            "content", "ad_id", "ably_message_id"]
+        flask_app.logger.debug(f"Input Data: {data}")
 
         # Check if necessary data is provided
-        if not all(data.get(field) for field in mandatory_fields):
+        if not all(data.get(field) for field in MESSAGE_MANDATORY_FIELDS):
             return jsonify(success=False, message="Missing required data"), 400
 
         # Get current timestamp
         createtime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
         # Connect to the database
-        conn = get_db()
-        cur = conn.cursor()
-
-        # Step 1: Find or Create Conversation
-        query = """SELECT id FROM conversations WHERE (user1_phone = %s AND user2_phone = %s) 
-                   OR (user1_phone = %s AND user2_phone = %s)"""
-        cur.execute(query, (data["sender_id"], data["recipient_id"],
-                    data["recipient_id"], data["sender_id"]))
-        conversation = cur.fetchone()
-
-        if conversation is None:
-            # Create a new conversation
-            cur.execute(
-                "INSERT INTO conversations (user1_phone, user2_phone) VALUES (%s, %s) RETURNING id",
-                (data["sender_id"], data["recipient_id"])
-            )
-            conversation_id = cur.fetchone()[0]
-        else:
-            conversation_id = conversation[0]
-
-        # Step 2: Insert the message with conversation_id
-        query = """INSERT INTO messages (sender_id, recipient_id, content, ad_id, ad_type, createtime, conversation_id, ably_message_id)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id"""
-
-        values = [
-            data["sender_id"],
-            data["recipient_id"],
-            data["content"],
-            data["ad_id"],  # This field is now mandatory
-            data.get("ad_type", None),  # Optional field
-            createtime,
-            conversation_id,
-            data["ably_message_id"]
-        ]
-
-        # Execute the query
-        cur.execute(query, values)
-        new_message_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
+        with db_cursor() as cur:
+            # Step 1: Find or Create Conversation
+            cur.execute(FIND_CONVERSATION_QUERY, (data["sender_id"], data["recipient_id"],
+                        data["recipient_id"], data["sender_id"]))
+            conversation = cur.fetchone()
+
+            if conversation is None:
+                # Create a new conversation
+                cur.execute(CREATE_CONVERSATION_QUERY,
+                            (data["sender_id"], data["recipient_id"]))
+                conversation_id = cur.fetchone()[0]
+            else:
+                conversation_id = conversation[0]
+
+            # Step 2: Insert the message with conversation_id
+            cur.execute(INSERT_MESSAGE_QUERY,
+                        message_values(data, createtime, conversation_id))
+            inserted = cur.fetchone()
+
+            if inserted is None:
+                # A retry of a message that is stored already
+                cur.execute(FIND_MESSAGE_QUERY, (data["ably_message_id"],), prepare=True)
+                new_message_id, conversation_id = cur.fetchone()
+            else:
+                new_message_id = inserted[0]
+
+                # Step 3: Update both participants' inbox entries
+                cur.execute(UPSERT_SUMMARY_QUERY,
+                            summary_values(data, createtime, conversation_id, new_message_id),
+                            prepare=True)
+
+                # Step 4: Push it to the recipient's sockets once committed
+                cur.execute(*push_query(data, createtime, new_message_id, conversation_id))
 
         flask_app.logger.info("Database query executed successfully")
 
-        # Create the returned object based on the interface
-        new_messages = {
-            "id": new_message_id,
-            "conversation_id": conversation_id
-        }
+        return (jsonify(new_message_json(data, new_message_id, conversation_id)),
+                201 if inserted else 200)
+
+    except Exception as e:
+        traceback_str = traceback.format_exc()
+        flask_app.logger.error(
+            f"Error occurred: {e}\nTraceback:\n{traceback_str}")
+        return jsonify(success=False, message="An error occurred while processing the request"), 500
 
-        # Include columns in the return object if they exist
-        for column in mandatory_fields + ["ad_type", "createtime"]:
-            if column in data:
-                new_messages[column] = data[column]
 
-        new_messages["ably_message_id"] = data["ably_message_id"]
+def resolve_conversations(cur, pairs):
+    # {(low phone, high phone): conversation id} for the given sender and
+    # recipient pairs, creating the missing conversations
+    senders = [sender for sender, _ in pairs]
+    recipients = [recipient for _, recipient in pairs]
+    conversations = {}
+    # The second round only happens when a concurrent transaction created
+    # some of the conversations
+    for _ in range(2):
+        cur.execute(RESOLVE_CONVERSATIONS_QUERY, (senders, recipients))
+        conversations.update({(low, high): id for id, low, high in cur.fetchall()})
+        if len(conversations) == len({tuple(sorted(pair)) for pair in pairs}):
+            break
+    return conversations
+
+
+@flask_app.route("/api/handle_message/batch", methods=['POST'])
+def handle_messages_batch():
+    # Many messages at once, for webhooks and offline sync replays. Takes a
+    # JSON array of handle_message bodies (or {"messages": [...]}) and answers
+    # with one result per message, in order: its id and conversation_id
+    # ("duplicate": true when the Ably message was stored already) or an error.
+    try:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get("messages")
+        items = batch_items(data)
 
-        return jsonify(new_messages), 201
+        # Get current timestamp
+        createtime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
+        results = [None] * len(items)
+        # (index, message, pair of phones, ad_id) of the messages to insert,
+        # one per Ably message id
+        new = {}
+        for index, message in enumerate(items):
+            if not isinstance(message, dict) or not all(message.get(field) for field in MESSAGE_MANDATORY_FIELDS):
+                results[index] = {"error": "Missing required data"}
+                continue
+            try:
+                ad_id = int(message["ad_id"])
+            except (TypeError, ValueError):
+                results[index] = {"error": "Invalid ad_id"}
+                continue
+            new.setdefault(str(message["ably_message_id"]),
+                           (index, message, (str(message["sender_id"]), str(message["recipient_id"])), ad_id))
+
+        # Ably message id -> (message id, conversation id)
+        found = {}
+        inserted = set()
+        if new:
+            with db_cursor() as cur:
+                conversations = resolve_conversations(cur, [pair for _, _, pair, _ in new.values()])
+                conversation_ids = [conversations[tuple(sorted(pair))] for _, _, pair, _ in new.values()]
+
+                cur.execute(INGEST_MESSAGES_QUERY, (
+                    [sender for _, _, (sender, _), _ in new.values()],
+                    [recipient for _, _, (_, recipient), _ in new.values()],
+                    [message["content"] for _, message, _, _ in new.values()],
+                    [ad_id for _, _, _, ad_id in new.values()],
+                    [message.get("ad_type") for _, message, _, _ in new.values()],
+                    [createtime] * len(new),
+                    conversation_ids,
+                    list(new),
+                ), prepare=True)
+                conversation_of = dict(zip(new, conversation_ids))
+                for message_id, ably_message_id in cur.fetchall():
+                    inserted.add(ably_message_id)
+                    found[ably_message_id] = (message_id, conversation_of[ably_message_id])
+
+                # Push the new messages to the recipients' sockets once committed
+                pushes = [push_query(message, createtime, *found[ably_message_id])[1]
+                          for ably_message_id, (_, message, _, _) in new.items()
+                          if ably_message_id in inserted]
+                if pushes:
+                    cur.executemany("SELECT pg_notify(%s, %s)", pushes)
+
+                duplicates = [ably_message_id for ably_message_id in new if ably_message_id not in inserted]
+                if duplicates:
+                    cur.execute(FIND_MESSAGES_QUERY, (duplicates,), prepare=True)
+                    found.update({ably_message_id: (message_id, conversation_id)
+                                  for message_id, conversation_id, ably_message_id in cur.fetchall()})
+
+        for index, message in enumerate(items):
+            if results[index] is not None:
+                continue
+            ably_message_id = str(message["ably_message_id"])
+            message_id, conversation_id = found[ably_message_id]
+            results[index] = {"id": message_id, "conversation_id": conversation_id,
+                              "ably_message_id": ably_message_id}
+            # Stored before, or repeated within this batch
+            if ably_message_id not in inserted or new[ably_message_id][0] != index:
+                results[index]["duplicate"] = True
+
+        counts = {"inserted": len(inserted),
+                  "duplicates": sum(1 for result in results if result.get("duplicate")),
+                  "rejected": sum(1 for result in results if "error" in result)}
+        flask_app.logger.info(f"Ingested a batch of {len(items)} messages: {counts}")
+
+        status = 201 if inserted else 200 if counts["duplicates"] else 400
+        return jsonify({"results": results, **counts}), status
+
+    except BatchError as e:
+        return jsonify(success=False, message=str(e)), 400
     except Exception as e:
         traceback_str = traceback.format_exc()
         flask_app.logger.error(
@@ -309,17 +655,26 @@ def fetch_messages_chatwindow():
     if not sender_id or not recipient_id or not ad_id or not ad_type:
         return jsonify({'error': 'sender_id, recipient_id, ad_id, and ad_type are required'}), 400
 
+    # The conversation of the pair lets the (conversation_id, ad_id, id) index
+    # serve the since_id / before_id windows (see pagination.py)
+    select = """SELECT * FROM messages WHERE conversation_id IN (SELECT id FROM conversations
+               WHERE (user1_phone = %s AND user2_phone = %s) OR (user1_phone = %s AND user2_phone = %s))
+               AND ((sender_id = %s AND recipient_id = %s) OR (sender_id = %s AND recipient_id = %s)) 
+               AND ad_id = %s AND ad_type = %s"""
     try:
-        db = get_db()
-        cursor = db.cursor(cursor_factory=DictCursor)
-
-        query = """SELECT * FROM messages WHERE ((sender_id = %s AND recipient_id = %s) OR (sender_id = %s AND recipient_id = %s)) 
-           AND ad_id = %s AND ad_type = %s ORDER BY createtime ASC"""
+        query, params, limit, backwards = message_query(
+            select, (sender_id, recipient_id, recipient_id, sender_id) * 2 + (ad_id, ad_type),
+            request.args, "createtime ASC")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        cursor.execute(
-            query, (sender_id, recipient_id, recipient_id, sender_id, ad_id, ad_type))
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(query, params, prepare=True)
 
-        messages = cursor.fetchall()
+            messages = cursor.fetchall()
+            if backwards:
+                messages.reverse()
 
         if not messages:
             return jsonify([]), 200  # Empty list but still a valid request
@@ -328,12 +683,12 @@ def fetch_messages_chatwindow():
         messages_json = []
         for message in messages:
             message_obj = {
-                "id": message[0],
-                "sender_id": message[1],
-                "recipient_id": message[2],
-                "content": message[3],
-                "createtime": message[4],
-                "conversation_id": message[5],
+                "id": message["id"],
+                "sender_id": message["sender_id"],
+                "recipient_id": message["recipient_id"],
+                "content": message["content"],
+                "createtime": message["createtime"],
+                "conversation_id": message["conversation_id"],
                 "ad_id": ad_id,
                 "ad_type": ad_type
             }
@@ -342,77 +697,26 @@ def fetch_messages_chatwindow():
         response = make_response(jsonify(messages_json))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
-        return response
+        return set_message_cursor(response, messages, limit, backwards)
 
     except Exception as e:
         flask_app.logger.error(f"Error occurred: {e}")
         return jsonify({'error': 'An error occurred while processing the request'}), 500
 
-    finally:
-        if cursor:
-            cursor.close()
-
 
 @flask_app.route('/api/list_conversations', methods=['GET'])
 def list_conversations():
     try:
         user_phone = request.args.get('user_phone')
 
-        conn = get_db()
-        cur = conn.cursor()
-
-        # Adjusted SQL Query
-        query = """
-        SELECT 
-            c.id, 
-            CASE 
-                WHEN c.user1_phone = %s THEN c.user2_phone 
-                ELSE c.user1_phone 
-            END AS other_user_phone,
-            a.name, 
-            a.imageurl, 
-            m.content AS lastMessage, 
-            m.createtime AS timestamp,
-            m.ad_id,
-            m.ad_type 
-        FROM conversations c
-        LEFT JOIN accounts a ON a.phone = CASE 
-                WHEN c.user1_phone = %s THEN c.user2_phone 
-                ELSE c.user1_phone 
-            END
-        LEFT JOIN (
-            SELECT content, createtime, conversation_id, ad_id, ad_type
-            FROM messages 
-            WHERE (conversation_id, createtime, ad_type) IN (
-                SELECT conversation_id, MAX(createtime), ad_type 
-                FROM messages 
-                WHERE sender_id = %s OR recipient_id = %s
-                GROUP BY conversation_id, ad_id, ad_type
-            )
-        ) m ON m.conversation_id = c.id
-        WHERE c.user1_phone = %s OR c.user2_phone = %s 
-        ORDER BY m.createtime DESC;
-        """
-        cur.execute(query, (user_phone, user_phone, user_phone,
-                    user_phone, user_phone, user_phone))
+        with db_cursor() as cur:
+            cur.execute(LIST_CONVERSATIONS_QUERY, (user_phone,), prepare=True)
 
-        conversations = cur.fetchall()
-        cur.close()
+            conversations = cur.fetchall()
 
         # Serialize and return
-        conversations_list = [{
-            "conversation_id": row[0],
-            "other_user_phone": row[1],
-            "name": row[2],
-            "profileImage": row[3],
-            "lastMessage": row[4],
-            "timestamp": str(row[5]),  # Convert datetime object to string
-            "ad_id": row[6],
-            "ad_type": row[7]
-        } for row in conversations]
-
         response = make_response(
-            jsonify({"conversations": conversations_list}))
+            jsonify({"conversations": conversations_json(conversations)}))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -424,6 +728,25 @@ def list_conversations():
         return jsonify(success=False, message="An error occurred while processing the request"), 500
 
 
+@flask_app.route('/api/mark_read', methods=['POST'])
+def mark_read():
+    try:
+        data = request.get_json()
+        for field in ["user_phone", "conversation_id", "ad_id"]:
+            if field not in data:
+                return jsonify({"error": f"{field} is required"}), 400
+
+        with db_cursor() as cur:
+            cur.execute(MARK_READ_QUERY, (data["user_phone"], data["conversation_id"],
+                        data["ad_id"], data.get("ad_type")), prepare=True)
+
+        return jsonify(success=True), 200
+
+    except Exception as e:
+        flask_app.logger.error(f"Error occurred: {e}", exc_info=True)
+        return jsonify(success=False, message="An error occurred while processing the request"), 500
+
+
 # New endpoint for fetching messages based on conversation_id
 @flask_app.route('/api/fetch_messages_chat_conversation', methods=['GET'])
 def fetch_messages_chat_conversation():
@@ -440,13 +763,19 @@ def fetch_messages_chat_conversation():
         return jsonify({'error': 'Invalid conversation_id or ad_id'}), 400
 
     try:
-        db = get_db()
-        cursor = db.cursor(cursor_factory=DictCursor)
+        query, params, limit, backwards = message_query(
+            "SELECT * FROM messages WHERE conversation_id = %s AND ad_id = %s",
+            (conversation_id, ad_id), request.args, "id ASC")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        cursor.execute(
-            "SELECT * FROM messages WHERE conversation_id = %s AND ad_id = %s", (conversation_id, ad_id))
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(query, params, prepare=True)
 
-        messages = cursor.fetchall()
+            messages = cursor.fetchall()
+            if backwards:
+                messages.reverse()
 
         if not messages:
             return jsonify([]), 200  # Empty list but still a valid request
@@ -455,13 +784,13 @@ def fetch_messages_chat_conversation():
         messages_json = []
         for message in messages:
             message_obj = {
-                "id": message[0],
-                "sender_id": message[1],
-                "recipient_id": message[2],
-                "content": message[3],
-                "createtime": message[4],
-                "conversation_id": message[5],
-                "ad_id": message[6],
+                "id": message["id"],
+                "sender_id": message["sender_id"],
+                "recipient_id": message["recipient_id"],
+                "content": message["content"],
+                "createtime": message["createtime"],
+                "conversation_id": message["conversation_id"],
+                "ad_id": message["ad_id"],
                 "ably_message_id": message['ably_message_id']
             }
             messages_json.append(message_obj)
@@ -469,15 +798,42 @@ def fetch_messages_chat_conversation():
         response = make_response(jsonify(messages_json))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
-        return response
+        return set_message_cursor(response, messages, limit, backwards)
 
     except Exception as e:
         flask_app.logger.error(f"Error occurred: {e}")
         return jsonify({'error': 'An error occurred while processing the request'}), 500
 
-    finally:
-        if cursor:
-            cursor.close()
+
+@flask_app.route("/api/search_ads", methods=["GET"])
+@conditional(*AD_TYPES.values())
+@cached(*AD_TYPES.values())
+def search_ads():
+    # Ads of every blueprint (or those of ad_type) matching q, best first
+    # (see textsearch.py)
+    try:
+        query, params, limit, terms = search_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        for row in rows:
+            row["highlight"] = {
+                "title": highlight(row["title"], terms),
+                "description": highlight(row["description"], terms, SNIPPET_LENGTH),
+            }
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_search_cursor(response, rows, limit)
+    except Exception as e:
+        flask_app.logger.error("Error searching ads", exc_info=True)
+        return jsonify({"error": "Failed to search ads"}), 500
 
 
 # fetch the accounts data to the frontend
@@ -485,16 +841,12 @@ def fetch_messages_chat_conversation():
 def get_account(phone):
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch the account related to the phone number
-        cursor.execute(
-            "SELECT * FROM accounts WHERE phone = %s LIMIT 1", (phone,))
-        row = cursor.fetchone()
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row) as cursor:
+            # Fetch the account related to the phone number
+            cursor.execute(
+                "SELECT id, phone, passcode, createtime, name, imageurl FROM accounts WHERE phone = %s LIMIT 1",
+                (phone,), prepare=True)
+            row = cursor.fetchone()
 
         if not row:
             return jsonify({"error": "Account not found"}), 404
@@ -507,7 +859,6 @@ def get_account(phone):
             "name": row["name"],
             "imageurl": row["imageurl"]
         }
-        print(account)
 
         return jsonify(account)
     except Exception as e:
@@ -0,0 +1,262 @@
+# asgi.py
+# Async (ASGI) entry point. The chat endpoints and the profile listings are
+# served on an asyncio event loop with an async Postgres pool, so a slow query
+# only parks a coroutine instead of holding a whole worker. Every other route
+# is forwarded to the Flask app, which runs in a thread pool.
+#
+#   gunicorn -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8000 asgi:asgi_app
+import logging
+import socketio
+import traceback
+from contextlib import asynccontextmanager
+from datetime import datetime
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from app import (flask_app, EXPOSE_HEADERS, MESSAGE_MANDATORY_FIELDS, FIND_CONVERSATION_QUERY,
+                 CREATE_CONVERSATION_QUERY, INSERT_MESSAGE_QUERY, FIND_MESSAGE_QUERY,
+                 LIST_CONVERSATIONS_QUERY, UPSERT_SUMMARY_QUERY, message_values,
+                 summary_values, push_query, new_message_json, conversations_json)
+from db import async_pool_config, db_config, get_db_stats
+from matching import get_match_stats
+from passwords import get_password_stats
+from pgjson import PG_JSON_LISTINGS
+from thumbnails import get_thumbnail_stats, thumbnail_urls
+from realtime import sio
+from serialization import dumps
+import notifications
+from cache import CACHE_STATUS_HEADER, CACHED_HEADERS, cache_key, get_cache_stats, response_cache
+from etags import VERSIONS_QUERY, not_modified, set_validators, validators
+from pagination import (ANIMAL_PROFILE_FILTERS, CAREGIVER_FILTERS, CARENEEDER_FILTERS,
+                        page_query, set_next_cursor)
+from caregiver import CAREGIVER_FIELDS
+from careneeder import CARENEEDER_FIELDS
+from animalcaregiver import ANIMAL_CAREGIVER_FIELDS
+from animalcareneeder import ANIMAL_CARENEEDER_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Shares the connection budget of the process with db.db_pool, which the
+# forwarded Flask routes still use
+async_pool = AsyncConnectionPool(
+    kwargs=db_config, name="caregiver-async", open=False, **async_pool_config())
+
+NO_STORE_HEADERS = {
+    'Cache-Control': 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0',
+    'Pragma': 'no-cache',
+}
+
+
+def json_response(obj, status_code=200, headers=None):
+    # Same encoder (and so the same datetime/Decimal formatting) as jsonify
+    body = dumps(obj)
+    return Response(body, status_code, headers, media_type="application/json")
+
+
+async def metrics(request):
+    return json_response({"db_pool": get_db_stats(),
+                          "async_db_pool": async_pool.get_stats(),
+                          "passwords": get_password_stats(),
+                          "thumbnails": get_thumbnail_stats(),
+                          "response_cache": get_cache_stats(),
+                          "matching": get_match_stats()})
+
+
+async def handle_message(request):
+    try:
+        logger.info("Received a request to handle_message")
+
+        # Validate input data
+        if request.headers.get("content-type", "").split(";")[0] != "application/json":
+            return json_response({"success": False, "message": "Invalid data format"}, 400)
+
+        data = await request.json()
+
+        # Check if necessary data is provided
+        if not all(data.get(field) for field in MESSAGE_MANDATORY_FIELDS):
+            return json_response({"success": False, "message": "Missing required data"}, 400)
+
+        # Get current timestamp
+        createtime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        # Committed when the block exits, rolled back if it raises
+        async with async_pool.connection() as conn:
+            cur = conn.cursor()
+
+            # Step 1: Find or Create Conversation
+            await cur.execute(FIND_CONVERSATION_QUERY, (data["sender_id"], data["recipient_id"],
+                              data["recipient_id"], data["sender_id"]))
+            conversation = await cur.fetchone()
+
+            if conversation is None:
+                # Create a new conversation
+                await cur.execute(CREATE_CONVERSATION_QUERY,
+                                  (data["sender_id"], data["recipient_id"]))
+                conversation_id = (await cur.fetchone())[0]
+            else:
+                conversation_id = conversation[0]
+
+            # Step 2: Insert the message with conversation_id
+            await cur.execute(INSERT_MESSAGE_QUERY,
+                              message_values(data, createtime, conversation_id))
+            inserted = await cur.fetchone()
+
+            if inserted is None:
+                # A retry of a message that is stored already
+                await cur.execute(FIND_MESSAGE_QUERY, (data["ably_message_id"],), prepare=True)
+                new_message_id, conversation_id = await cur.fetchone()
+            else:
+                new_message_id = inserted[0]
+
+                # Step 3: Update both participants' inbox entries
+                await cur.execute(UPSERT_SUMMARY_QUERY,
+                                  summary_values(data, createtime, conversation_id, new_message_id),
+                                  prepare=True)
+
+                # Step 4: Push it to the recipient's sockets once committed
+                await cur.execute(*push_query(data, createtime, new_message_id, conversation_id))
+
+        return json_response(new_message_json(data, new_message_id, conversation_id),
+                             201 if inserted else 200)
+
+    except Exception as e:
+        traceback_str = traceback.format_exc()
+        logger.error(f"Error occurred: {e}\nTraceback:\n{traceback_str}")
+        return json_response({"success": False, "message": "An error occurred while processing the request"}, 500)
+
+
+async def list_conversations(request):
+    try:
+        user_phone = request.query_params.get('user_phone')
+
+        async with async_pool.connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(LIST_CONVERSATIONS_QUERY, (user_phone,), prepare=True)
+            conversations = await cur.fetchall()
+
+        return json_response({"conversations": conversations_json(conversations)},
+                             headers=NO_STORE_HEADERS)
+
+    except Exception as e:
+        traceback_str = traceback.format_exc()
+        logger.error(f"Error occurred: {e}\nTraceback:\n{traceback_str}")
+        return json_response({"success": False, "message": "An error occurred while processing the request"}, 500)
+
+
+def listing(table, filters, fields, label):
+    # Async version of the all_* profile listings of the blueprints, with the
+    # same paging contract (see pagination.py), the same response body and the
+    # same response cache (see cache.py)
+    async def endpoint(request):
+        try:
+            query, params, limit = page_query(table, filters, request.query_params, fields)
+        except ValueError as e:
+            return json_response({"error": str(e)}, 400)
+
+        notifications.start()
+        key = cache_key(request.url.path, request.query_params.multi_items())
+
+        # Conditional GET (see etags.py)
+        async with async_pool.connection() as conn:
+            cursor = conn.cursor()
+            await cursor.execute(VERSIONS_QUERY, ([table],), prepare=True)
+            versions = await cursor.fetchall()
+        etag = None
+        if versions:
+            etag, last_modified = validators(key, versions)
+            if not_modified(etag, last_modified, request.headers.get("if-none-match"),
+                            request.headers.get("if-modified-since")):
+                response = Response(status_code=304)
+                set_validators(response.headers, etag, last_modified)
+                return response
+
+        entry = response_cache.get(key)
+        if entry is not None:
+            status, headers, body = entry
+            response = Response(body, status, {**headers, CACHE_STATUS_HEADER: "HIT"})
+            if etag is not None:
+                set_validators(response.headers, etag, last_modified)
+            return response
+
+        generation = response_cache.generation((table,))
+        try:
+            async with async_pool.connection() as conn:
+                cursor = conn.cursor(row_factory=dict_row, binary=True)
+                await cursor.execute(query, params)
+                rows = await cursor.fetchall()
+
+            if not rows:
+                if limit is not None:
+                    return json_response([])
+                logger.warning(f"No {label} found in the database")
+                return json_response({"error": f"Problem of fetching {label}"}, 404)
+
+            for row in rows:
+                row["thumbnails"] = thumbnail_urls(row["imageurl"])
+            response = json_response(rows, headers=NO_STORE_HEADERS)
+            set_next_cursor(response, rows, limit)
+            response_cache.put(key, (table,), generation, response.status_code,
+                               {name: response.headers[name] for name in CACHED_HEADERS
+                                if name in response.headers},
+                               response.body)
+            response.headers[CACHE_STATUS_HEADER] = "MISS"
+            if etag is not None:
+                set_validators(response.headers, etag, last_modified)
+            return response
+        except Exception:
+            logger.error(f"Error fetching all {label}", exc_info=True)
+            return json_response({"error": f"Failed to fetch all {label}"}, 500)
+
+    return endpoint
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await async_pool.open()
+    yield
+    await async_pool.close()
+
+
+# With PG_JSON_LISTINGS the careneeder listing stays with Flask, which builds
+# its body in Postgres (see pgjson.py)
+CARENEEDER_LISTING = [] if PG_JSON_LISTINGS else [
+    Route("/api/careneeder/all_careneeders",
+          listing("careneeder", CARENEEDER_FILTERS, CARENEEDER_FIELDS, "careneeders"),
+          methods=["GET"]),
+]
+
+starlette_app = Starlette(
+    routes=[
+        Route("/metrics", metrics),
+        Route("/api/handle_message", handle_message, methods=["POST"]),
+        Route("/api/list_conversations", list_conversations, methods=["GET"]),
+        Route("/api/caregiver/all_caregivers",
+              listing("caregivers", CAREGIVER_FILTERS, CAREGIVER_FIELDS, "caregivers"),
+              methods=["GET"]),
+        *CARENEEDER_LISTING,
+        Route("/api/animalcaregiver/all_animalcaregivers",
+              listing("animalcaregiverform", ANIMAL_PROFILE_FILTERS,
+                      ANIMAL_CAREGIVER_FIELDS, "animal caregivers"),
+              methods=["GET"]),
+        Route("/api/animalcareneeder/all_animalcareneeders",
+              listing("animalcareneederform", ANIMAL_PROFILE_FILTERS,
+                      ANIMAL_CARENEEDER_FIELDS, "animal careneeders"),
+              methods=["GET"]),
+        # Everything else (including the POST side of the listings) is served by Flask
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"],
+                   allow_headers=["*"], expose_headers=EXPOSE_HEADERS),
+    ],
+    lifespan=lifespan,
+)
+
+# Socket.IO (see realtime.py) is served at /socket.io, everything else by the
+# Starlette app
+asgi_app = socketio.ASGIApp(sio, other_asgi_app=starlette_app)
@@ -0,0 +1,130 @@
+# availability.py
+# "Who is free on Tuesday mornings next month": the profiles with a schedule
+# in a window of dates, weekdays and hours, found through schedule_slots
+# (migrations/012_schedule_slots.sql) instead of every schedule. Parameters
+# of the /availability endpoints:
+#
+#   from, to   first and last date (ISO 8601), default today and `from`
+#   weekdays   mon, tue, ... sun, comma separated (default every day)
+#   slots      morning, afternoon, evening, overnight or hour ranges such as
+#              9-12, comma separated (default any hour)
+#
+# A schedule matches when its dates overlap the window and it shares at
+# least one weekday and one hour with it. Profiles come newest first and are
+# paged like the listings (limit, after_id and X-Next-After-Id, see
+# pagination.py), each with its matching schedules.
+from datetime import date, timedelta
+
+ALL_WEEKDAYS = (1 << 7) - 1
+ALL_HOURS = (1 << 24) - 1
+
+# Monday first, as bit 0 of weekday_mask
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# slot name -> hours [first, last)
+SLOTS = {
+    "overnight": (0, 6),
+    "morning": (6, 12),
+    "afternoon": (12, 18),
+    "evening": (18, 24),
+}
+
+MAX_WINDOW_DAYS = 366
+
+SLOTS_MATCH = """x.schedule_type = %s AND x.period && daterange(%s, %s, '[]')
+                 AND x.weekday_mask & %s <> 0 AND x.slot_mask & %s <> 0"""
+
+
+def hours_mask(first, last):
+    # Hours [first, last) as bits, wrapping past midnight, as in SQL
+    if last > first:
+        return (1 << last) - (1 << first)
+    return ((1 << 24) - (1 << first)) | ((1 << last) - 1)
+
+
+def _date(args, name, default):
+    if args.get(name, "") == "":
+        return default
+    try:
+        return date.fromisoformat(args[name])
+    except ValueError:
+        raise ValueError(f"Invalid value for {name}")
+
+
+def _names(args, name):
+    return [item.strip().lower() for item in args.get(name, "").split(",") if item.strip()]
+
+
+def availability_window(args):
+    # Returns (first, last, weekday_mask, slot_mask). Raises ValueError for
+    # malformed parameters.
+    first = _date(args, "from", date.today())
+    last = _date(args, "to", first)
+    if last < first:
+        raise ValueError("to must not be before from")
+    if (last - first).days >= MAX_WINDOW_DAYS:
+        raise ValueError(f"The window is limited to {MAX_WINDOW_DAYS} days")
+
+    weekdays = 0
+    for name in _names(args, "weekdays"):
+        if name[:3] not in WEEKDAYS:
+            raise ValueError(f"weekdays must be among {', '.join(WEEKDAYS)}")
+        weekdays |= 1 << WEEKDAYS.index(name[:3])
+    weekdays = weekdays or ALL_WEEKDAYS
+    # Windows shorter than a week only have some of the weekdays
+    if (last - first).days < 6:
+        present = 0
+        for offset in range((last - first).days + 1):
+            present |= 1 << (first + timedelta(days=offset)).weekday()
+        weekdays &= present
+        if not weekdays:
+            raise ValueError("None of the weekdays falls between from and to")
+
+    slots = 0
+    for name in _names(args, "slots"):
+        if name in SLOTS:
+            slots |= hours_mask(*SLOTS[name])
+            continue
+        try:
+            start, end = (int(hour) for hour in name.split("-"))
+        except ValueError:
+            raise ValueError(f"slots must be among {', '.join(SLOTS)} or hour ranges such as 9-12")
+        if not (0 <= start < 24 and 0 <= end <= 24 and start != end):
+            raise ValueError(f"Invalid hour range {name}")
+        slots |= hours_mask(start, end % 24)
+
+    return first, last, weekdays, slots or ALL_HOURS
+
+
+def available_profiles(cursor, schedule_type, schedules, fk, profiles, fields, window,
+                       limit, after_id=None):
+    # A page of the profiles with a schedule matching window (see
+    # availability_window), each with those schedules under "schedules".
+    # cursor must return dict rows. fk is the column of `schedules` holding
+    # the profile id.
+    match = [schedule_type, *window]
+    query = (f"SELECT {', '.join(fields)} FROM {profiles} WHERE id IN "
+             f"(SELECT x.profile_id FROM schedule_slots x WHERE {SLOTS_MATCH})")
+    params = list(match)
+    if after_id is not None:
+        query += " AND id < %s"
+        params.append(after_id)
+    query += " ORDER BY id DESC LIMIT %s"
+    params.append(limit)
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    if not rows:
+        return rows
+
+    cursor.execute(
+        f"SELECT s.* FROM {schedules} s "
+        "JOIN schedule_slots x ON x.schedule_id = s.id "
+        f"WHERE {SLOTS_MATCH} AND x.profile_id = ANY(%s) ORDER BY s.id DESC",
+        [*match, [row["id"] for row in rows]])
+    found = {}
+    for schedule in cursor.fetchall():
+        found.setdefault(schedule[fk], []).append(schedule)
+
+    for row in rows:
+        row["schedules"] = found.get(row["id"], [])
+    return rows
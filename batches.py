@@ -0,0 +1,96 @@
+# batches.py
+# Batch variants of the create endpoints, for importers. The body is a JSON
+# array of the objects the single endpoint takes. Every item is validated on
+# its own, the valid ones are inserted in one transaction by one pipelined
+# executemany, and the response lists, in request order, the new id of each
+# item or why it was rejected:
+#
+#   {"results": [{"id": 41}, {"error": "name is required"}, {"id": 42}],
+#    "inserted": 2, "rejected": 1}
+#
+# The status is 201 when anything was inserted, 400 otherwise. An error
+# raised by the database (a value of the wrong type, a constraint) rolls back
+# the whole batch.
+import os
+
+from flask import jsonify
+
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 5000))
+
+
+class BatchError(ValueError):
+    # The request as a whole is unusable
+    pass
+
+
+def batch_items(data):
+    if not isinstance(data, list):
+        raise BatchError("Expected a JSON array")
+    if not data:
+        raise BatchError("The batch is empty")
+    if len(data) > MAX_BATCH_SIZE:
+        raise BatchError(f"At most {MAX_BATCH_SIZE} items per batch")
+    return data
+
+
+def reference_id(value):
+    # An id as the single endpoints take it: a number, or a string Postgres
+    # reads as one ("12"). None otherwise.
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    return None
+
+
+def existing_ids(cursor, table, items, field):
+    # The ids among items[*][field] that exist in table, for validating
+    # references in one query. Compare reference_id(item[field]) against it.
+    ids = {reference_id(item.get(field)) for item in items if isinstance(item, dict)}
+    ids.discard(None)
+    cursor.execute(f"SELECT id FROM {table} WHERE id = ANY(%s)", (list(ids),))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def insert_rows(cursor, table, columns, rows):
+    # Ids of the inserted rows, in the order of rows
+    if not rows:
+        return []
+    cursor.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) RETURNING id",
+        rows, returning=True)
+    ids = [cursor.fetchone()[0]]
+    while cursor.nextset():
+        ids.append(cursor.fetchone()[0])
+    return ids
+
+
+def insert_batch(cursor, table, columns, items, values):
+    # values(item) returns the values of columns for an item or raises
+    # ValueError with the message for the client. Returns the results list.
+    results = []
+    rows = []
+    for item in items:
+        if not isinstance(item, dict):
+            results.append({"error": "Expected a JSON object"})
+            continue
+        try:
+            rows.append(values(item))
+            results.append(None)
+        except ValueError as e:
+            results.append({"error": str(e)})
+
+    ids = iter(insert_rows(cursor, table, columns, rows))
+    return [{"id": next(ids)} if result is None else result for result in results]
+
+
+def batch_response(results):
+    inserted = sum(1 for result in results if "id" in result)
+    body = {"results": results, "inserted": inserted, "rejected": len(results) - inserted}
+    return jsonify(body), 201 if inserted else 400
@@ -0,0 +1,95 @@
+# bench/ad_search_latency.py
+# Latency of /api/search_ads over a synthetic corpus of BENCH_ADS ads (one
+# million by default), for queries from common to rare words, CJK and
+# English: the query of textsearch.search_query plus the highlighting the
+# endpoint does, first page and BENCH_PAGES pages deep.
+#
+# The ads are copied into ad_search alone (migrations/010_ad_search.sql),
+# with no ads table rows behind them, and are tagged profile_id = -1: clean
+# up with DELETE FROM ad_search WHERE profile_id = -1. BENCH_SEED=0 reuses
+# the ones of an earlier run.
+#
+#   python bench/ad_search_latency.py
+import os
+import random
+
+from common import connect, copy_rows, report, timed
+
+from psycopg.rows import dict_row
+
+from textsearch import SNIPPET_LENGTH, highlight, search_query
+
+ADS = int(os.environ.get("BENCH_ADS", 1000000))
+SEED = os.environ.get("BENCH_SEED", "1") == "1"
+PAGES = int(os.environ.get("BENCH_PAGES", 5))
+REPEAT = int(os.environ.get("BENCH_REPEAT", 50))
+
+# Most frequent first, drawn with weights 1 / rank
+WORDS = ["照顧", "care", "長者", "helper", "家務", "經驗", "nurse", "煮飯", "住家", "elderly",
+         "cleaning", "陪診", "cooking", "part-time", "寵物", "weekend", "狗狗", "overnight",
+         "夜班", "貓咪", "散步", "patient", "洗澡", "walking", "餵藥", "復康", "dog", "cat",
+         "粵語", "普通話", "massage", "wheelchair", "物理治療", "diabetes", "dementia", "認知障礙"]
+
+QUERIES = [
+    ("common CJK word", "照顧"),
+    ("common English word", "care"),
+    ("two common words", "長者 helper"),
+    ("mixed, mid frequency", "寵物 weekend"),
+    ("rare pair", "dementia 認知障礙"),
+    ("single character", "狗"),
+    ("no match", "zzzzzz"),
+]
+
+
+def seed_ads(conn, count):
+    rnd = random.Random(5)
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT coalesce(max(ad_id), 0) FROM ad_search WHERE ad_type = 'caregiver'")
+        first = cursor.fetchone()[0] + 1
+    copy_rows(conn, "ad_search", ["ad_type", "ad_id", "profile_id", "title", "description"],
+              (("caregiver", first + i, -1,
+                " ".join(rnd.choices(WORDS, weights, k=3)),
+                " ".join(rnd.choices(WORDS, weights, k=rnd.randint(10, 40))))
+               for i in range(count)))
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE ad_search")
+    conn.commit()
+
+
+def search(conn, args):
+    # One request's work; returns the `after` of the next page, if any
+    query, params, limit, terms = search_query(args)
+    with conn.cursor(row_factory=dict_row, binary=True) as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    for row in rows:
+        row["highlight"] = {"title": highlight(row["title"], terms),
+                            "description": highlight(row["description"], terms, SNIPPET_LENGTH)}
+    if len(rows) == limit:
+        last = rows[-1]
+        return f"{last['rank']!r}:{last['id']}:{last['ad_type']}"
+    return None
+
+
+def main():
+    with connect() as conn:
+        if SEED:
+            seed_ads(conn, ADS)
+
+        for label, text in QUERIES:
+            report(f"{label}, page 1", timed(lambda: search(conn, {"q": text}), REPEAT), "searches")
+
+            # The cursor of page PAGES, then time that page
+            args = {"q": text}
+            for _ in range(PAGES - 1):
+                after = search(conn, args)
+                if after is None:
+                    break
+                args = {"q": text, "after": after}
+            else:
+                report(f"{label}, page {PAGES}", timed(lambda: search(conn, args), REPEAT), "searches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# bench/common.py
+# Shared by the benchmark scripts in bench/. They connect to the database of
+# the DB_* environment variables (the same ones as db.py) and the scripts that
+# seed data write rows into it: run them against a scratch database with the
+# migrations applied, never against production.
+#
+#   DB_NAME=bench DB_USER=... DB_HOST=localhost python bench/<script>.py
+import json
+import os
+import random
+import sys
+import time
+
+import psycopg
+
+# The repository root, so that the scripts can import the app's modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DB_CONFIG = {
+    "dbname": os.environ.get("DB_NAME"),
+    "user": os.environ.get("DB_USER"),
+    "password": os.environ.get("DB_PASSWORD"),
+    "host": os.environ.get("DB_HOST"),
+    "port": os.environ.get("DB_PORT"),
+}
+
+# Codes and names of migrations/009_profile_locations.sql
+DISTRICTS = ["central and western", "wan chai", "eastern", "southern", "yau tsim mong",
+             "sham shui po", "kowloon city", "wong tai sin", "kwun tong", "tsuen wan",
+             "tuen mun", "yuen long", "north", "tai po", "sai kung", "sha tin", "kwai tsing",
+             "islands"]
+
+# Seeded rows are tagged with this name, so that a scratch database can be
+# cleaned with DELETE ... WHERE name = BENCH_NAME
+BENCH_NAME = "bench"
+
+
+def connect(**kwargs):
+    return psycopg.connect(**DB_CONFIG, **kwargs)
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def report(label, seconds, unit="op"):
+    # One line with the count, mean, p50, p95 and p99 of `seconds`, in ms
+    ms = [s * 1000 for s in seconds]
+    print(f"{label:40} n={len(ms):<6} mean={sum(ms) / len(ms):9.2f}ms "
+          f"p50={percentile(ms, 50):9.2f}ms p95={percentile(ms, 95):9.2f}ms "
+          f"p99={percentile(ms, 99):9.2f}ms  ({len(ms) / (sum(seconds) or 1):.1f} {unit}/s)")
+
+
+def timed(fn, repeat, warmup=1):
+    # The duration of each of `repeat` calls of fn, after `warmup` untimed ones
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def copy_rows(conn, table, columns, rows):
+    with conn.cursor() as cursor:
+        with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+    conn.commit()
+
+
+def seed_caregivers(conn, count, seed=1):
+    # `count` caregivers in random districts, with random prices and
+    # experience. Returns the ids they got.
+    rnd = random.Random(seed)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT coalesce(max(id), 0) FROM caregivers")
+        first = cursor.fetchone()[0]
+    copy_rows(conn, "caregivers",
+              ["name", "phone", "imageurl", "location", "hourlycharge",
+               "years_of_experience", "age", "education", "gender"],
+              ((BENCH_NAME, f"bench-{i}", "https://example.com/avatar.jpg",
+                json.dumps(rnd.sample(DISTRICTS, rnd.randint(1, 3))),
+                rnd.randint(60, 250), rnd.randint(0, 30), rnd.randint(20, 65),
+                rnd.choice(["primary", "secondary", "degree"]), rnd.choice(["male", "female"]))
+               for i in range(count)))
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM caregivers WHERE id > %s AND name = %s", (first, BENCH_NAME))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def seed_careneeders(conn, count, seed=2):
+    rnd = random.Random(seed)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT coalesce(max(id), 0) FROM careneeder")
+        first = cursor.fetchone()[0]
+    copy_rows(conn, "careneeder",
+              ["name", "phone", "imageurl", "location", "hourlycharge",
+               "live_in_care", "meal_preparation", "companionship"],
+              ((BENCH_NAME, f"bench-{i}", "https://example.com/avatar.jpg",
+                json.dumps(rnd.sample(DISTRICTS, rnd.randint(1, 2))), rnd.randint(60, 250),
+                rnd.random() < 0.3, rnd.random() < 0.5, rnd.random() < 0.5)
+               for i in range(count)))
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM careneeder WHERE id > %s AND name = %s", (first, BENCH_NAME))
+        return [row[0] for row in cursor.fetchall()]
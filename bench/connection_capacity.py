@@ -0,0 +1,64 @@
+# bench/connection_capacity.py
+# Concurrent requests one pod sustains, the sync gunicorn app (app:flask_app)
+# against the ASGI one (asgi:asgi_app). For each level of BENCH_CONCURRENCY,
+# that many clients each send requests to BENCH_PATH over their own
+# connection for BENCH_SECONDS. The script reports the throughput, the
+# latency percentiles and the failed requests (errors and timeouts) of each
+# server.
+#
+#   BENCH_SYNC_URL=http://localhost:8000 BENCH_ASGI_URL=http://localhost:8001 \
+#       python bench/connection_capacity.py
+import asyncio
+import os
+import time
+
+import httpx
+
+from common import percentile
+
+URLS = [(name, os.environ[variable]) for name, variable in
+        [("sync", "BENCH_SYNC_URL"), ("asgi", "BENCH_ASGI_URL")] if os.environ.get(variable)]
+PATH = os.environ.get("BENCH_PATH", "/api/list_conversations?user_phone=bench")
+CONCURRENCY = [int(level) for level in
+               os.environ.get("BENCH_CONCURRENCY", "10,50,100,250,500,1000").split(",")]
+SECONDS = float(os.environ.get("BENCH_SECONDS", 20))
+TIMEOUT = float(os.environ.get("BENCH_TIMEOUT", 10))
+
+
+async def client(url, deadline, samples, failures):
+    # One connection, requests back to back until the deadline
+    limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+    async with httpx.AsyncClient(base_url=url, timeout=TIMEOUT, limits=limits) as http:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await http.get(PATH)
+                if response.status_code == 200:
+                    samples.append(time.perf_counter() - started)
+                    continue
+            except httpx.HTTPError:
+                pass
+            failures.append(time.perf_counter() - started)
+
+
+async def level(url, concurrency):
+    samples, failures = [], []
+    deadline = time.monotonic() + SECONDS
+    await asyncio.gather(*(client(url, deadline, samples, failures) for _ in range(concurrency)))
+    return samples, failures
+
+
+def main():
+    if not URLS:
+        raise SystemExit("Set BENCH_SYNC_URL and/or BENCH_ASGI_URL")
+    for name, url in URLS:
+        for concurrency in CONCURRENCY:
+            samples, failures = asyncio.run(level(url, concurrency))
+            ms = [s * 1000 for s in samples] or [0]
+            print(f"{name:5} {concurrency:5} clients: {len(samples) / SECONDS:8.1f} req/s "
+                  f"p50={percentile(ms, 50):8.1f}ms p99={percentile(ms, 99):8.1f}ms "
+                  f"failed={len(failures)}")
+
+
+if __name__ == "__main__":
+    main()
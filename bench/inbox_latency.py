@@ -0,0 +1,116 @@
+# bench/inbox_latency.py
+# Latency of the inbox query (/api/list_conversations) for BENCH_USERS users
+# with BENCH_MESSAGES_PER_USER messages each, spread over
+# BENCH_CONVERSATIONS_PER_USER conversations: the conversation_summaries
+# query the endpoint runs (migrations/004_conversation_summaries.sql) against
+# the aggregate over the messages it replaced.
+#
+#   python bench/inbox_latency.py
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from common import ROOT, connect, copy_rows, report, timed
+
+from app import LIST_CONVERSATIONS_QUERY
+
+USERS = int(os.environ.get("BENCH_USERS", 5))
+MESSAGES_PER_USER = int(os.environ.get("BENCH_MESSAGES_PER_USER", 100000))
+CONVERSATIONS_PER_USER = int(os.environ.get("BENCH_CONVERSATIONS_PER_USER", 200))
+REPEAT = int(os.environ.get("BENCH_REPEAT", 50))
+
+# list_conversations before conversation_summaries
+AGGREGATE_QUERY = """
+        SELECT
+            c.id,
+            CASE
+                WHEN c.user1_phone = %s THEN c.user2_phone
+                ELSE c.user1_phone
+            END AS other_user_phone,
+            a.name,
+            a.imageurl,
+            m.content AS lastMessage,
+            m.createtime AS timestamp,
+            m.ad_id,
+            m.ad_type
+        FROM conversations c
+        LEFT JOIN accounts a ON a.phone = CASE
+                WHEN c.user1_phone = %s THEN c.user2_phone
+                ELSE c.user1_phone
+            END
+        LEFT JOIN (
+            SELECT content, createtime, conversation_id, ad_id, ad_type
+            FROM messages
+            WHERE (conversation_id, createtime, ad_type) IN (
+                SELECT conversation_id, MAX(createtime), ad_type
+                FROM messages
+                WHERE sender_id = %s OR recipient_id = %s
+                GROUP BY conversation_id, ad_id, ad_type
+            )
+        ) m ON m.conversation_id = c.id
+        WHERE c.user1_phone = %s OR c.user2_phone = %s
+        ORDER BY m.createtime DESC
+        """
+
+
+def seed_inboxes(conn):
+    # The phones of the seeded users. Their summaries are filled by the
+    # backfill of migrations/004, as for messages stored before it.
+    rnd = random.Random(4)
+    run = uuid.uuid4().hex[:8]
+    users = [f"bench-{run}-{u}" for u in range(USERS)]
+    copy_rows(conn, "conversations", ["user1_phone", "user2_phone"],
+              ((user, f"{user}-{k}") for user in users for k in range(CONVERSATIONS_PER_USER)))
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id, user1_phone, user2_phone FROM conversations WHERE user1_phone = ANY(%s)",
+                       (users,))
+        conversations = {user: [] for user in users}
+        for conversation_id, user, other in cursor.fetchall():
+            conversations[user].append((conversation_id, other))
+
+    started = datetime(2024, 1, 1)
+    copy_rows(conn, "messages",
+              ["sender_id", "recipient_id", "content", "ad_id", "ad_type", "createtime",
+               "conversation_id", "ably_message_id"],
+              ((sender, recipient, f"bench message {i}", rnd.randint(1, 50),
+                rnd.choice(["caregiver", "careneeder", None]),
+                started + timedelta(seconds=i * 30 + rnd.randint(0, 29)), conversation_id,
+                f"{user}-{i}")
+               for user in users
+               for i, (conversation_id, other) in enumerate(
+                   rnd.choice(conversations[user]) for _ in range(MESSAGES_PER_USER))
+               for sender, recipient in [rnd.choice([(user, other), (other, user)])]))
+
+    with open(os.path.join(ROOT, "migrations", "004_conversation_summaries.sql")) as f:
+        backfill = f.read()
+    with conn.cursor() as cursor:
+        cursor.execute(backfill)
+        cursor.execute("ANALYZE messages")
+        cursor.execute("ANALYZE conversation_summaries")
+    conn.commit()
+    return users
+
+
+def main():
+    with connect() as conn:
+        users = seed_inboxes(conn)
+
+        def inbox(query, params):
+            def run():
+                with conn.cursor() as cursor:
+                    cursor.execute(query, params, prepare=True)
+                    cursor.fetchall()
+            return run
+
+        summaries, aggregate = [], []
+        for user in users:
+            summaries += timed(inbox(LIST_CONVERSATIONS_QUERY, (user,)), REPEAT)
+            aggregate += timed(inbox(AGGREGATE_QUERY, (user,) * 6), max(1, REPEAT // 10))
+
+    report(f"summaries, {MESSAGES_PER_USER} messages/user", summaries, "inboxes")
+    report(f"aggregate, {MESSAGES_PER_USER} messages/user", aggregate, "inboxes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# bench/match_throughput.py
+# Throughput of the caregiver matching (matching.py) over BENCH_CAREGIVERS
+# seeded caregivers, per careneeder: the first, full computation, a stored
+# list served as it is, and the incremental refresh after
+# BENCH_NEW_CAREGIVERS more caregivers are added.
+#
+#   python bench/match_throughput.py
+import os
+import time
+
+from common import connect, report, seed_careneeders, seed_caregivers
+
+import matching
+
+CAREGIVERS = int(os.environ.get("BENCH_CAREGIVERS", 200000))
+NEW_CAREGIVERS = int(os.environ.get("BENCH_NEW_CAREGIVERS", 1000))
+CARENEEDERS = int(os.environ.get("BENCH_CARENEEDERS", 20))
+
+
+def match_each(conn, careneeders):
+    samples = []
+    for careneeder_id in careneeders:
+        started = time.perf_counter()
+        with conn.cursor() as cursor:
+            matching.matches_for(cursor, careneeder_id)
+        conn.commit()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    with connect() as conn:
+        seed_caregivers(conn, CAREGIVERS)
+        careneeders = seed_careneeders(conn, CARENEEDERS)
+
+        full = match_each(conn, careneeders)
+        served = match_each(conn, careneeders)
+        seed_caregivers(conn, NEW_CAREGIVERS, seed=3)
+        incremental = match_each(conn, careneeders)
+
+    report(f"full, {CAREGIVERS}+ caregivers", full, "careneeders")
+    report("stored list served", served, "careneeders")
+    report(f"incremental, {NEW_CAREGIVERS} new caregivers", incremental, "careneeders")
+    print(f"caregivers scored per second: {matching.get_match_stats()['caregivers_per_second']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# bench/message_ingest.py
+# Messages stored per second over HTTP, one per POST /api/handle_message
+# against BENCH_BATCH_SIZE per POST /api/handle_message/batch, with
+# BENCH_CLIENTS concurrent clients. Run it against a server of the app
+# (BENCH_URL) on a scratch database; messages go to BENCH_CONVERSATIONS
+# conversations between "bench-..." phones.
+#
+#   BENCH_URL=http://localhost:8000 python bench/message_ingest.py
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from common import report
+
+URL = os.environ.get("BENCH_URL", "http://localhost:8000")
+MESSAGES = int(os.environ.get("BENCH_MESSAGES", 20000))
+BATCH_SIZE = int(os.environ.get("BENCH_BATCH_SIZE", 100))
+CLIENTS = int(os.environ.get("BENCH_CLIENTS", 16))
+CONVERSATIONS = int(os.environ.get("BENCH_CONVERSATIONS", 100))
+AD_ID = int(os.environ.get("BENCH_AD_ID", 1))
+
+
+def messages(count):
+    run = uuid.uuid4().hex[:8]
+    return [{
+        "sender_id": f"bench-{i % CONVERSATIONS}-a",
+        "recipient_id": f"bench-{i % CONVERSATIONS}-b",
+        "content": f"bench message {i}",
+        "ad_id": AD_ID,
+        "ably_message_id": f"bench-{run}-{i}",
+    } for i in range(count)]
+
+
+def ingest(path, bodies, expected):
+    # Posts the bodies from CLIENTS threads, each with its own keep-alive
+    # client. Returns the wall clock time and the duration of each request.
+    local = threading.local()
+    clients = []
+
+    def post(body):
+        if not hasattr(local, "client"):
+            local.client = httpx.Client(base_url=URL, timeout=60)
+            clients.append(local.client)
+        started = time.perf_counter()
+        response = local.client.post(path, json=body)
+        assert response.status_code == expected, (response.status_code, response.text[:200])
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CLIENTS) as executor:
+        samples = list(executor.map(post, bodies))
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        client.close()
+    return elapsed, samples
+
+
+def main():
+    single = messages(MESSAGES)
+    elapsed, samples = ingest("/api/handle_message", single, 201)
+    report("single, per request", samples, "requests")
+    print(f"single: {MESSAGES / elapsed:.0f} messages/s with {CLIENTS} clients")
+
+    batched = messages(MESSAGES)
+    bodies = [batched[i:i + BATCH_SIZE] for i in range(0, MESSAGES, BATCH_SIZE)]
+    elapsed, samples = ingest("/api/handle_message/batch", bodies, 201)
+    report(f"batches of {BATCH_SIZE}, per request", samples, "requests")
+    print(f"batch: {MESSAGES / elapsed:.0f} messages/s with {CLIENTS} clients")
+
+
+if __name__ == "__main__":
+    main()
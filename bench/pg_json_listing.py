@@ -0,0 +1,44 @@
+# bench/pg_json_listing.py
+# GET /api/careneeder/all_careneeders with its body built by Postgres
+# (pgjson.py, PG_JSON_LISTINGS=1) against the Python path (rows fetched as
+# dicts and encoded by serialization.py), over BENCH_CARENEEDERS seeded
+# careneeders: the full listing and pages of BENCH_PAGE_SIZE. The handler
+# runs without its response cache and ETag decorators.
+#
+#   python bench/pg_json_listing.py
+import inspect
+import os
+
+from common import connect, report, seed_careneeders, timed
+
+import careneeder
+from app import flask_app
+
+CARENEEDERS = int(os.environ.get("BENCH_CARENEEDERS", 50000))
+PAGE_SIZE = int(os.environ.get("BENCH_PAGE_SIZE", 200))
+REPEAT = int(os.environ.get("BENCH_REPEAT", 20))
+
+listing = inspect.unwrap(careneeder.get_all_careneeders)
+
+
+def fetch(query_string, pg_json):
+    careneeder.PG_JSON_LISTINGS = pg_json
+    with flask_app.test_request_context(f"/api/careneeder/all_careneeders?{query_string}"):
+        response = listing()
+        assert response.status_code == 200, response.status_code
+        return response.get_data()
+
+
+def main():
+    with connect() as conn:
+        seed_careneeders(conn, CARENEEDERS)
+
+    for label, query_string in [("full listing", ""), (f"pages of {PAGE_SIZE}", f"limit={PAGE_SIZE}")]:
+        for path, pg_json in [("python", False), ("postgres json", True)]:
+            size = len(fetch(query_string, pg_json))
+            report(f"{label}, {path} ({size / 1e6:.2f} MB)",
+                   timed(lambda: fetch(query_string, pg_json), REPEAT), "responses")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# bench/serialization_speed.py
+# Encoding time of a listing of BENCH_ROWS caregiver-shaped rows (the
+# fields of caregiver.CAREGIVER_FIELDS plus a timestamp), as dict_row returns
+# them:
+# Flask's default provider on copies of the rows (the encoding before
+# serialization.py), the stdlib fallback of serialization.py, and orjson.
+# Needs no database.
+#
+#   python bench/serialization_speed.py
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from common import DISTRICTS, report, timed
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import serialization
+
+ROWS = int(os.environ.get("BENCH_ROWS", 50000))
+REPEAT = int(os.environ.get("BENCH_REPEAT", 10))
+
+
+def caregiver_rows(count, seed=1):
+    rnd = random.Random(seed)
+    created = datetime(2024, 1, 1)
+    rows = []
+    for i in range(count, 0, -1):
+        rows.append({
+            "id": i,
+            "name": rnd.choice(["陳大文", "李小明", "Mary Santos", "Siti Rahayu"]),
+            "years_of_experience": rnd.randint(0, 30),
+            "age": rnd.randint(20, 65),
+            "education": rnd.choice(["primary", "secondary", "degree"]),
+            "gender": rnd.choice(["male", "female"]),
+            "phone": f"9{rnd.randint(0, 9999999):07d}",
+            "imageurl": f"https://example.com/images/{i:064x}.jpg",
+            "location": json.dumps(rnd.sample(DISTRICTS, rnd.randint(1, 3))),
+            "hourlycharge": Decimal(rnd.randint(6000, 25000)) / 100,
+            "createtime": created + timedelta(seconds=rnd.randint(0, 10 ** 8)),
+        })
+    return rows
+
+
+def main():
+    rows = caregiver_rows(ROWS)
+    default = DefaultJSONProvider(Flask(__name__))
+
+    results = [
+        ("flask default, copied rows", lambda: default.dumps([dict(row) for row in rows]).encode()),
+        ("stdlib fallback", lambda: serialization._stdlib_dumps(rows)),
+    ]
+    if serialization.orjson is not None:
+        results.append(("orjson", lambda: serialization.dumps(rows)))
+    else:
+        print("orjson is not installed, only the stdlib encoders are measured")
+
+    for label, encode in results:
+        size = len(encode())
+        report(f"{label} ({size / 1e6:.1f} MB)", timed(encode, REPEAT), "listings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# bench/thumbnail_savings.py
+# Time thumbnails.make_thumbnails takes per image and the bytes its variants
+# save: the original against each variant, and against the 256 px WebP a
+# listing avatar loads. Runs on the pictures of BENCH_IMAGES (a directory of
+# JPEG/PNG files) or, without it, on BENCH_SYNTHETIC generated phone-sized
+# photos. S3 is moto's in-memory one unless BENCH_REAL_S3=1, in which case
+# the bucket of the S3_* variables is written to.
+#
+#   BENCH_IMAGES=~/photos python bench/thumbnail_savings.py
+import io
+import os
+import random
+import time
+
+from common import percentile, report
+
+from PIL import Image, ImageDraw, ImageFilter
+
+IMAGES = os.environ.get("BENCH_IMAGES")
+SYNTHETIC = int(os.environ.get("BENCH_SYNTHETIC", 20))
+REAL_S3 = os.environ.get("BENCH_REAL_S3", "0") == "1"
+
+# (width, height, format) of the generated pictures
+SYNTHETIC_SHAPES = [(4032, 3024, "JPEG"), (3024, 4032, "JPEG"), (1080, 1440, "JPEG"),
+                    (1170, 2532, "PNG")]
+
+
+def synthetic_photo(rnd, width, height, fmt):
+    # Smooth shapes over a gradient plus sensor-like noise, which compresses
+    # about like a photo
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        r = rnd.randrange(width // 20, width // 4)
+        draw.ellipse((x - r, y - r, x + r, y + r),
+                     fill=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    image = image.filter(ImageFilter.GaussianBlur(width / 200))
+    noise = Image.effect_noise((width, height), 12).convert("RGB")
+    image = Image.blend(image, noise, 0.08)
+    out = io.BytesIO()
+    image.save(out, fmt, **({"quality": 92} if fmt == "JPEG" else {}))
+    return out.getvalue(), "image/jpeg" if fmt == "JPEG" else "image/png"
+
+
+def pictures():
+    # [(name, bytes, content type)]
+    if IMAGES:
+        types = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+        return [(name, open(os.path.join(IMAGES, name), "rb").read(),
+                 types[os.path.splitext(name)[1].lower()])
+                for name in sorted(os.listdir(IMAGES))
+                if os.path.splitext(name)[1].lower() in types]
+    rnd = random.Random(6)
+    return [(f"synthetic-{i}", *synthetic_photo(rnd, *SYNTHETIC_SHAPES[i % len(SYNTHETIC_SHAPES)]))
+            for i in range(SYNTHETIC)]
+
+
+def run(thumbnails):
+    import uploads
+
+    seconds, source_total = [], 0
+    variant_totals = {fmt: {width: 0 for width in thumbnails.THUMBNAIL_WIDTHS}
+                      for fmt in thumbnails.FORMATS}
+    avatar = []
+    for i, (name, body, content_type) in enumerate(pictures()):
+        key = f"{uploads.OBJECT_PREFIX}bench-{i}{uploads.IMAGE_TYPES[content_type]}"
+        thumbnails.s3.put_object(Bucket=uploads.S3_BUCKET, Key=key, Body=body, ContentType=content_type)
+        started = time.perf_counter()
+        source_bytes, sizes = thumbnails.make_thumbnails(key)
+        seconds.append(time.perf_counter() - started)
+        source_total += source_bytes
+        for fmt, widths in sizes.items():
+            for width, size in widths.items():
+                variant_totals[fmt][width] += size
+        if 256 in sizes["webp"]:
+            avatar.append(1 - sizes["webp"][256] / source_bytes)
+
+    report(f"make_thumbnails, {len(seconds)} images", seconds, "images")
+    print(f"originals: {source_total / len(seconds) / 1e6:.2f} MB on average")
+    for fmt, widths in variant_totals.items():
+        for width, total in sorted(widths.items()):
+            print(f"  {fmt:5} {width:4}px: {total / len(seconds) / 1e3:8.1f} kB on average, "
+                  f"{100 * (1 - total / source_total):5.1f}% smaller")
+    if avatar:
+        print(f"256px WebP avatar saves {100 * percentile(avatar, 50):.1f}% of the bytes "
+              f"(median, min {100 * min(avatar):.1f}%)")
+
+
+def main():
+    if REAL_S3:
+        import thumbnails
+        run(thumbnails)
+        return
+
+    import boto3
+    from moto import mock_aws
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(name, "bench")
+    import thumbnails
+    import uploads
+    with mock_aws():
+        thumbnails.s3 = uploads.s3 = boto3.client("s3", region_name=uploads.S3_REGION)
+        uploads.s3.create_bucket(Bucket=uploads.S3_BUCKET,
+                                 CreateBucketConfiguration={"LocationConstraint": uploads.S3_REGION})
+        run(thumbnails)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# cache.py
+# Process-local LRU cache of the serialized listing responses, keyed by path
+# and query string (so by endpoint, filters and page) and tagged with the
+# tables they were read from.
+#
+# Handlers that write one of those tables are decorated with @invalidates:
+# after a successful response the entries of the table are dropped here and a
+# NOTIFY on CACHE_CHANNEL makes every other process and pod drop them too (see
+# notifications.py). A read that was running while a write committed is not
+# stored, so an old result cannot outlive the invalidation. RESPONSE_CACHE_TTL
+# bounds how long an entry can be served if a notification is lost.
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response, request
+
+import notifications
+from db import db_cursor
+from pagination import NEXT_CURSOR_HEADER
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 512))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 300))
+CACHE_CHANNEL = os.environ.get("CACHE_CHANNEL", "cache_invalidate")
+
+CACHE_STATUS_HEADER = "X-Cache"
+
+logger = logging.getLogger(__name__)
+
+# Response headers worth keeping with the body
+CACHED_HEADERS = ("Content-Type", "Cache-Control", "Pragma", NEXT_CURSOR_HEADER)
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (expires, tags, status, headers, body)
+        self.entries = OrderedDict()
+        self.size = 0
+        # tag -> keys, for invalidation
+        self.tagged = {}
+        # tag -> number of invalidations so far
+        self.generations = {}
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                      "invalidations": 0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[2:]
+
+    def generation(self, tags):
+        # Taken before reading, handed back to put
+        with self.lock:
+            return tuple(self.generations.get(tag, 0) for tag in tags)
+
+    def put(self, key, tags, generation, status, headers, body):
+        with self.lock:
+            # A table was written while the response was being built
+            if generation != tuple(self.generations.get(tag, 0) for tag in tags):
+                return
+            if len(body) > self.max_bytes:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, tags, status, headers, body)
+            self.size += len(body)
+            for tag in tags:
+                self.tagged.setdefault(tag, set()).add(key)
+            self.stats["stores"] += 1
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.stats["evictions"] += 1
+
+    def invalidate(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.generations[tag] = self.generations.get(tag, 0) + 1
+                for key in list(self.tagged.get(tag, ())):
+                    self._remove(key)
+            self.stats["invalidations"] += 1
+
+    def _remove(self, key):
+        # Caller holds the lock
+        _, tags, _, _, body = self.entries.pop(key)
+        self.size -= len(body)
+        for tag in tags:
+            keys = self.tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tagged[tag]
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
+
+
+def cache_key(path, args):
+    return path + "?" + "&".join(f"{name}={value}" for name, value in sorted(args))
+
+
+def _drop(payload):
+    response_cache.invalidate(json.loads(payload))
+
+
+notifications.subscribe(CACHE_CHANNEL, _drop)
+
+
+def cached(*tables):
+    # Caches the 200 responses of a GET view that reads `tables`
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            notifications.start()
+            key = cache_key(request.path, request.args.items(multi=True))
+
+            entry = response_cache.get(key)
+            if entry is not None:
+                status, headers, body = entry
+                response = make_response(body, status)
+                response.headers.update(headers)
+                response.headers[CACHE_STATUS_HEADER] = "HIT"
+                return response
+
+            generation = response_cache.generation(tables)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                headers = {name: response.headers[name] for name in CACHED_HEADERS
+                           if name in response.headers}
+                response_cache.put(key, tables, generation, response.status_code,
+                                   headers, response.get_data())
+            response.headers[CACHE_STATUS_HEADER] = "MISS"
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate(*tables):
+    # Drops the cached responses of `tables` here and, through NOTIFY, in
+    # every other process. Call once the write is committed.
+    response_cache.invalidate(tables)
+    try:
+        with db_cursor() as cursor:
+            notifications.publish(cursor, CACHE_CHANNEL, json.dumps(tables))
+    except Exception:
+        # The write itself went through, the other processes catch up when
+        # their entries expire
+        logger.error(f"Publishing the invalidation of {tables} failed", exc_info=True)
+
+
+def invalidates(*tables):
+    # For views that write `tables`: invalidates them after a 2xx response
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = make_response(view(*args, **kwargs))
+            if 200 <= response.status_code < 300:
+                invalidate(*tables)
+            return response
+        return wrapper
+    return decorator
+
+
+def get_cache_stats():
+    return response_cache.get_stats()
@@ -1,24 +1,54 @@
 import json
+import psycopg
 from flask import Blueprint, jsonify, request, make_response, current_app
-from psycopg2.extras import DictCursor
-from db import close_db, get_db
+from psycopg.rows import dict_row
+from db import db_cursor
+from uploads import UploadError, image_urls, resolve_image_key
+from thumbnails import thumbnail_urls
+from cache import cached, invalidates
+from etags import conditional
+from streaming import streamable
+from pagination import CAREGIVER_FILTERS, page_query, page_window, search_query, set_next_cursor
+from adcards import ad_cards
+from availability import availability_window, available_profiles
+from batches import (BatchError, batch_items, batch_response, existing_ids, insert_batch,
+                     reference_id)
 
 caregiver_bp = Blueprint('caregiver', __name__)
 
+# Fields returned by the caregiver listing
+CAREGIVER_FIELDS = ["id", "name", "years_of_experience", "age", "education",
+                    "gender", "phone", "imageurl", "location", "hourlycharge"]
+
+# Prepared statements, so the columns are listed: a prepared SELECT * fails
+# with "cached plan must not change result type" once a migration adds one
+CAREGIVER_BY_ID_QUERY = (f"SELECT {', '.join(CAREGIVER_FIELDS)} FROM caregivers "
+                         "WHERE id = %s")
+CAREGIVER_BY_PHONE_QUERY = (f"SELECT {', '.join(CAREGIVER_FIELDS)} FROM caregivers "
+                            "WHERE phone = %s ORDER BY id DESC")
+
+# Columns written by the batch create endpoints (see batches.py)
+CAREGIVER_COLUMNS = ["name", "phone", "imageurl", "location", "hourlycharge",
+                     "years_of_experience", "age", "education", "gender", "lat", "lng"]
+CAREGIVER_MANDATORY_FIELDS = ["name", "phone", "imageurl", "location", "hourlycharge"]
+SCHEDULE_COLUMNS = ["scheduletype", "totalhours", "frequency", "startdate",
+                    "selectedtimeslots", "durationdays", "caregiver_id"]
+AD_COLUMNS = ["title", "description", "caregiver_id"]
+
+# Full-table listings, also served streamed (see streaming.py)
+ALL_SCHEDULES_QUERY = "SELECT * FROM caregiverschedule ORDER BY id DESC"
+ALL_ADS_QUERY = "SELECT * FROM caregiverads ORDER BY id DESC"
+
 @caregiver_bp.route("/mycaregiver/<phone>", methods=["GET"])
+@conditional("caregivers")
 def get_mycaregivers(phone):
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch the caregivers related to the phone number
-        cursor.execute(
-            "SELECT * FROM caregivers WHERE phone = %s ORDER BY id DESC", (phone,))
-        rows = cursor.fetchall()
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the caregivers related to the phone number
+            cursor.execute(
+                CAREGIVER_BY_PHONE_QUERY, (phone,), prepare=True)
+            rows = cursor.fetchall()
 
         if not rows:
             return jsonify({"error": "Caregivers not found"}), 404
@@ -46,45 +76,41 @@ def get_mycaregivers(phone):
 
 
 @caregiver_bp.route("/mycaregiver/<int:id>", methods=["PUT"])
+@invalidates("caregivers")
 def update_caregiver(id):
     current_app.logger.debug(f"Entering update_caregiver for id {id}")
     try:
         data = request.get_json()
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Define the columns and values for the UPDATE query
-        # Added location to the list
-        columns = ["name", "location"]
-        # Using .get() to avoid KeyError
-        values = []
-
-        for field in columns:
-            value = data.get(field, None)
-            if field == 'location' and isinstance(value, list):
-                # Serialize dict to JSON string
-                values.append(json.dumps(value))
-            else:
-                values.append(value)
-
-        current_app.logger.debug(f"Serialized location: {json.dumps(value)}")
-        current_app.logger.debug(f"Prepared values for SQL update: {values}")
-
-        # Construct the UPDATE query
-        update_query = "UPDATE caregivers SET " + \
-            ', '.join([f"{col} = %s" for col in columns]) + f" WHERE id = {id}"
-
-        # Execute the UPDATE query with the values
-        cursor.execute(update_query, values)
-
-        current_app.logger.info(f"Received data: {data}")
-        current_app.logger.info(f"Executing query: {update_query}")
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+        with db_cursor() as cursor:
+            # Define the columns and values for the UPDATE query
+            # Added location to the list
+            columns = ["name", "location"]
+            # Using .get() to avoid KeyError
+            values = []
+
+            for field in columns:
+                value = data.get(field, None)
+                if field == 'location' and value is not None:
+                    # Stored JSON encoded, as add_caregiver does, whether a
+                    # list or a single district
+                    values.append(json.dumps(value))
+                else:
+                    values.append(value)
+
+            current_app.logger.debug(f"Serialized location: {json.dumps(value)}")
+            current_app.logger.debug(f"Prepared values for SQL update: {values}")
+
+            # Construct the UPDATE query
+            update_query = "UPDATE caregivers SET " + \
+                ', '.join([f"{col} = %s" for col in columns]) + f" WHERE id = {id}"
+
+            # Execute the UPDATE query with the values
+            cursor.execute(update_query, values)
+
+            current_app.logger.info(f"Received data: {data}")
+            current_app.logger.info(f"Executing query: {update_query}")
 
         return jsonify({"success": "更新成功"}), 200
 
@@ -95,71 +121,86 @@ def update_caregiver(id):
 
 
 @caregiver_bp.route('/all_caregivers', methods=['GET'])
+@conditional("caregivers")
+@cached("caregivers")
 def get_all_caregivers():
     current_app.logger.info(
         "---------------Entering GET /all_caregivers request")
     try:
-        # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
+        query, params, limit = page_query(
+            "caregivers", CAREGIVER_FILTERS, request.args, CAREGIVER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Fetch caregivers from the database
-        cursor.execute("SELECT * FROM caregivers ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} caregivers from the database")
-
-        # Close the connection
-        cursor.close()
+    try:
+        # Connect to the PostgreSQL database
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch one page (or all) of the caregivers from the database
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} caregivers from the database")
 
         if not rows:
+            if limit is not None:
+                return jsonify([]), 200
             current_app.logger.warning("No caregivers found in the database")
             return jsonify({"error": "Problem of fetching caregivers"}), 404
 
-        # Directly convert the rows into JSON
-        caregivers = [dict(row) for row in rows]
-
-        # Format the data for JSON
-        caregivers = [
-            {
-                "id": row["id"],
-                "name": row["name"],
-                "years_of_experience": row["years_of_experience"],
-                "age": row["age"],
-                "education": row["education"],
-                "gender": row["gender"],
-                "phone": row["phone"],
-                "imageurl": row["imageurl"],
-                "location": row["location"],
-                "hourlycharge": row["hourlycharge"]
-            }
-            for row in rows
-        ]
+        # The rows hold exactly the listed fields, add the URLs of the small
+        # variants of the image and serialize them as they are
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
 
         current_app.logger.debug("Successfully processed all caregivers data")
 
-        response = make_response(jsonify(caregivers))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
-        return response
+        return set_next_cursor(response, rows, limit)
     except Exception as e:
         current_app.logger.error("Error fetching all caregivers", exc_info=True)
         return jsonify({"error": "Failed to fetch all caregivers"}), 500
     
+@caregiver_bp.route("/search", methods=["GET"])
+@conditional("caregivers")
+@cached("caregivers")
+def search_caregivers():
+    # Caregivers by district or around a point (see search_query in pagination.py)
+    try:
+        query, params, limit, nearest = search_query(
+            "caregivers", CAREGIVER_FILTERS, request.args, CAREGIVER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        # Results around a point are the nearest ones, they have no next page
+        return set_next_cursor(response, rows, None if nearest else limit)
+    except Exception as e:
+        current_app.logger.error("Error searching caregivers", exc_info=True)
+        return jsonify({"error": "Failed to search caregivers"}), 500
+
+
 @caregiver_bp.route("/all_caregivers/<int:caregiver_id>", methods=["GET"])
+@conditional("caregivers")
 def get_caregiver_detail(caregiver_id):
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch the specific caregiver from the database using the id
-        cursor.execute("SELECT * FROM caregivers WHERE id = %s",
-                       (caregiver_id,))
-        row = cursor.fetchone()
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the specific caregiver from the database using the id
+            cursor.execute(CAREGIVER_BY_ID_QUERY,
+                           (caregiver_id,), prepare=True)
+            row = cursor.fetchone()
 
         # Check if a caregiver with the given id exists
         if not row:
@@ -187,44 +228,43 @@ def get_caregiver_detail(caregiver_id):
 
 
 @caregiver_bp.route("/all_caregivers", methods=["POST"])
+@invalidates("caregivers")
 def add_caregiver():
     try:
         data = request.get_json()
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Define the mandatory columns and values for the INSERT query
-        mandatory_columns = ["name", "phone",
-                             "imageurl", "location", "hourlycharge"]
-        values = [data[field] if field != 'location' else json.dumps(
-            data[field]) for field in mandatory_columns]
-
-        # Optional fields: yearsOfExperience, age, education, gender
-        # Add them to the INSERT query only if they are present in the data
-        optional_fields = ["years_of_experience", "age", "education", "gender"]
-        for field in optional_fields:
-            if field in data:
-                mandatory_columns.append(field)
-                values.append(data[field])
-            else:
-                # If the optional field is missing, set a default value or NULL
-                # For example, set the yearsOfExperience to NULL
-                # You can customize the default values as needed
-                mandatory_columns.append(field)
-                values.append(None)
-
-        # Construct the INSERT query with the appropriate number of placeholders
-        insert_query = f"INSERT INTO caregivers ({', '.join(mandatory_columns)}) VALUES ({', '.join(['%s'] * len(mandatory_columns))}) RETURNING id"
-
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_caregiver_id = cursor.fetchone()[0]
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+        with db_cursor() as cursor:
+            # imageurl, or the image_key of a completed upload
+            resolve_image_key(cursor, data)
+
+            # Define the mandatory columns and values for the INSERT query
+            mandatory_columns = ["name", "phone",
+                                 "imageurl", "location", "hourlycharge"]
+            values = [data[field] if field != 'location' else json.dumps(
+                data[field]) for field in mandatory_columns]
+
+            # Optional fields: yearsOfExperience, age, education, gender, and the
+            # lat/lng of the profile (else the centre of its first district)
+            # Add them to the INSERT query only if they are present in the data
+            optional_fields = ["years_of_experience", "age", "education", "gender", "lat", "lng"]
+            for field in optional_fields:
+                if field in data:
+                    mandatory_columns.append(field)
+                    values.append(data[field])
+                else:
+                    # If the optional field is missing, set a default value or NULL
+                    # For example, set the yearsOfExperience to NULL
+                    # You can customize the default values as needed
+                    mandatory_columns.append(field)
+                    values.append(None)
+
+            # Construct the INSERT query with the appropriate number of placeholders
+            insert_query = f"INSERT INTO caregivers ({', '.join(mandatory_columns)}) VALUES ({', '.join(['%s'] * len(mandatory_columns))}) RETURNING id"
+
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_caregiver_id = cursor.fetchone()[0]
 
         # Return the newly created caregiver data with the assigned ID
         # imageUrl is possibly from const [imageUrl, setImageUrl] = useState<string | null>(null) in CaregiverForm.tsx
@@ -242,11 +282,48 @@ def add_caregiver():
         }
         return jsonify(new_caregiver), 201
 
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error adding caregiver: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add caregiver"}), 500
 
+@caregiver_bp.route("/all_caregivers/batch", methods=["POST"])
+@invalidates("caregivers")
+def add_caregivers_batch():
+    try:
+        items = batch_items(request.get_json())
+
+        with db_cursor() as cursor:
+            # The image_keys of the whole batch, in one query
+            urls = image_urls(cursor, items)
+
+            def values(data):
+                # imageurl, or the image_key of a completed upload
+                resolve_image_key(cursor, data, urls)
+                for field in CAREGIVER_MANDATORY_FIELDS:
+                    if field not in data:
+                        raise ValueError(f"{field} is required")
+                return [json.dumps(data[field]) if field == "location" else data.get(field)
+                        for field in CAREGIVER_COLUMNS]
+
+            results = insert_batch(cursor, "caregivers", CAREGIVER_COLUMNS, items, values)
+
+        current_app.logger.info(
+            f"Batch of {len(items)} caregivers, {sum('id' in r for r in results)} inserted")
+        return batch_response(results)
+
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    except (psycopg.DataError, psycopg.IntegrityError) as e:
+        return jsonify({"error": f"Batch rejected, nothing was inserted: {e.diag.message_primary}"}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error adding caregivers batch: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to add caregivers"}), 500
+
+
 @caregiver_bp.route("/caregiver_schedule", methods=["POST"])
+@invalidates("caregiverschedule")
 def add_caregiver_schedule():
     try:
         data = request.get_json()
@@ -273,21 +350,15 @@ def add_caregiver_schedule():
                 values.append(None)
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f"INSERT INTO caregiverschedule ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f"INSERT INTO caregiverschedule ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
 
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_schedule_id = cursor.fetchone()[0]
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_schedule_id = cursor.fetchone()[0]
 
         # Create the returned object based on the Schedule interface
         new_schedule = {
@@ -302,45 +373,64 @@ def add_caregiver_schedule():
         return jsonify(new_schedule), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()
         current_app.logger.error(
             f"Error adding schedule: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add schedule"}), 500
-    finally:
-        if conn:
-            conn.close()    
+
+@caregiver_bp.route("/caregiver_schedule/batch", methods=["POST"])
+@invalidates("caregiverschedule")
+def add_caregiver_schedules_batch():
+    try:
+        items = batch_items(request.get_json())
+
+        with db_cursor() as cursor:
+            caregivers = existing_ids(cursor, "caregivers", items, "caregiver_id")
+
+            def values(data):
+                if "caregiver_id" not in data:
+                    raise ValueError("caregiver_id is required")
+                data["caregiver_id"] = reference_id(data["caregiver_id"])
+                if data["caregiver_id"] not in caregivers:
+                    raise ValueError("Unknown caregiver_id")
+                return [data.get(column) for column in SCHEDULE_COLUMNS]
+
+            results = insert_batch(cursor, "caregiverschedule", SCHEDULE_COLUMNS, items, values)
+
+        return batch_response(results)
+
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    except (psycopg.DataError, psycopg.IntegrityError) as e:
+        return jsonify({"error": f"Batch rejected, nothing was inserted: {e.diag.message_primary}"}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error adding schedules batch: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to add schedules"}), 500
+
 
 @caregiver_bp.route('/all_caregiverschedule', methods=['GET'])
+@conditional("caregiverschedule")
+@cached("caregiverschedule")
+@streamable(ALL_SCHEDULES_QUERY)
 def get_all_caregiverschedule():
     current_app.logger.info("Entering GET /all_caregiverschedule request")
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch careneederschedule data from the database
-        cursor.execute("SELECT * FROM caregiverschedule ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} caregiverschedule records from the database")
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch careneederschedule data from the database
+            cursor.execute(ALL_SCHEDULES_QUERY)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} caregiverschedule records from the database")
 
         if not rows:
             current_app.logger.warning(
                 "No caregiverschedule records found in the database")
             return jsonify({"error": "No caregiverschedule data available"}), 404
 
-        # Format the data for JSON
-
-        caregiverschedule = [dict(row) for row in rows]
-
         current_app.logger.debug(
             "Successfully processed all caregiverschedule data")
 
-        response = make_response(jsonify(caregiverschedule))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -351,6 +441,7 @@ def get_all_caregiverschedule():
         
 
 @caregiver_bp.route("/caregiver_ads", methods=["POST"])
+@invalidates("caregiverads")
 def add_caregiver_ad():
     try:
         data = request.get_json()
@@ -369,21 +460,15 @@ def add_caregiver_ad():
                 values.append(None)
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f"INSERT INTO caregiverads ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
-
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_ad_id = cursor.fetchone()[0]
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f"INSERT INTO caregiverads ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
 
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_ad_id = cursor.fetchone()[0]
 
         # Create the returned object based on the ad interface
         new_ad = {
@@ -398,31 +483,56 @@ def add_caregiver_ad():
         return jsonify(new_ad), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()  # Rolling back in case of an error
         current_app.logger.error(
             f"Error adding caregiver ad: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add caregiver ad"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+
+@caregiver_bp.route("/caregiver_ads/batch", methods=["POST"])
+@invalidates("caregiverads")
+def add_caregiver_ads_batch():
+    try:
+        items = batch_items(request.get_json())
+
+        with db_cursor() as cursor:
+            caregivers = existing_ids(cursor, "caregivers", items, "caregiver_id")
+
+            def values(data):
+                if "caregiver_id" not in data:
+                    raise ValueError("caregiver_id is required")
+                data["caregiver_id"] = reference_id(data["caregiver_id"])
+                if data["caregiver_id"] not in caregivers:
+                    raise ValueError("Unknown caregiver_id")
+                return [data.get(column) for column in AD_COLUMNS]
+
+            results = insert_batch(cursor, "caregiverads", AD_COLUMNS, items, values)
+
+        return batch_response(results)
+
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    except (psycopg.DataError, psycopg.IntegrityError) as e:
+        return jsonify({"error": f"Batch rejected, nothing was inserted: {e.diag.message_primary}"}), 400
+    except Exception as e:
+        current_app.logger.error(
+            f"Error adding caregiver ads batch: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to add caregiver ads"}), 500
 
 
 @caregiver_bp.route("/all_caregiverads", methods=["GET"])
+@conditional("caregiverads")
+@cached("caregiverads")
+@streamable(ALL_ADS_QUERY)
 def get_caregiver_ads():
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        # Use DictCursor to fetch rows as dictionaries
-        cursor = conn.cursor(cursor_factory=DictCursor)
+        # Use dict_row to fetch rows as dictionaries
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Execute the SELECT query to fetch all records from the caregiverads table
+            cursor.execute(ALL_ADS_QUERY)
 
-        # Execute the SELECT query to fetch all records from the caregiverads table
-        select_query = "SELECT * FROM caregiverads ORDER BY id DESC"
-        cursor.execute(select_query)
-
-        # Fetch all rows and close the cursor
-        rows = cursor.fetchall()
-        cursor.close()
+            # Fetch all rows
+            rows = cursor.fetchall()
 
         current_app.logger.debug(
             f"Fetched {len(rows)} caregiverads records from the database")
@@ -436,56 +546,99 @@ def get_caregiver_ads():
                 "No caregiverads records found in the database")
             return jsonify({"error": "No caregiverads data available"}), 404
 
-        caregiverads = [dict(row) for row in rows]
-
         current_app.logger.debug("Successfully processed all caregiverads data")
 
-        response = make_response(jsonify(caregiverads))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
 
     except Exception as e:
-        if conn:
-            conn.rollback()  # Rolling back in case of an error
         current_app.logger.error(
             f"Error fetching caregiver ads: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to fetch caregiver ads"}), 500
 
-    finally:
-        if conn:
-            conn.close()    
+@caregiver_bp.route("/ad_cards", methods=["GET"])
+@conditional("caregiverads", "caregivers", "caregiverschedule")
+@cached("caregiverads", "caregivers", "caregiverschedule")
+def get_caregiver_ad_cards():
+    # Ads with their caregiver and schedules, one page at a time (see adcards.py)
+    try:
+        limit, after_id = page_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cards, rows = ad_cards(
+                cursor, "caregiverads", "caregiver_id", "caregivers", CAREGIVER_FIELDS,
+                {"schedules": ("caregiverschedule", "caregiver_id", ["*"])},
+                limit, after_id)
+
+        response = make_response(jsonify(cards))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_next_cursor(response, rows, limit)
+    except Exception as e:
+        current_app.logger.error("Error fetching caregiver ad cards", exc_info=True)
+        return jsonify({"error": "Failed to fetch caregiver ad cards"}), 500
+
+
+@caregiver_bp.route("/availability", methods=["GET"])
+@conditional("caregivers", "caregiverschedule")
+@cached("caregivers", "caregiverschedule")
+def get_available_caregivers():
+    # Caregivers with a schedule in a window of dates, weekdays and hours,
+    # each with those schedules (see availability.py)
+    try:
+        window = availability_window(request.args)
+        limit, after_id = page_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            rows = available_profiles(
+                cursor, "caregiver", "caregiverschedule", "caregiver_id", "caregivers", CAREGIVER_FIELDS,
+                window, limit, after_id)
+
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_next_cursor(response, rows, limit)
+    except Exception as e:
+        current_app.logger.error("Error fetching available caregivers", exc_info=True)
+        return jsonify({"error": "Failed to fetch available caregivers"}), 500
+
 
 @caregiver_bp.route("/api/mycaregiver/<int:id>/ad", methods=["PUT"])
+@invalidates("caregiverads")
 def update_caregiver_ad(id):
-    caregiver_bp.logger.debug(f"Entering update_caregiver for id {id}")
+    current_app.logger.debug(f"Entering update_caregiver_ad for id {id}")
     try:
         data = request.get_json()
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Define the columns and values for the UPDATE query
-        columns = ["title", "description"]
-        values = [data.get(field, None) for field in columns]
-
-        current_app.logger.debug(f"Prepared values for SQL update: {values}")
+        with db_cursor() as cursor:
+            # Define the columns and values for the UPDATE query
+            columns = ["title", "description"]
+            values = [data.get(field, None) for field in columns]
 
-        # Construct the UPDATE query
-        update_query = "UPDATE caregiverads SET " + \
-            ', '.join([f"{col} = %s" for col in columns]) + \
-            f" WHERE caregiver_id = {id}"
+            current_app.logger.debug(f"Prepared values for SQL update: {values}")
 
-        # Execute the UPDATE query with the values
-        cursor.execute(update_query, values)
+            # Construct the UPDATE query
+            update_query = "UPDATE caregiverads SET " + \
+                ', '.join([f"{col} = %s" for col in columns]) + \
+                f" WHERE caregiver_id = {id}"
 
-        current_app.logger.info(f"Received data: {data}")
-        current_app.logger.info(f"Executing query: {update_query}")
+            # Execute the UPDATE query with the values
+            cursor.execute(update_query, values)
 
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            current_app.logger.info(f"Received data: {data}")
+            current_app.logger.info(f"Executing query: {update_query}")
 
         return jsonify({"success": "更新成功"}), 200
 
@@ -1,11 +1,41 @@
 import json
 from flask import Blueprint, jsonify, request, make_response, current_app
-from psycopg2.extras import DictCursor
-from db import close_db, get_db
+from psycopg.rows import dict_row
+from db import db_cursor
+from uploads import UploadError, resolve_image_key
+from thumbnails import thumbnail_urls, thumbnails_column
+from cache import cached, invalidates
+from etags import conditional
+from streaming import streamable
+from pagination import CARENEEDER_FILTERS, page_query, page_window, search_query, set_next_cursor
+from adcards import ad_cards
+from availability import availability_window, available_profiles
+from pgjson import PG_JSON_LISTINGS, aggregate_query, json_body_response, json_columns
+from matching import MATCH_TOP_K, matches_for
+from caregiver import CAREGIVER_FIELDS
 
 careneeder_bp = Blueprint('careneeder', __name__)
 
+# Fields returned by the careneeder listing
+CARENEEDER_FIELDS = [
+    "id", "name", "phone", "hourlycharge", "imageurl", "live_in_care",
+    "live_out_care", "domestic_work", "meal_preparation", "companionship",
+    "washing_dressing", "nursing_health_care", "mobility_support",
+    "transportation", "errands_shopping", "location"
+]
+
+# Prepared, hence explicit columns (see caregiver.py)
+CARENEEDER_BY_ID_QUERY = (f"SELECT {', '.join(CARENEEDER_FIELDS)} FROM careneeder "
+                          "WHERE id = %s")
+CARENEEDER_BY_PHONE_QUERY = (f"SELECT {', '.join(CARENEEDER_FIELDS)} FROM careneeder "
+                             "WHERE phone = %s ORDER BY id DESC")
+
+# Full-table listings, also served streamed (see streaming.py)
+ALL_SCHEDULES_QUERY = "SELECT * FROM careneederschedule ORDER BY id DESC"
+ALL_ADS_QUERY = "SELECT * FROM careneederads ORDER BY id DESC"
+
 @careneeder_bp.route("/all_careneeders", methods=["POST"])
+@invalidates("careneeder")
 def add_careneeder():
     try:
         data = request.get_json()
@@ -16,41 +46,38 @@ def add_careneeder():
                 return jsonify({"error": f"{field} is required"}), 400
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Define the mandatory columns and values for the INSERT query
-        mandatory_columns = ["name", "phone", "location", "hourlycharge"]
-        values = [data[field] if field != 'location' else json.dumps(
-            data[field]) for field in mandatory_columns]
-
-        # Define optional fields and include them in columns and values if they are present
-        optional_fields = [
-            "imageurl", "live_in_care", "live_out_care", "domestic_work", "meal_preparation",
-            "companionship", "washing_dressing", "nursing_health_care",
-            "mobility_support", "transportation", "errands_shopping"
-        ]
-
-        for field in optional_fields:
-            if field in data:
-                mandatory_columns.append(field)
-                values.append(data[field])
-            else:
-                mandatory_columns.append(field)
-                values.append(None)
-
-         # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(mandatory_columns)
-        values_placeholder = ', '.join(['%s'] * len(mandatory_columns))
-        insert_query = f"INSERT INTO careneeder ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
-
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_careneeder_id = cursor.fetchone()[0]
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+        with db_cursor() as cursor:
+            # imageurl, or the image_key of a completed upload
+            resolve_image_key(cursor, data)
+
+            # Define the mandatory columns and values for the INSERT query
+            mandatory_columns = ["name", "phone", "location", "hourlycharge"]
+            values = [data[field] if field != 'location' else json.dumps(
+                data[field]) for field in mandatory_columns]
+
+            # Define optional fields and include them in columns and values if they are present
+            optional_fields = [
+                "imageurl", "live_in_care", "live_out_care", "domestic_work", "meal_preparation",
+                "companionship", "washing_dressing", "nursing_health_care",
+                "mobility_support", "transportation", "errands_shopping", "lat", "lng"
+            ]
+
+            for field in optional_fields:
+                if field in data:
+                    mandatory_columns.append(field)
+                    values.append(data[field])
+                else:
+                    mandatory_columns.append(field)
+                    values.append(None)
+
+             # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(mandatory_columns)
+            values_placeholder = ', '.join(['%s'] * len(mandatory_columns))
+            insert_query = f"INSERT INTO careneeder ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
+
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_careneeder_id = cursor.fetchone()[0]
 
         # Create the returned object based on the Careneeder interface
         new_careneeder = {
@@ -67,68 +94,82 @@ def add_careneeder():
 
         return jsonify(new_careneeder), 201
 
-    except Exception as e:  # Could also catch specific exceptions like psycopg2.DatabaseError
-        if conn:
-            conn.rollback()  # Rolling back in case of an error
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:  # Could also catch specific exceptions like psycopg.DatabaseError
         current_app.logger.error(
             f"Error adding careneeder: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add careneeder"}), 500
-    finally:
-        if conn:
-            conn.close()  # Ensure that the connection is closed or returned to the pool
 
 
 @careneeder_bp.route('/all_careneeders', methods=['GET'])
+@conditional("careneeder")
+@cached("careneeder")
 def get_all_careneeders():
     current_app.logger.info(
         "---------------Entering GET /all_careneeders request")
     try:
-        # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch careneeders from the database
-        cursor.execute("SELECT * FROM careneeder ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} careneeders from the database")
+        if PG_JSON_LISTINGS:
+            return _all_careneeders_from_postgres()
+        query, params, limit = page_query(
+            "careneeder", CARENEEDER_FILTERS, request.args, CARENEEDER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Close the connection
-        cursor.close()
+    try:
+        # Connect to the PostgreSQL database
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch one page (or all) of the careneeders from the database
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} careneeders from the database")
 
         if not rows:
+            if limit is not None:
+                return jsonify([]), 200
             current_app.logger.warning("No careneeders found in the database")
             return jsonify({"error": "Problem of fetching careneeders"}), 404
 
-        # Directly convert the rows into JSON
-        careneeders = [dict(row) for row in rows]
-
-        # Format the data for JSON
-        careneeders = [
-            {
-                "id": row["id"],
-                "name": row["name"],
-                "phone": row["phone"],
-                "hourlycharge": row["hourlycharge"],
-                "imageurl": row["imageurl"],
-                "live_in_care": row["live_in_care"],
-                "live_out_care": row["live_out_care"],
-                "domestic_work": row["domestic_work"],
-                "meal_preparation": row["meal_preparation"],
-                "companionship": row["companionship"],
-                "washing_dressing": row["washing_dressing"],
-                "nursing_health_care": row["nursing_health_care"],
-                "mobility_support": row["mobility_support"],
-                "transportation": row["transportation"],
-                "errands_shopping": row["errands_shopping"],
-                "location": row["location"]
-            }
-            for row in rows
-        ]
+        # The rows hold exactly the listed fields, add the URLs of the small
+        # variants of the image and serialize them as they are
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
 
         current_app.logger.debug("Successfully processed all careneeders data")
 
-        response = make_response(jsonify(careneeders))
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_next_cursor(response, rows, limit)
+    except Exception as e:
+        current_app.logger.error("Error fetching all careneeders", exc_info=True)
+        return jsonify({"error": "Failed to fetch all careneeders"}), 500
+
+
+def _all_careneeders_from_postgres():
+    # Same response as get_all_careneeders, with the body built by the query
+    # (see pgjson.py)
+    thumbnails, thumbnail_params = thumbnails_column()
+    query, params, limit = page_query(
+        "careneeder", CARENEEDER_FILTERS, request.args,
+        json_columns(CARENEEDER_FIELDS, {"thumbnails": thumbnails}))
+
+    try:
+        with db_cursor(binary=True) as cursor:
+            # The thumbnails parameters come first in the select list
+            cursor.execute(aggregate_query(query), [*thumbnail_params, *params])
+            body, count, last_id = cursor.fetchone()
+            current_app.logger.debug(
+                f"Fetched {count} careneeders from the database")
+
+        if not count:
+            if limit is not None:
+                return jsonify([]), 200
+            current_app.logger.warning("No careneeders found in the database")
+            return jsonify({"error": "Problem of fetching careneeders"}), 404
+
+        response = json_body_response(body, count, last_id, limit)
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -137,20 +178,45 @@ def get_all_careneeders():
         return jsonify({"error": "Failed to fetch all careneeders"}), 500
 
 
+@careneeder_bp.route("/search", methods=["GET"])
+@conditional("careneeder")
+@cached("careneeder")
+def search_careneeders():
+    # Careneeders by district or around a point (see search_query in pagination.py)
+    try:
+        query, params, limit, nearest = search_query(
+            "careneeder", CARENEEDER_FILTERS, request.args, CARENEEDER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        # Results around a point are the nearest ones, they have no next page
+        return set_next_cursor(response, rows, None if nearest else limit)
+    except Exception as e:
+        current_app.logger.error("Error searching careneeders", exc_info=True)
+        return jsonify({"error": "Failed to search careneeders"}), 500
+
+
 @careneeder_bp.route("/all_careneeders/<int:careneeder_id>", methods=["GET"])
+@conditional("careneeder")
 def get_careneeder_detail(careneeder_id):
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch the specific careneeder from the database using the id
-        cursor.execute("SELECT * FROM careneeder WHERE id = %s",
-                       (careneeder_id,))
-        row = cursor.fetchone()
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the specific careneeder from the database using the id
+            cursor.execute(CARENEEDER_BY_ID_QUERY,
+                           (careneeder_id,), prepare=True)
+            row = cursor.fetchone()
 
         # Check if a careneeder with the given id exists
         if not row:
@@ -183,20 +249,62 @@ def get_careneeder_detail(careneeder_id):
         return jsonify({"error": "Failed to fetch careneeder detail"}), 500
 
 
+@careneeder_bp.route("/<int:careneeder_id>/matches", methods=["GET"])
+@conditional("careneeder", "caregivers")
+def get_careneeder_matches(careneeder_id):
+    # The caregivers that fit the careneeder best, with their score (see
+    # matching.py)
+    try:
+        limit = int(request.args.get("limit", MATCH_TOP_K))
+    except ValueError:
+        return jsonify({"error": "Invalid value for limit"}), 400
+    if not 1 <= limit <= MATCH_TOP_K:
+        return jsonify({"error": f"limit must be between 1 and {MATCH_TOP_K}"}), 400
+
+    try:
+        with db_cursor() as cursor:
+            matches = matches_for(cursor, careneeder_id)
+
+        if matches is None:
+            return jsonify({"error": "Careneeder not found"}), 404
+        matches = matches[:limit]
+
+        with db_cursor(dict_row, binary=True) as cursor:
+            cursor.execute(
+                f"SELECT {', '.join(CAREGIVER_FIELDS)} FROM caregivers WHERE id = ANY(%s)",
+                ([caregiver_id for caregiver_id, _ in matches],))
+            caregivers = {row["id"]: row for row in cursor.fetchall()}
+
+        rows = []
+        for caregiver_id, match_score in matches:
+            row = caregivers.get(caregiver_id)
+            # Deleted since the matches were computed
+            if row is None:
+                continue
+            row["score"] = round(match_score, 4)
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
+            rows.append(row)
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return response
+    except Exception as e:
+        current_app.logger.error(
+            f"Error matching caregivers for careneeder {careneeder_id}", exc_info=True)
+        return jsonify({"error": "Failed to match caregivers"}), 500
+
+
 @careneeder_bp.route("/mycareneeder/<phone>", methods=["GET"])
+@conditional("careneeder")
 def get_mycareneeders(phone):
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch the careneeders related to the phone number
-        cursor.execute(
-            "SELECT * FROM careneeder WHERE phone = %s ORDER BY id DESC", (phone,))
-        rows = cursor.fetchall()
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch the careneeders related to the phone number
+            cursor.execute(
+                CARENEEDER_BY_PHONE_QUERY, (phone,), prepare=True)
+            rows = cursor.fetchall()
 
         if not rows:
             return jsonify({"error": "Careneeders not found"}), 404
@@ -231,6 +339,7 @@ def get_mycareneeders(phone):
     
 
 @careneeder_bp.route("/careneeder_schedule", methods=["POST"])
+@invalidates("careneederschedule")
 def add_schedule():
     try:
         data = request.get_json()
@@ -257,21 +366,15 @@ def add_schedule():
                 values.append(None)
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f"INSERT INTO careneederschedule ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
-
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_schedule_id = cursor.fetchone()[0]
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f"INSERT INTO careneederschedule ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
 
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_schedule_id = cursor.fetchone()[0]
 
         # Create the returned object based on the Schedule interface
         new_schedule = {
@@ -286,46 +389,36 @@ def add_schedule():
         return jsonify(new_schedule), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()
         current_app.logger.error(
             f"Error adding schedule: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add schedule"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @careneeder_bp.route("/mycareneeder/<int:id>/ad", methods=["PUT"])
+@invalidates("careneederads")
 def update_careneeder_ad(id):
     current_app.logger.debug(f"Entering update_careneeder for id {id}")
     try:
         data = request.get_json()
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
+        with db_cursor() as cursor:
+            # Define the columns and values for the UPDATE query
+            columns = ["title", "description"]
+            values = [data.get(field, None) for field in columns]
 
-        # Define the columns and values for the UPDATE query
-        columns = ["title", "description"]
-        values = [data.get(field, None) for field in columns]
+            current_app.logger.debug(f"Prepared values for SQL update: {values}")
 
-        current_app.logger.debug(f"Prepared values for SQL update: {values}")
+            # Construct the UPDATE query
+            update_query = "UPDATE careneederads SET " + \
+                ', '.join([f"{col} = %s" for col in columns]) + \
+                f" WHERE careneeder_id = {id}"
 
-        # Construct the UPDATE query
-        update_query = "UPDATE careneederads SET " + \
-            ', '.join([f"{col} = %s" for col in columns]) + \
-            f" WHERE careneeder_id = {id}"
+            # Execute the UPDATE query with the values
+            cursor.execute(update_query, values)
 
-        # Execute the UPDATE query with the values
-        cursor.execute(update_query, values)
-
-        current_app.logger.info(f"Received data: {data}")
-        current_app.logger.info(f"Executing query: {update_query}")
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            current_app.logger.info(f"Received data: {data}")
+            current_app.logger.info(f"Executing query: {update_query}")
 
         return jsonify({"success": "更新成功"}), 200
 
@@ -336,6 +429,7 @@ def update_careneeder_ad(id):
 
 
 @careneeder_bp.route("/careneeder_ads", methods=["POST"])
+@invalidates("careneederads")
 def add_careneeder_ad():
     try:
         data = request.get_json()
@@ -354,21 +448,15 @@ def add_careneeder_ad():
                 values.append(None)
 
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Construct the INSERT query with placeholders for all columns
-        columns_placeholder = ', '.join(columns)
-        values_placeholder = ', '.join(['%s'] * len(columns))
-        insert_query = f"INSERT INTO careneederads ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
+        with db_cursor() as cursor:
+            # Construct the INSERT query with placeholders for all columns
+            columns_placeholder = ', '.join(columns)
+            values_placeholder = ', '.join(['%s'] * len(columns))
+            insert_query = f"INSERT INTO careneederads ({columns_placeholder}) VALUES ({values_placeholder}) RETURNING id"
 
-        # Execute the INSERT query with the values
-        cursor.execute(insert_query, values)
-        new_ad_id = cursor.fetchone()[0]
-
-        # Commit the changes and close the connection
-        conn.commit()
-        cursor.close()
+            # Execute the INSERT query with the values
+            cursor.execute(insert_query, values)
+            new_ad_id = cursor.fetchone()[0]
 
         # Create the returned object based on the ad interface
         new_ad = {
@@ -383,46 +471,35 @@ def add_careneeder_ad():
         return jsonify(new_ad), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()  # Rolling back in case of an error
         current_app.logger.error(
             f"Error adding careneeder ad: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to add careneeder ad"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @careneeder_bp.route('/all_careneederschedule', methods=['GET'])
+@conditional("careneederschedule")
+@cached("careneederschedule")
+@streamable(ALL_SCHEDULES_QUERY)
 def get_all_careneederschedule():
     current_app.logger.info("Entering GET /all_careneederschedule request")
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Fetch careneederschedule data from the database
-        cursor.execute("SELECT * FROM careneederschedule ORDER BY id DESC")
-        rows = cursor.fetchall()
-        current_app.logger.debug(
-            f"Fetched {len(rows)} careneederschedule records from the database")
-
-        # Close the connection
-        cursor.close()
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Fetch careneederschedule data from the database
+            cursor.execute(ALL_SCHEDULES_QUERY)
+            rows = cursor.fetchall()
+            current_app.logger.debug(
+                f"Fetched {len(rows)} careneederschedule records from the database")
 
         if not rows:
             current_app.logger.warning(
                 "No careneederschedule records found in the database")
             return jsonify({"error": "No careneederschedule data available"}), 404
 
-        # Format the data for JSON
-
-        careneederschedule = [dict(row) for row in rows]
-
         current_app.logger.debug(
             "Successfully processed all careneederschedule data")
 
-        response = make_response(jsonify(careneederschedule))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
@@ -433,21 +510,19 @@ def get_all_careneederschedule():
 
 
 @careneeder_bp.route("/all_careneederads", methods=["GET"])
+@conditional("careneederads")
+@cached("careneederads")
+@streamable(ALL_ADS_QUERY)
 def get_careneeder_ads():
-    conn = None
     try:
         # Connect to the PostgreSQL database
-        conn = get_db()
-        # Use DictCursor to fetch rows as dictionaries
-        cursor = conn.cursor(cursor_factory=DictCursor)
+        # Use dict_row to fetch rows as dictionaries
+        with db_cursor(dict_row, binary=True) as cursor:
+            # Execute the SELECT query to fetch all records from the table
+            cursor.execute(ALL_ADS_QUERY)
 
-        # Execute the SELECT query to fetch all records from the table
-        select_query = "SELECT * FROM careneederads ORDER BY id DESC"
-        cursor.execute(select_query)
-
-        # Fetch all rows and close the cursor
-        rows = cursor.fetchall()
-        cursor.close()
+            # Fetch all rows
+            rows = cursor.fetchall()
 
         current_app.logger.debug(
             f"Fetched {len(rows)} careneederads records from the database")
@@ -461,22 +536,70 @@ def get_careneeder_ads():
                 "No careneederads records found in the database")
             return jsonify({"error": "No careneederads data available"}), 404
 
-        careneederads = [dict(row) for row in rows]
-
         current_app.logger.debug("Successfully processed all careneederads data")
 
-        response = make_response(jsonify(careneederads))
+        response = make_response(jsonify(rows))
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
         return response
 
     except Exception as e:
-        if conn:
-            conn.rollback()  # Rolling back in case of an error
         current_app.logger.error(
             f"Error fetching careneeder ads: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to fetch careneeder ads"}), 500
 
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+
+@careneeder_bp.route("/ad_cards", methods=["GET"])
+@conditional("careneederads", "careneeder", "careneederschedule")
+@cached("careneederads", "careneeder", "careneederschedule")
+def get_careneeder_ad_cards():
+    # Ads with their careneeder and schedules, one page at a time (see adcards.py)
+    try:
+        limit, after_id = page_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            cards, rows = ad_cards(
+                cursor, "careneederads", "careneeder_id", "careneeder", CARENEEDER_FIELDS,
+                {"schedules": ("careneederschedule", "careneeder_id", ["*"])},
+                limit, after_id)
+
+        response = make_response(jsonify(cards))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_next_cursor(response, rows, limit)
+    except Exception as e:
+        current_app.logger.error("Error fetching careneeder ad cards", exc_info=True)
+        return jsonify({"error": "Failed to fetch careneeder ad cards"}), 500
+
+
+@careneeder_bp.route("/availability", methods=["GET"])
+@conditional("careneeder", "careneederschedule")
+@cached("careneeder", "careneederschedule")
+def get_available_careneeders():
+    # Careneeders with a schedule in a window of dates, weekdays and hours,
+    # each with those schedules (see availability.py)
+    try:
+        window = availability_window(request.args)
+        limit, after_id = page_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with db_cursor(dict_row, binary=True) as cursor:
+            rows = available_profiles(
+                cursor, "careneeder", "careneederschedule", "careneeder_id", "careneeder", CARENEEDER_FIELDS,
+                window, limit, after_id)
+
+        for row in rows:
+            row["thumbnails"] = thumbnail_urls(row["imageurl"])
+
+        response = make_response(jsonify(rows))
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        response.headers['Pragma'] = 'no-cache'
+        return set_next_cursor(response, rows, limit)
+    except Exception as e:
+        current_app.logger.error("Error fetching available careneeders", exc_info=True)
+        return jsonify({"error": "Failed to fetch available careneeders"}), 500
@@ -1,6 +1,11 @@
 # db.py
-from flask import g
-import psycopg2.pool
+from contextlib import contextmanager
+from flask import g, has_app_context
+import psycopg
+from psycopg_pool import ConnectionPool, PoolTimeout
+import threading
+import time
+import weakref
 import os
 
 # Database configuration
@@ -12,17 +17,211 @@ db_config = {
     "port": os.environ.get("DB_PORT"),
 }
 
-# Setting up a connection pool
-db_pool = psycopg2.pool.SimpleConnectionPool(1, 20, **db_config)
+# Pool configuration (seconds for the time based settings)
+pool_config = {
+    "min_size": int(os.environ.get("DB_POOL_MIN", 1)),
+    "max_size": int(os.environ.get("DB_POOL_MAX", 20)),
+    # How long a request waits for a free connection before giving up
+    "timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+    # Connections older than this are closed and replaced
+    "max_lifetime": float(os.environ.get("DB_POOL_MAX_AGE", 30 * 60)),
+    # Connections unused for longer than this are closed and replaced
+    "max_idle": float(os.environ.get("DB_POOL_MAX_IDLE", 5 * 60)),
+}
+
+# DB_POOL_MAX is the connection budget of the whole process. Under asgi.py,
+# ASYNC_POOL_MAX of it goes to the async pool and db_pool keeps the rest (see
+# async_pool_config).
+ASYNC_POOL_MAX = int(os.environ.get("ASYNC_POOL_MAX", pool_config["max_size"] // 2))
+
+# Connections idle for longer than this are probed with SELECT 1 on checkout
+CHECK_AFTER = float(os.environ.get("DB_POOL_CHECK_AFTER", 5))
+
+# Rows fetched per round trip when streaming a result set (see RowStream)
+STREAM_BATCH_SIZE = int(os.environ.get("DB_STREAM_BATCH_SIZE", 500))
+
+# Upper bounds (ms) of the buckets of the pool wait time histogram
+WAIT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+# Setting up a connection pool. psycopg_pool blocks getconn() up to `timeout`
+# when every connection is checked out, discards broken connections when they
+# are returned and recycles them by age and idle time.
+db_pool = ConnectionPool(kwargs=db_config, name="caregiver", **pool_config)
+
+# What the pool does not do is check connections before handing them out, so
+# connections that sat idle (and may have been killed by a failover) are
+# probed in get_db.
+_returned_at = weakref.WeakKeyDictionary()
+
+_stats_lock = threading.Lock()
+_reconnects = 0
+_wait_counts = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+
+def _record_wait(waited_ms):
+    with _stats_lock:
+        for i, bound in enumerate(WAIT_BUCKETS_MS):
+            if waited_ms <= bound:
+                _wait_counts[i] += 1
+                return
+        _wait_counts[-1] += 1
+
+
+def _is_alive(conn):
+    try:
+        conn.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg.Error:
+        return False
+
+
+def async_pool_config():
+    # Settings of an async pool taking ASYNC_POOL_MAX of the budget; db_pool
+    # shrinks to what is left. Each pool keeps at least one connection.
+    budget = pool_config["max_size"]
+    async_max = max(1, min(ASYNC_POOL_MAX, budget - 1))
+    sync_max = max(1, budget - async_max)
+    db_pool.resize(min(pool_config["min_size"], sync_max), sync_max)
+    return {**pool_config, "min_size": min(pool_config["min_size"], async_max),
+            "max_size": async_max}
+
+
+def _checkout():
+    global _reconnects
+
+    # Bounded so a database that is down fails the request instead of looping
+    for _ in range(pool_config["max_size"] + 1):
+        started = time.monotonic()
+        conn = db_pool.getconn()
+        _record_wait((time.monotonic() - started) * 1000)
+
+        returned_at = _returned_at.get(conn)
+        if returned_at is None or time.monotonic() - returned_at <= CHECK_AFTER or _is_alive(conn):
+            return conn
+
+        # The pool throws away broken connections when they are returned
+        db_pool.putconn(conn)
+        with _stats_lock:
+            _reconnects += 1
+
+    raise psycopg.OperationalError("Could not get a working database connection")
+
+
+def get_db_stats():
+    stats = db_pool.get_stats()
+    with _stats_lock:
+        return {
+            "size": stats.get("pool_size", 0),
+            "max": stats.get("pool_max", pool_config["max_size"]),
+            "in_use": stats.get("pool_size", 0) - stats.get("pool_available", 0),
+            "idle": stats.get("pool_available", 0),
+            "waiting": stats.get("requests_waiting", 0),
+            "connects": stats.get("connections_num", 0),
+            "reconnects": _reconnects,
+            "lost": stats.get("connections_lost", 0) + stats.get("returns_bad", 0),
+            "timeouts": stats.get("requests_errors", 0),
+            "wait_ms_total": stats.get("requests_wait_ms", 0),
+            "wait_ms_histogram": {
+                **{f"<={bound}ms": count for bound, count in zip(WAIT_BUCKETS_MS, _wait_counts)},
+                f">{WAIT_BUCKETS_MS[-1]}ms": _wait_counts[-1],
+            },
+        }
+
 
 def get_db():
     if 'db' not in g:
-        g.db = db_pool.getconn()
+        g.db = _checkout()
     return g.db
 
+@contextmanager
+def db_cursor(row_factory=None, binary=False):
+    # Cursor on the connection of the current request. The transaction is
+    # committed when the block exits normally and rolled back when it raises.
+    # The connection itself stays open and goes back to the pool in close_db,
+    # handlers must never close it.
+    #
+    # Pass row_factory=dict_row to get rows as dicts and binary=True to have
+    # the server send results in binary format (cheaper to parse for numbers,
+    # timestamps and arrays).
+    conn = get_db()
+    cursor = conn.cursor(row_factory=row_factory, binary=binary)
+    try:
+        yield cursor
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def take_db():
+    # The connection of the current request, handed over to the caller, which
+    # must give it back with release_db (close_db no longer will). Checks one
+    # out when the request has none, so that a request never holds two.
+    if has_app_context() and 'db' in g:
+        return g.pop('db')
+    return _checkout()
+
+def release_db(conn):
+    _returned_at[conn] = time.monotonic()
+    db_pool.putconn(conn)
+
 def close_db(error):
-    # If this request used the database, close the used connection
+    # If this request used the database, return the connection to the pool
     db = g.pop('db', None)
 
     if db is not None:
-        db_pool.putconn(db)
\ No newline at end of file
+        release_db(db)
+
+
+class RowStream:
+    # The rows of a query read through a named (server-side) cursor, in
+    # batches of batch_size, so that only one batch at a time is held in
+    # memory whatever the size of the result.
+    #
+    # Streamed response bodies are produced after the request's app context,
+    # and with it close_db, is gone, so the stream takes over the request's
+    # connection (see take_db; decorators such as etags.conditional have
+    # usually checked it out already). It goes back to the pool in close(),
+    # which WSGI servers call once the response is sent or the client went
+    # away. Code holding a cursor of the request must not open one: reading
+    # through a named cursor of its own connection does the same.
+    def __init__(self, query, params=None, row_factory=None, batch_size=STREAM_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.conn = take_db()
+        try:
+            self.cursor = self.conn.cursor(name=f"stream_{id(self):x}",
+                                           row_factory=row_factory, binary=True)
+            self.cursor.itersize = batch_size
+            self.cursor.execute(query, params)
+            # Read now so that errors and empty results are known before the
+            # response starts
+            self.first = self.cursor.fetchmany(batch_size)
+        except Exception:
+            self.close()
+            raise
+
+    def __iter__(self):
+        # Yields lists of rows
+        try:
+            batch = self.first
+            while batch:
+                yield batch
+                batch = self.cursor.fetchmany(self.batch_size)
+        finally:
+            self.close()
+
+    def close(self):
+        conn, self.conn = self.conn, None
+        if conn is None:
+            return
+        try:
+            # Closed here, not when garbage collected, by then the connection
+            # may serve another request
+            if getattr(self, "cursor", None) is not None:
+                self.cursor.close()
+            conn.rollback()
+        except psycopg.Error:
+            pass
+        release_db(conn)
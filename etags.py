@@ -0,0 +1,88 @@
+# etags.py
+# Conditional GET for the read endpoints. Every table has a version counter
+# and a last write time in table_versions, kept by triggers (see
+# migrations/005_table_versions.sql). An endpoint reading some tables gets a
+# strong ETag derived from its path, query string and the versions of those
+# tables, and their latest write time as Last-Modified. When the client
+# already has that version, the answer is a 304 and the endpoint's own query
+# and JSON encoding never run.
+#
+# The versions are read before the endpoint runs, so a write landing in
+# between can only make the ETag older than the body, never newer.
+import hashlib
+import os
+from functools import wraps
+
+from flask import make_response, request
+from werkzeug.http import http_date, parse_date, parse_etags
+
+from cache import cache_key
+from db import db_cursor
+
+VERSIONS_QUERY = """SELECT table_name, version, updated_at FROM table_versions
+                   WHERE table_name = ANY(%s::text[])"""
+
+# Part of every ETag; change it (e.g. to the image tag) when a deploy changes
+# the shape of the responses
+ETAG_VERSION = os.environ.get("ETAG_VERSION", "1")
+
+# Replaces no-store on responses that carry validators, so that clients keep
+# them and revalidate on every use
+REVALIDATE = "no-cache"
+
+
+def validators(key, versions):
+    # (etag, last_modified) for the response at `key` (see cache.cache_key)
+    # given the rows of VERSIONS_QUERY
+    digest = hashlib.sha1(repr((ETAG_VERSION, key,
+                                sorted((table, version) for table, version, _ in versions)))
+                          .encode("utf-8")).hexdigest()
+    return digest, max(updated_at for _, _, updated_at in versions)
+
+
+def not_modified(etag, last_modified, if_none_match, if_modified_since):
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if if_none_match:
+        return parse_etags(if_none_match).contains(etag)
+    if if_modified_since:
+        since = parse_date(if_modified_since)
+        return since is not None and last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def set_validators(headers, etag, last_modified):
+    headers["ETag"] = f'"{etag}"'
+    headers["Last-Modified"] = http_date(last_modified)
+    headers["Cache-Control"] = REVALIDATE
+    if "Pragma" in headers:
+        del headers["Pragma"]
+
+
+def conditional(*tables):
+    # For GET views that read `tables`
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with db_cursor() as cursor:
+                cursor.execute(VERSIONS_QUERY, (list(tables),), prepare=True)
+                versions = cursor.fetchall()
+
+            # Tables without a version row (migration not applied yet)
+            if len(versions) != len(tables):
+                return view(*args, **kwargs)
+
+            etag, last_modified = validators(
+                cache_key(request.path, request.args.items(multi=True)), versions)
+
+            if not_modified(etag, last_modified, request.headers.get("If-None-Match"),
+                            request.headers.get("If-Modified-Since")):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            set_validators(response.headers, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
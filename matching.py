@@ -0,0 +1,235 @@
+# matching.py
+# Caregiver candidates for a careneeder (/api/careneeder/<id>/matches).
+#
+# Every caregiver gets a score between 0 and 1 against the careneeder, the
+# MATCH_WEIGHTS weighted sum of:
+#   location    1 when they share a district (see
+#               migrations/009_profile_locations.sql), else decaying with the
+#               distance between their points over MATCH_DISTANCE_KM
+#   price       1 when the caregiver's hourlycharge is within the
+#               careneeder's, falling to 0 at twice it
+#   experience  years_of_experience, full at MATCH_FULL_EXPERIENCE_YEARS
+# The caregivers table has no service columns, so the careneeder's service
+# flags do not take part.
+#
+# Caregivers are read MATCH_BATCH_SIZE at a time through a server-side cursor
+# on the request's connection into NumPy arrays (districts as bitsets) and
+# scored a batch at a time. The best MATCH_TOP_K are kept in
+# careneeder_matches (migrations/011_careneeder_matches.sql) with the highest
+# caregiver id scored. While the caregivers table is unchanged they are served
+# as they are. Otherwise, while every kept caregiver is unchanged, only the
+# caregivers added since and those whose scored fields changed since
+# (caregiver_changes, kept by a trigger) are scored and merged with the kept
+# ones. A kept caregiver that changed or was deleted may leave room for any
+# other, so the list is then computed again from scratch, as are lists older
+# than MATCH_REFRESH_SECONDS and those of careneeders whose profile changed.
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+MATCH_TOP_K = int(os.environ.get("MATCH_TOP_K", 50))
+MATCH_DISTANCE_KM = float(os.environ.get("MATCH_DISTANCE_KM", 5))
+MATCH_FULL_EXPERIENCE_YEARS = float(os.environ.get("MATCH_FULL_EXPERIENCE_YEARS", 10))
+MATCH_REFRESH_SECONDS = int(os.environ.get("MATCH_REFRESH_SECONDS", 3600))
+MATCH_BATCH_SIZE = int(os.environ.get("MATCH_BATCH_SIZE", 10000))
+# location, price, experience
+MATCH_WEIGHTS = [float(weight) for weight in
+                 os.environ.get("MATCH_WEIGHTS", "0.5,0.35,0.15").split(",")]
+
+EARTH_RADIUS_KM = 6371.0
+
+NEED_QUERY = """SELECT hourlycharge::float8, district_codes, lat, lng
+                FROM careneeder WHERE id = %s"""
+
+STORED_QUERY = """SELECT v.version, m.caregiver_ids, m.scores, m.max_caregiver_id, m.need_key,
+                         m.caregivers_version, m.computed_at > now() - make_interval(secs => %s),
+                         m.scored_at
+                  FROM (SELECT (SELECT version FROM table_versions
+                                WHERE table_name = 'caregivers') AS version) v
+                  LEFT JOIN careneeder_matches m ON m.careneeder_id = %s"""
+
+CAREGIVER_FEATURES_QUERY = """SELECT id, hourlycharge::float8, years_of_experience::float8,
+                                     district_codes, lat, lng
+                              FROM caregivers
+                              WHERE id > %s OR id IN (
+                                  SELECT caregiver_id FROM caregiver_changes WHERE changed_at > %s)"""
+
+# Whether a kept caregiver changed or was deleted since the list was scored
+KEPT_STALE_QUERY = """SELECT EXISTS (SELECT 1 FROM caregiver_changes
+                                     WHERE caregiver_id = ANY(%s) AND changed_at > %s)
+                          OR (SELECT count(*) FROM caregivers WHERE id = ANY(%s)) < cardinality(%s)"""
+
+# A full computation sets computed_at, an incremental one keeps it
+STORE_QUERY = """INSERT INTO careneeder_matches (careneeder_id, caregiver_ids, scores,
+                     max_caregiver_id, need_key, caregivers_version, computed_at, scored_at)
+                 VALUES (%s, %s, %s, %s, %s, %s, now(), now())
+                 ON CONFLICT (careneeder_id) DO UPDATE SET
+                     caregiver_ids = EXCLUDED.caregiver_ids, scores = EXCLUDED.scores,
+                     max_caregiver_id = EXCLUDED.max_caregiver_id, need_key = EXCLUDED.need_key,
+                     caregivers_version = EXCLUDED.caregivers_version, scored_at = now(),
+                     computed_at = CASE WHEN %s THEN now() ELSE careneeder_matches.computed_at END"""
+
+# district code -> bit of the district bitsets. Filled as codes are seen;
+# past 64 codes bits are shared, which only adds false "same district"s.
+_district_bits = {}
+_bits_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "served": 0,
+    "full": 0,
+    "incremental": 0,
+    "caregivers_scored": 0,
+    "score_seconds": 0.0,
+}
+
+
+def district_mask(codes):
+    mask = 0
+    for code in codes or ():
+        bit = _district_bits.get(code)
+        if bit is None:
+            with _bits_lock:
+                bit = _district_bits.setdefault(code, len(_district_bits) % 64)
+        mask |= 1 << bit
+    return np.uint64(mask)
+
+
+def _float(value):
+    return np.nan if value is None else value
+
+
+def _distance_km(lat, lng, lats, lngs):
+    # From one point to each of lats/lngs, NaN where a point is missing
+    lat, lng, lats, lngs = np.radians(lat), np.radians(lng), np.radians(lats), np.radians(lngs)
+    a = (np.sin((lats - lat) / 2) ** 2
+         + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def score(need, charges, experience, masks, lats, lngs):
+    # Scores of the caregivers whose features are given as arrays, against
+    # need (a row of NEED_QUERY)
+    budget, codes, lat, lng = need
+
+    shared = (masks & district_mask(codes)) != 0
+    location = shared.astype(np.float64)
+    if lat is not None and lng is not None:
+        nearby = np.exp(-_distance_km(lat, lng, lats, lngs) / MATCH_DISTANCE_KM)
+        location = np.where(shared, 1.0, np.nan_to_num(nearby))
+
+    if budget is not None and budget > 0:
+        price = np.clip(2.0 - charges / budget, 0.0, 1.0)
+        price = np.where(np.isnan(charges), 0.5, price)
+    else:
+        price = np.full(len(charges), 0.5)
+
+    seniority = np.nan_to_num(np.clip(experience / MATCH_FULL_EXPERIENCE_YEARS, 0.0, 1.0))
+
+    location_weight, price_weight, experience_weight = MATCH_WEIGHTS
+    return location_weight * location + price_weight * price + experience_weight * seniority
+
+
+def _top(ids, scores):
+    # The best MATCH_TOP_K, best first and newest first among equals (a
+    # partial sort would drop arbitrary ones among equal scores)
+    order = np.lexsort((-ids, -scores))[:MATCH_TOP_K]
+    return ids[order], scores[order]
+
+
+def _batches(cursor, query, params):
+    # The rows of query MATCH_BATCH_SIZE at a time, through a server-side
+    # cursor on the connection of cursor (a db.RowStream would hold a second
+    # connection of the pool for the request)
+    with cursor.connection.cursor(name="match_candidates", binary=True) as named:
+        named.itersize = MATCH_BATCH_SIZE
+        named.execute(query, params)
+        while True:
+            batch = named.fetchmany(MATCH_BATCH_SIZE)
+            if not batch:
+                return
+            yield batch
+
+
+def _candidates(cursor, need, since_id, changed_since, kept_ids=(), kept_scores=()):
+    # Scores the caregivers with an id above since_id and those changed after
+    # changed_since (none when None), and merges them with the kept ones.
+    # Returns the (ids, scores) of the best and the highest id seen.
+    started = time.monotonic()
+    ids = np.array(kept_ids, dtype=np.int64)
+    scores = np.array(kept_scores, dtype=np.float64)
+    max_id = since_id
+    scored = 0
+
+    for batch in _batches(cursor, CAREGIVER_FEATURES_QUERY, (since_id, changed_since)):
+        batch_ids = np.fromiter((row[0] for row in batch), dtype=np.int64, count=len(batch))
+        batch_scores = score(
+            need,
+            np.fromiter((_float(row[1]) for row in batch), dtype=np.float64, count=len(batch)),
+            np.fromiter((_float(row[2]) for row in batch), dtype=np.float64, count=len(batch)),
+            np.fromiter((district_mask(row[3]) for row in batch), dtype=np.uint64, count=len(batch)),
+            np.fromiter((_float(row[4]) for row in batch), dtype=np.float64, count=len(batch)),
+            np.fromiter((_float(row[5]) for row in batch), dtype=np.float64, count=len(batch)))
+        # A changed caregiver is scored again, its old score goes
+        fresh = ~np.isin(ids, batch_ids)
+        ids, scores = _top(np.concatenate((ids[fresh], batch_ids)),
+                           np.concatenate((scores[fresh], batch_scores)))
+        max_id = max(max_id, int(batch_ids.max()))
+        scored += len(batch)
+
+    with _stats_lock:
+        _stats["caregivers_scored"] += scored
+        _stats["score_seconds"] += time.monotonic() - started
+    return ids, scores, max_id
+
+
+def matches_for(cursor, careneeder_id):
+    # [(caregiver_id, score), ...], best first, or None when there is no such
+    # careneeder. cursor returns tuples.
+    cursor.execute(NEED_QUERY, (careneeder_id,), prepare=True)
+    need = cursor.fetchone()
+    if need is None:
+        return None
+    need_key = json.dumps(need, default=str)
+
+    cursor.execute(STORED_QUERY, (MATCH_REFRESH_SECONDS, careneeder_id), prepare=True)
+    (version, kept_ids, kept_scores, max_id, stored_key, stored_version, fresh,
+     scored_at) = cursor.fetchone()
+
+    full = kept_ids is None or stored_key != need_key or not fresh
+    if not full:
+        if version is not None and stored_version == version:
+            with _stats_lock:
+                _stats["served"] += 1
+            return list(zip(kept_ids, kept_scores))
+        cursor.execute(KEPT_STALE_QUERY, (kept_ids, scored_at, kept_ids, kept_ids))
+        full = cursor.fetchone()[0]
+
+    if full:
+        ids, scores, max_id = _candidates(cursor, need, 0, None)
+    else:
+        # Caregivers outside the list whose price, district or experience
+        # changed may belong in it now
+        ids, scores, max_id = _candidates(cursor, need, max_id, scored_at, kept_ids, kept_scores)
+    with _stats_lock:
+        _stats["full" if full else "incremental"] += 1
+
+    ids, scores = ids.tolist(), scores.tolist()
+    cursor.execute(STORE_QUERY, (careneeder_id, ids, scores, max_id, need_key, version, full))
+    return list(zip(ids, scores))
+
+
+def get_match_stats():
+    with _stats_lock:
+        seconds = _stats["score_seconds"]
+        return {
+            "served": _stats["served"],
+            "full": _stats["full"],
+            "incremental": _stats["incremental"],
+            "caregivers_scored": _stats["caregivers_scored"],
+            # Scoring throughput, database reads included
+            "caregivers_per_second": int(_stats["caregivers_scored"] / seconds) if seconds else 0,
+        }
@@ -0,0 +1,40 @@
+-- Indexes backing the keyset paginated, filterable listing endpoints
+-- (/all_caregivers, /all_careneeders, /all_animalcaregivers, /all_animalcareneeders).
+-- Paging itself walks the primary key backwards (ORDER BY id DESC, id < after_id);
+-- the indexes below serve the optional filters while keeping that order.
+
+-- location is a JSON encoded list of districts, filtered with
+-- location_jsonb(location) ? district. Rows written before it was encoded hold
+-- plain text, which location_jsonb reads as a JSON string: a bare location::jsonb
+-- index would fail on them, on its creation and on every write of such a value.
+CREATE OR REPLACE FUNCTION location_jsonb(location text) RETURNS jsonb AS $$
+BEGIN
+    RETURN location::jsonb;
+EXCEPTION WHEN invalid_text_representation THEN
+    RETURN to_jsonb(location);
+END
+$$ LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE;
+
+DROP INDEX IF EXISTS caregivers_location_idx;
+DROP INDEX IF EXISTS careneeder_location_idx;
+DROP INDEX IF EXISTS animalcaregiverform_location_idx;
+DROP INDEX IF EXISTS animalcareneederform_location_idx;
+CREATE INDEX IF NOT EXISTS caregivers_location_json_idx ON caregivers USING GIN (location_jsonb(location));
+CREATE INDEX IF NOT EXISTS careneeder_location_json_idx ON careneeder USING GIN (location_jsonb(location));
+CREATE INDEX IF NOT EXISTS animalcaregiverform_location_json_idx ON animalcaregiverform USING GIN (location_jsonb(location));
+CREATE INDEX IF NOT EXISTS animalcareneederform_location_json_idx ON animalcareneederform USING GIN (location_jsonb(location));
+
+CREATE INDEX IF NOT EXISTS caregivers_hourlycharge_id_idx ON caregivers (hourlycharge, id DESC);
+CREATE INDEX IF NOT EXISTS careneeder_hourlycharge_id_idx ON careneeder (hourlycharge, id DESC);
+
+CREATE INDEX IF NOT EXISTS caregivers_gender_id_idx ON caregivers (gender, id DESC);
+CREATE INDEX IF NOT EXISTS animalcaregiverform_gender_id_idx ON animalcaregiverform (gender, id DESC);
+CREATE INDEX IF NOT EXISTS animalcareneederform_gender_id_idx ON animalcareneederform (gender, id DESC);
+
+CREATE INDEX IF NOT EXISTS caregivers_age_id_idx ON caregivers (age, id DESC);
+CREATE INDEX IF NOT EXISTS animalcaregiverform_age_id_idx ON animalcaregiverform (age, id DESC);
+CREATE INDEX IF NOT EXISTS animalcareneederform_age_id_idx ON animalcareneederform (age, id DESC);
+
+CREATE INDEX IF NOT EXISTS caregivers_experience_id_idx ON caregivers (years_of_experience, id DESC);
+CREATE INDEX IF NOT EXISTS animalcaregiverform_experience_id_idx ON animalcaregiverform (years_of_experience, id DESC);
+CREATE INDEX IF NOT EXISTS animalcareneederform_experience_id_idx ON animalcareneederform (years_of_experience, id DESC);
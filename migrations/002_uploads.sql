@@ -0,0 +1,15 @@
+-- Images uploaded through /api/upload or directly to S3 with a presigned
+-- request (/api/upload/presign, then /api/upload/complete). The create
+-- endpoints accept the key of a 'complete' upload as image_key.
+CREATE TABLE IF NOT EXISTS uploads (
+    key text PRIMARY KEY,
+    content_type text NOT NULL,
+    status text NOT NULL DEFAULT 'pending',
+    size bigint,
+    url text,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    completed_at timestamptz
+);
+
+-- Lets a cleanup job find presigned uploads that were never completed
+CREATE INDEX IF NOT EXISTS uploads_pending_created_at_idx ON uploads (created_at) WHERE status = 'pending';
@@ -0,0 +1,10 @@
+-- Indexes for the incremental chat endpoints (/api/fetch_messages and
+-- /api/fetch_messages_chat_conversation with since_id, since_ts, before_id or
+-- limit). Each poll becomes a short range scan at the end of one
+-- conversation's messages, however long the conversation is.
+-- CONCURRENTLY so that the messages table stays writable; run outside of a
+-- transaction block.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_conversation_ad_id_idx
+    ON messages (conversation_id, ad_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_conversation_ad_createtime_idx
+    ON messages (conversation_id, ad_id, createtime);
@@ -0,0 +1,37 @@
+-- Inbox entries behind /api/list_conversations: one row per participant and
+-- (conversation, ad, ad_type) with the last message and the number of
+-- messages the participant has not read yet. handle_message keeps them up to
+-- date in the same transaction as the message, /api/mark_read resets
+-- unread_count.
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    owner_phone text NOT NULL,
+    other_user_phone text NOT NULL,
+    conversation_id integer NOT NULL,
+    ad_id integer NOT NULL,
+    -- '' when the messages have no ad_type, so it can be part of the key
+    ad_type text NOT NULL DEFAULT '',
+    last_message_id integer NOT NULL,
+    last_message text,
+    last_createtime timestamp,
+    unread_count integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner_phone, conversation_id, ad_id, ad_type)
+);
+
+CREATE INDEX IF NOT EXISTS conversation_summaries_inbox_idx
+    ON conversation_summaries (owner_phone, last_createtime DESC);
+
+-- Backfill from the existing messages, everything counts as read
+INSERT INTO conversation_summaries (owner_phone, other_user_phone, conversation_id, ad_id,
+    ad_type, last_message_id, last_message, last_createtime)
+SELECT p.owner_phone, p.other_user_phone, m.conversation_id, m.ad_id,
+       COALESCE(m.ad_type, ''), m.id, m.content, m.createtime
+FROM (
+    SELECT DISTINCT ON (conversation_id, ad_id, COALESCE(ad_type, ''))
+        id, conversation_id, ad_id, ad_type, content, createtime
+    FROM messages
+    ORDER BY conversation_id, ad_id, COALESCE(ad_type, ''), id DESC
+) m
+JOIN conversations c ON c.id = m.conversation_id
+CROSS JOIN LATERAL (VALUES (c.user1_phone, c.user2_phone),
+                           (c.user2_phone, c.user1_phone)) AS p (owner_phone, other_user_phone)
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,37 @@
+-- Version counter per table, bumped by a statement level trigger on every
+-- write. The read endpoints derive their ETag and Last-Modified from it and
+-- answer If-None-Match / If-Modified-Since with 304 without running their
+-- query (see etags.py).
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name text PRIMARY KEY,
+    version bigint NOT NULL DEFAULT 0,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO table_versions (table_name, version, updated_at)
+    VALUES (TG_TABLE_NAME, 1, now())
+    ON CONFLICT (table_name) DO UPDATE
+        SET version = table_versions.version + 1, updated_at = now();
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'caregivers', 'caregiverschedule', 'caregiverads',
+        'careneeder', 'careneederschedule', 'careneederads',
+        'animalcaregiver', 'animalcaregiverform', 'animalcaregiverschedule', 'animalcaregiverads',
+        'animalcareneeder', 'animalcareneederform', 'animalcareneederschedule', 'animalcareneederads'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_version', t);
+        EXECUTE format('CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()', t || '_version', t);
+        INSERT INTO table_versions (table_name) VALUES (t) ON CONFLICT DO NOTHING;
+    END LOOP;
+END
+$$;
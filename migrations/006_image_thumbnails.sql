@@ -0,0 +1,25 @@
+-- SQL twin of thumbnails.thumbnail_urls, for the listings whose JSON body is
+-- built by Postgres (see pgjson.py):
+--   {"128": {"jpeg": url, "webp": url}, ...} for images under one of the
+--   managed prefixes, {} for anything else.
+-- Keys are derived as in thumbnails.thumbnail_key:
+--   <public_url>/images/<sha256>.jpg -> <public_url>/thumbnails/images/<sha256>/128.webp
+CREATE OR REPLACE FUNCTION image_thumbnails(imageurl text, public_url text,
+                                            prefixes text[], widths int[])
+RETURNS json AS $$
+    SELECT CASE
+        WHEN k.key IS NULL OR NOT EXISTS (
+            SELECT 1 FROM unnest(prefixes) AS p WHERE left(k.key, length(p)) = p)
+        THEN '{}'::json
+        ELSE (SELECT json_object_agg(
+                         w::text,
+                         json_build_object(
+                             'jpeg', public_url || '/thumbnails/' || s.stem || '/' || w || '.jpg',
+                             'webp', public_url || '/thumbnails/' || s.stem || '/' || w || '.webp')
+                         ORDER BY w::text)
+              FROM unnest(widths) AS w,
+                   LATERAL (SELECT regexp_replace(k.key, '\.[^./]*$', '') AS stem) AS s)
+    END
+    FROM (SELECT CASE WHEN left(imageurl, length(public_url) + 1) = public_url || '/'
+                      THEN substr(imageurl, length(public_url) + 2) END AS key) AS k
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
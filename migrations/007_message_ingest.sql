@@ -0,0 +1,57 @@
+-- Unique keys for the batched message ingest (POST /api/handle_message/batch)
+-- and the conversation lookup of /api/handle_message:
+--   * one conversation per pair of phones, whichever of them wrote first, so
+--     that conversations can be found or created with INSERT ... ON CONFLICT
+--   * one message per ably_message_id, so that replayed messages are skipped
+--
+-- Concurrent first messages could create the same conversation twice before
+-- this; such duplicates are merged into the oldest one first.
+BEGIN;
+
+CREATE TEMP TABLE conversation_merges ON COMMIT DROP AS
+SELECT id, keep FROM (
+    SELECT id, min(id) OVER (PARTITION BY LEAST(user1_phone, user2_phone),
+                                          GREATEST(user1_phone, user2_phone)) AS keep
+    FROM conversations
+) c
+WHERE id <> keep;
+
+UPDATE messages m SET conversation_id = cm.keep
+FROM conversation_merges cm WHERE m.conversation_id = cm.id;
+
+-- Inbox entries of the merged conversations, combined with those of the kept one
+INSERT INTO conversation_summaries AS s (owner_phone, other_user_phone, conversation_id, ad_id,
+    ad_type, last_message_id, last_message, last_createtime, unread_count)
+SELECT s2.owner_phone, min(s2.other_user_phone), cm.keep, s2.ad_id, s2.ad_type,
+       max(s2.last_message_id),
+       (array_agg(s2.last_message ORDER BY s2.last_message_id DESC))[1],
+       (array_agg(s2.last_createtime ORDER BY s2.last_message_id DESC))[1],
+       sum(s2.unread_count)
+FROM conversation_summaries s2
+JOIN conversation_merges cm ON cm.id = s2.conversation_id
+GROUP BY s2.owner_phone, cm.keep, s2.ad_id, s2.ad_type
+ON CONFLICT (owner_phone, conversation_id, ad_id, ad_type) DO UPDATE SET
+    last_message_id = GREATEST(s.last_message_id, EXCLUDED.last_message_id),
+    last_message = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+        THEN EXCLUDED.last_message ELSE s.last_message END,
+    last_createtime = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+        THEN EXCLUDED.last_createtime ELSE s.last_createtime END,
+    unread_count = s.unread_count + EXCLUDED.unread_count;
+
+DELETE FROM conversation_summaries s USING conversation_merges cm WHERE s.conversation_id = cm.id;
+DELETE FROM conversations c USING conversation_merges cm WHERE c.id = cm.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS conversations_pair_idx
+    ON conversations (LEAST(user1_phone, user2_phone), GREATEST(user1_phone, user2_phone));
+
+-- Messages stored twice for one Ably message (client retries): keep the first
+DELETE FROM messages m USING messages kept
+WHERE m.ably_message_id = kept.ably_message_id AND m.id > kept.id;
+
+COMMIT;
+
+-- Outside of the transaction so that messages stays writable while it builds.
+-- If a duplicate arrived in between and the build fails, drop the invalid
+-- index and run the DELETE above and this statement again.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS messages_ably_message_id_idx
+    ON messages (ably_message_id);
@@ -0,0 +1,11 @@
+-- Indexes backing the /ad_cards endpoints of the four blueprints (adcards.py).
+-- A page of cards joins the ads to their profiles by primary key, then reads
+-- the schedules and details of those profiles by profile id.
+
+CREATE INDEX IF NOT EXISTS caregiverschedule_caregiver_id_idx ON caregiverschedule (caregiver_id, id DESC);
+CREATE INDEX IF NOT EXISTS careneederschedule_careneeder_id_idx ON careneederschedule (careneeder_id, id DESC);
+CREATE INDEX IF NOT EXISTS animalcaregiverschedule_form_id_idx ON animalcaregiverschedule (animalcaregiverform_id, id DESC);
+CREATE INDEX IF NOT EXISTS animalcareneederschedule_form_id_idx ON animalcareneederschedule (animalcareneederform_id, id DESC);
+
+CREATE INDEX IF NOT EXISTS animalcaregiver_animalcaregiverid_idx ON animalcaregiver (animalcaregiverid, id DESC);
+CREATE INDEX IF NOT EXISTS animalcareneeder_animalcareneederid_idx ON animalcareneeder (animalcareneederid, id DESC);
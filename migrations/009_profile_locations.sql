@@ -0,0 +1,106 @@
+-- Normalized locations for the four profile tables, behind the district
+-- filter of the listings and the /search endpoints (pagination.py).
+--
+-- location stays the JSON encoded list of district names the clients send.
+-- A trigger keeps next to it:
+--   * district_codes: the codes of the districts named in location (GIN index)
+--   * lat, lng: the point sent by the client, or else the centre of the first
+--     district; geo, the same as a point, has a GiST index for radius search
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS districts (
+    code text PRIMARY KEY,
+    names text[] NOT NULL,  -- lower case names and spellings clients use
+    lat double precision NOT NULL,
+    lng double precision NOT NULL
+);
+
+INSERT INTO districts (code, names, lat, lng) VALUES
+    ('central-western', '{中西區,中西区,central and western,central & western,central and western district}', 22.2820, 114.1500),
+    ('wan-chai', '{灣仔區,湾仔区,灣仔,湾仔,wan chai,wan chai district}', 22.2770, 114.1830),
+    ('eastern', '{東區,东区,eastern,eastern district}', 22.2790, 114.2250),
+    ('southern', '{南區,南区,southern,southern district}', 22.2470, 114.1600),
+    ('yau-tsim-mong', '{油尖旺區,油尖旺区,油尖旺,yau tsim mong,yau tsim mong district}', 22.3110, 114.1700),
+    ('sham-shui-po', '{深水埗區,深水埗区,深水埗,sham shui po,sham shui po district}', 22.3300, 114.1590),
+    ('kowloon-city', '{九龍城區,九龙城区,九龍城,九龙城,kowloon city,kowloon city district}', 22.3230, 114.1900),
+    ('wong-tai-sin', '{黃大仙區,黄大仙区,黃大仙,黄大仙,wong tai sin,wong tai sin district}', 22.3420, 114.1950),
+    ('kwun-tong', '{觀塘區,观塘区,觀塘,观塘,kwun tong,kwun tong district}', 22.3130, 114.2250),
+    ('tsuen-wan', '{荃灣區,荃湾区,荃灣,荃湾,tsuen wan,tsuen wan district}', 22.3710, 114.1140),
+    ('tuen-mun', '{屯門區,屯门区,屯門,屯门,tuen mun,tuen mun district}', 22.3910, 113.9770),
+    ('yuen-long', '{元朗區,元朗区,元朗,yuen long,yuen long district}', 22.4450, 114.0220),
+    ('north', '{北區,北区,north,north district}', 22.4940, 114.1380),
+    ('tai-po', '{大埔區,大埔区,大埔,tai po,tai po district}', 22.4500, 114.1690),
+    ('sai-kung', '{西貢區,西贡区,西貢,西贡,sai kung,sai kung district}', 22.3810, 114.2700),
+    ('sha-tin', '{沙田區,沙田区,沙田,sha tin,sha tin district}', 22.3830, 114.1880),
+    ('kwai-tsing', '{葵青區,葵青区,葵青,kwai tsing,kwai tsing district}', 22.3550, 114.1290),
+    ('islands', '{離島區,离岛区,離島,离岛,islands,islands district}', 22.2610, 113.9460)
+ON CONFLICT (code) DO UPDATE SET names = EXCLUDED.names, lat = EXCLUDED.lat, lng = EXCLUDED.lng;
+
+CREATE INDEX IF NOT EXISTS districts_names_idx ON districts USING GIN (names);
+
+-- Codes of the districts given as codes or names (lower case), for the
+-- district filter
+CREATE OR REPLACE FUNCTION district_codes_for(wanted text[]) RETURNS text[] AS $$
+    SELECT COALESCE(array_agg(code ORDER BY code), '{}')
+    FROM districts WHERE code = ANY(wanted) OR names && wanted
+$$ LANGUAGE sql STABLE;
+
+-- Codes of the districts named in a location value, in its order. Values
+-- that are not JSON are read as one name through location_jsonb
+-- (migrations/001_listing_indexes.sql), so the trigger and the backfill below
+-- never fail on them.
+CREATE OR REPLACE FUNCTION location_district_codes(location text) RETURNS text[] AS $$
+    SELECT COALESCE(array_agg(d.code ORDER BY l.n), '{}')
+    FROM jsonb_array_elements_text(CASE jsonb_typeof(location_jsonb(location))
+                                       WHEN 'array' THEN location_jsonb(location)
+                                       WHEN 'string' THEN jsonb_build_array(location_jsonb(location))
+                                       ELSE '[]' END)
+         WITH ORDINALITY l(name, n)
+    JOIN districts d ON lower(trim(l.name)) = ANY(d.names) OR lower(trim(l.name)) = d.code
+$$ LANGUAGE sql STABLE;
+
+-- Great-circle distance in km
+CREATE OR REPLACE FUNCTION distance_km(lat1 double precision, lng1 double precision,
+                                       lat2 double precision, lng2 double precision)
+RETURNS double precision AS $$
+    SELECT 2 * 6371.0 * asin(sqrt(
+        power(sin(radians(lat2 - lat1) / 2), 2)
+        + cos(radians(lat1)) * cos(radians(lat2)) * power(sin(radians(lng2 - lng1) / 2), 2)))
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION sync_profile_location() RETURNS trigger AS $$
+BEGIN
+    NEW.district_codes := location_district_codes(NEW.location);
+    -- A new location without a new point moves the profile to its district
+    IF NEW.lat IS NULL OR NEW.lng IS NULL
+       OR (TG_OP = 'UPDATE' AND NEW.location IS DISTINCT FROM OLD.location
+           AND NEW.lat IS NOT DISTINCT FROM OLD.lat AND NEW.lng IS NOT DISTINCT FROM OLD.lng) THEN
+        SELECT d.lat, d.lng INTO NEW.lat, NEW.lng
+        FROM districts d WHERE d.code = NEW.district_codes[1];
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['caregivers', 'careneeder', 'animalcaregiverform', 'animalcareneederform'] LOOP
+        EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS district_codes text[] NOT NULL DEFAULT ''{}'', '
+                       'ADD COLUMN IF NOT EXISTS lat double precision, '
+                       'ADD COLUMN IF NOT EXISTS lng double precision, '
+                       'ADD COLUMN IF NOT EXISTS geo point GENERATED ALWAYS AS (point(lng, lat)) STORED', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_location', t);
+        EXECUTE format('CREATE TRIGGER %I BEFORE INSERT OR UPDATE OF location, lat, lng ON %I '
+                       'FOR EACH ROW EXECUTE FUNCTION sync_profile_location()', t || '_location', t);
+        -- Backfill through the trigger
+        EXECUTE format('UPDATE %I SET location = location', t);
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I USING GIN (district_codes)',
+                       t || '_district_codes_idx', t);
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I USING GIST (geo)', t || '_geo_idx', t);
+    END LOOP;
+END
+$$;
+
+COMMIT;
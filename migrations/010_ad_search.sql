@@ -0,0 +1,87 @@
+-- Full-text search over the ads of the four blueprints (textsearch.py,
+-- GET /api/search_ads).
+--
+-- The default text search parsers do not split CJK text into words, so
+-- cjk_tokens() turns text into space separated tokens first: the overlapping
+-- bigrams of each CJK run (and, for indexed text, its single characters) and
+-- the other words in lower case. The 'simple' configuration then indexes them
+-- as they are. No extension is needed.
+--
+-- ad_search keeps a copy of every ad with its search_vector under one GIN
+-- index, filled by triggers on the ads tables.
+BEGIN;
+
+CREATE OR REPLACE FUNCTION cjk_tokens(body text, unigrams boolean DEFAULT false) RETURNS text AS $$
+    SELECT coalesce(string_agg(t.token, ' ' ORDER BY w.n, t.i), '')
+    FROM regexp_split_to_table(
+             regexp_replace(lower(coalesce(body, '')),
+                            '([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+)', ' \1 ', 'g'),
+             '[^0-9a-z\u00c0-\u024f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+')
+         WITH ORDINALITY w(word, n)
+    CROSS JOIN LATERAL (
+        SELECT w.word AS token, 0 AS i
+        WHERE w.word !~ '^[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]'
+        UNION ALL
+        SELECT substr(w.word, i, 2), i FROM generate_series(1, length(w.word) - 1) i
+        WHERE w.word ~ '^[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]'
+        UNION ALL
+        SELECT substr(w.word, i, 1), i FROM generate_series(1, length(w.word)) i
+        WHERE w.word ~ '^[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]'
+          AND (unigrams OR length(w.word) = 1)
+    ) t
+    WHERE w.word <> ''
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE TABLE IF NOT EXISTS ad_search (
+    ad_type text NOT NULL,
+    ad_id integer NOT NULL,
+    profile_id integer,
+    title text,
+    description text,
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', cjk_tokens(title, true)), 'A')
+        || setweight(to_tsvector('simple', cjk_tokens(description, true)), 'B')) STORED,
+    PRIMARY KEY (ad_type, ad_id)
+);
+
+-- TG_ARGV: the ad_type of the table, the column holding the profile id
+CREATE OR REPLACE FUNCTION sync_ad_search() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM ad_search WHERE ad_type = TG_ARGV[0] AND ad_id = OLD.id;
+        RETURN OLD;
+    END IF;
+    INSERT INTO ad_search (ad_type, ad_id, profile_id, title, description)
+    VALUES (TG_ARGV[0], NEW.id, (to_jsonb(NEW) ->> TG_ARGV[1])::integer, NEW.title, NEW.description)
+    ON CONFLICT (ad_type, ad_id) DO UPDATE SET
+        profile_id = EXCLUDED.profile_id, title = EXCLUDED.title, description = EXCLUDED.description;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    ad record;
+BEGIN
+    FOR ad IN SELECT * FROM (VALUES
+        ('caregiver', 'caregiverads', 'caregiver_id'),
+        ('careneeder', 'careneederads', 'careneeder_id'),
+        ('animalcaregiver', 'animalcaregiverads', 'animalcaregiverid'),
+        ('animalcareneeder', 'animalcareneederads', 'animalcareneederid')
+    ) v(ad_type, tbl, fk) LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', ad.tbl || '_search', ad.tbl);
+        EXECUTE format('CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE ON %I '
+                       'FOR EACH ROW EXECUTE FUNCTION sync_ad_search(%L, %L)',
+                       ad.tbl || '_search', ad.tbl, ad.ad_type, ad.fk);
+        EXECUTE format('INSERT INTO ad_search (ad_type, ad_id, profile_id, title, description) '
+                       'SELECT %L, id, %I, title, description FROM %I '
+                       'ON CONFLICT (ad_type, ad_id) DO UPDATE SET profile_id = EXCLUDED.profile_id, '
+                       'title = EXCLUDED.title, description = EXCLUDED.description',
+                       ad.ad_type, ad.fk, ad.tbl);
+    END LOOP;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ad_search_vector_idx ON ad_search USING GIN (search_vector);
+
+COMMIT;
@@ -0,0 +1,41 @@
+-- Best caregivers of each careneeder (matching.py), computed when
+-- /api/careneeder/<id>/matches is first asked for and extended with the
+-- caregivers added or changed since on later requests.
+CREATE TABLE IF NOT EXISTS careneeder_matches (
+    careneeder_id integer PRIMARY KEY,
+    caregiver_ids integer[] NOT NULL,  -- best first
+    scores real[] NOT NULL,
+    max_caregiver_id integer NOT NULL,  -- caregivers above it are not scored yet
+    need_key text NOT NULL,             -- the careneeder's scored fields
+    caregivers_version bigint,          -- table_versions of caregivers when stored
+    computed_at timestamptz NOT NULL,   -- last computation from scratch
+    scored_at timestamptz NOT NULL      -- last computation, from scratch or not
+);
+
+-- When each caregiver's scored fields last changed, so that a caregiver
+-- outside a stored list gets scored again once its price, districts, point or
+-- experience change. One row per caregiver.
+CREATE TABLE IF NOT EXISTS caregiver_changes (
+    caregiver_id integer PRIMARY KEY,
+    changed_at timestamptz NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS caregiver_changes_changed_at_idx ON caregiver_changes (changed_at);
+
+CREATE OR REPLACE FUNCTION track_caregiver_change() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO caregiver_changes (caregiver_id, changed_at) VALUES (NEW.id, now())
+    ON CONFLICT (caregiver_id) DO UPDATE SET changed_at = EXCLUDED.changed_at;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+-- district_codes is set by the caregivers_location trigger
+-- (migrations/009_profile_locations.sql), hence compared rather than listed
+-- in UPDATE OF
+DROP TRIGGER IF EXISTS caregivers_match_change ON caregivers;
+CREATE TRIGGER caregivers_match_change AFTER UPDATE ON caregivers
+    FOR EACH ROW
+    WHEN ((OLD.hourlycharge, OLD.years_of_experience, OLD.district_codes, OLD.lat, OLD.lng)
+          IS DISTINCT FROM (NEW.hourlycharge, NEW.years_of_experience, NEW.district_codes, NEW.lat, NEW.lng))
+    EXECUTE FUNCTION track_caregiver_change();
@@ -0,0 +1,155 @@
+-- Availability index over the schedules of the four blueprints (availability.py,
+-- GET /api/<blueprint>/availability).
+--
+-- The schedule columns hold what the clients sent (startdate, durationdays,
+-- frequency, selectedtimeslots). schedule_slots keeps each schedule as:
+--   * period: the dates it covers, [startdate, startdate + durationdays),
+--     open-ended without durationdays and unbounded without a readable
+--     startdate
+--   * weekday_mask: bit 0 Monday ... bit 6 Sunday, from the weekday names in
+--     frequency and selectedtimeslots (every day when none are named)
+--   * slot_mask: bit n the hour n:00-n+1:00, from the "HH:MM-HH:MM" ranges
+--     and the morning / afternoon / evening / overnight names (上午, 下午, ...)
+--     in selectedtimeslots (every hour when none are given)
+-- Triggers on the schedule tables keep it current. Partial GiST indexes on
+-- period, one per schedule type, serve the date overlap and the masks are
+-- checked on the rows found.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS schedule_slots (
+    schedule_type text NOT NULL,
+    schedule_id integer NOT NULL,
+    profile_id integer,
+    period daterange NOT NULL,
+    weekday_mask integer NOT NULL,
+    slot_mask integer NOT NULL,
+    PRIMARY KEY (schedule_type, schedule_id)
+);
+
+-- Hours [first, last) as bits, wrapping past midnight
+CREATE OR REPLACE FUNCTION hours_mask(first integer, last integer) RETURNS integer AS $$
+    SELECT CASE
+        WHEN last > first THEN (1 << last) - (1 << first)
+        ELSE ((1 << 24) - (1 << first)) | ((1 << last) - 1)
+    END
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION schedule_slot_mask(slots text) RETURNS integer AS $$
+DECLARE
+    item text;
+    hours text[];
+    mask integer := 0;
+BEGIN
+    FOR item IN SELECT lower(btrim(x, ' "{}[]')) FROM regexp_split_to_table(coalesce(slots, ''), '[,;、，]') x LOOP
+        hours := regexp_match(item, '(\d{1,2})(?::(\d{2}))?\s*(?:-|–|~|至|到|to)\s*(\d{1,2})(?::(\d{2}))?');
+        IF hours IS NOT NULL AND hours[1]::integer <= 24 AND hours[3]::integer <= 24 THEN
+            -- A range ending past the hour takes that hour too
+            mask := mask | hours_mask(hours[1]::integer % 24,
+                                      (hours[3]::integer + (coalesce(hours[4], '00') <> '00')::integer) % 24);
+        ELSIF item ~ '(overnight|通宵|深夜|凌晨)' THEN
+            mask := mask | hours_mask(0, 6);
+        ELSIF item ~ '(morning|上午|早上|早晨)' THEN
+            mask := mask | hours_mask(6, 12);
+        ELSIF item ~ '(afternoon|下午)' THEN
+            mask := mask | hours_mask(12, 18);
+        ELSIF item ~ '(evening|night|晚上|晚間|晚间|夜)' THEN
+            mask := mask | hours_mask(18, 24);
+        ELSIF item ~ '(all day|full day|全日|全天)' THEN
+            mask := mask | hours_mask(0, 24);
+        END IF;
+    END LOOP;
+    RETURN CASE WHEN mask = 0 THEN hours_mask(0, 24) ELSE mask END;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION schedule_weekday_mask(body text) RETURNS integer AS $$
+DECLARE
+    -- Monday first
+    english text[] := ARRAY['\mmon(day)?\M', '\mtue(s|sday)?\M', '\mwed(nesday)?\M',
+                            '\mthu(rs|rsday)?\M', '\mfri(day)?\M', '\msat(urday)?\M', '\msun(day)?\M'];
+    chinese text[] := ARRAY['一', '二', '三', '四', '五', '六', '[日天]'];
+    -- 星期一, 週一, 周一, 禮拜一 ...
+    prefix text := '(星期|週|周|禮拜|礼拜)';
+    mask integer := 0;
+    day integer;
+BEGIN
+    body := lower(coalesce(body, ''));
+    FOR day IN 1..7 LOOP
+        IF body ~ english[day] OR body ~ (prefix || chinese[day]) THEN
+            mask := mask | (1 << (day - 1));
+        END IF;
+    END LOOP;
+    IF body ~ '(\mweekdays?\M|平日|工作日)' THEN
+        mask := mask | 31;
+    END IF;
+    IF body ~ '(\mweekends?\M|週末|周末)' THEN
+        mask := mask | 96;
+    END IF;
+    RETURN CASE WHEN mask = 0 THEN 127 ELSE mask END;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+-- TG_ARGV: the schedule_type of the table, the column holding the profile id
+CREATE OR REPLACE FUNCTION sync_schedule_slots() RETURNS trigger AS $$
+DECLARE
+    first_day date;
+    days integer;
+    covered daterange := '(,)';
+    weekdays integer;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM schedule_slots WHERE schedule_type = TG_ARGV[0] AND schedule_id = OLD.id;
+        RETURN OLD;
+    END IF;
+
+    -- Unreadable values leave the dates open
+    BEGIN
+        first_day := substring(NEW.startdate::text FROM '\d{4}-\d{2}-\d{2}')::date;
+        days := nullif(substring(NEW.durationdays::text FROM '\d+'), '')::integer;
+        covered := CASE WHEN days IS NULL THEN daterange(first_day, NULL)
+                        ELSE daterange(first_day, first_day + greatest(days, 1)) END;
+    EXCEPTION WHEN others THEN
+        covered := '(,)';
+    END;
+
+    weekdays := schedule_weekday_mask(concat_ws(' ', NEW.frequency::text, NEW.selectedtimeslots::text));
+    -- Periods shorter than a week only have some of the weekdays
+    IF upper(covered) - lower(covered) < 7 THEN
+        weekdays := weekdays & (SELECT coalesce(bit_or(1 << (extract(isodow FROM d)::integer - 1)), 0)
+                                FROM generate_series(lower(covered), upper(covered) - 1, interval '1 day') d);
+    END IF;
+
+    INSERT INTO schedule_slots (schedule_type, schedule_id, profile_id, period, weekday_mask, slot_mask)
+    VALUES (TG_ARGV[0], NEW.id, (to_jsonb(NEW) ->> TG_ARGV[1])::integer, covered, weekdays,
+            schedule_slot_mask(NEW.selectedtimeslots::text))
+    ON CONFLICT (schedule_type, schedule_id) DO UPDATE SET
+        profile_id = EXCLUDED.profile_id, period = EXCLUDED.period,
+        weekday_mask = EXCLUDED.weekday_mask, slot_mask = EXCLUDED.slot_mask;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    s record;
+BEGIN
+    FOR s IN SELECT * FROM (VALUES
+        ('caregiver', 'caregiverschedule', 'caregiver_id'),
+        ('careneeder', 'careneederschedule', 'careneeder_id'),
+        ('animalcaregiver', 'animalcaregiverschedule', 'animalcaregiverform_id'),
+        ('animalcareneeder', 'animalcareneederschedule', 'animalcareneederform_id')
+    ) v(schedule_type, tbl, fk) LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', s.tbl || '_slots', s.tbl);
+        EXECUTE format('CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE ON %I '
+                       'FOR EACH ROW EXECUTE FUNCTION sync_schedule_slots(%L, %L)',
+                       s.tbl || '_slots', s.tbl, s.schedule_type, s.fk);
+        -- Backfill through the trigger
+        EXECUTE format('UPDATE %I SET id = id', s.tbl);
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON schedule_slots USING GIST (period) '
+                       'WHERE schedule_type = %L', 'schedule_slots_' || s.schedule_type || '_period_idx',
+                       s.schedule_type);
+    END LOOP;
+END
+$$;
+
+COMMIT;
@@ -0,0 +1,70 @@
+# notifications.py
+# One Postgres LISTEN connection per process, shared by the modules that keep
+# in-memory state in sync across processes and pods (presence, response
+# cache). Modules subscribe to their channel at import time; the listener
+# thread is started on first use so that each gunicorn worker gets its own
+# after the fork.
+import logging
+import threading
+import time
+
+import psycopg
+
+from db import db_config
+
+logger = logging.getLogger(__name__)
+
+# Seconds before listening again after the connection was lost
+RECONNECT_DELAY = 5
+
+# channel -> (callback(payload), on_connect(conn) or None)
+_subscriptions = {}
+_lock = threading.Lock()
+_started = False
+
+
+def subscribe(channel, callback, on_connect=None):
+    # on_connect runs on the listening connection every time it (re)connects,
+    # after LISTEN, to catch up on what was missed
+    _subscriptions[channel] = (callback, on_connect)
+
+
+def publish(cursor, channel, payload):
+    # Delivered to every listening process (this one included) when the
+    # cursor's transaction commits
+    cursor.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+
+
+def _listen_loop():
+    while True:
+        try:
+            with psycopg.connect(**db_config, autocommit=True) as conn:
+                for channel in _subscriptions:
+                    conn.execute(f'LISTEN "{channel}"')
+                for _, on_connect in _subscriptions.values():
+                    if on_connect is not None:
+                        on_connect(conn)
+
+                for notify in conn.notifies():
+                    callback, _ = _subscriptions.get(notify.channel, (None, None))
+                    if callback is None:
+                        continue
+                    try:
+                        callback(notify.payload)
+                    except Exception:
+                        logger.error(f"Handling a notification on {notify.channel} failed",
+                                     exc_info=True)
+        except Exception:
+            logger.warning("Lost the notification connection, reconnecting", exc_info=True)
+            time.sleep(RECONNECT_DELAY)
+
+
+def start():
+    global _started
+    if _started:
+        return
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_listen_loop, name="notifications", daemon=True).start()
@@ -0,0 +1,273 @@
+# Keyset pagination and filtering for the listing endpoints.
+#
+# Paging contract: pass `limit` to get a page of at most `limit` rows ordered
+# by id DESC. When the page is full the response carries an X-Next-After-Id
+# header; pass that value back as `after_id` to get the next page. Any filter
+# parameter also switches the endpoint into paged mode. Requests without paging
+# or filter parameters keep returning the full list, as before.
+import math
+import os
+from datetime import datetime, timezone
+
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 200
+
+NEXT_CURSOR_HEADER = "X-Next-After-Id"
+
+
+def _names(value):
+    # Comma separated district codes or names, matched case-insensitively
+    names = [name.strip().lower() for name in value.split(",") if name.strip()]
+    if not names:
+        raise ValueError
+    return names
+
+
+# query parameter -> (SQL condition, type of the bound value)
+# location is stored as a JSON encoded list of districts, read through
+# location_jsonb (migrations/001_listing_indexes.sql) which tolerates older
+# plain text values. district matches the district_codes kept from it
+# (migrations/009_profile_locations.sql).
+LOCATION_FILTER = {
+    "location": ("location_jsonb(location) ? %s", str),
+    "district": ("district_codes && district_codes_for(%s)", _names),
+}
+
+GENDER_FILTER = {
+    "gender": ("gender = %s", str),
+}
+
+HOURLYCHARGE_FILTERS = {
+    "min_hourlycharge": ("hourlycharge >= %s", float),
+    "max_hourlycharge": ("hourlycharge <= %s", float),
+}
+
+AGE_FILTERS = {
+    "min_age": ("age >= %s", int),
+    "max_age": ("age <= %s", int),
+}
+
+EXPERIENCE_FILTERS = {
+    "min_years_of_experience": ("years_of_experience >= %s", int),
+    "max_years_of_experience": ("years_of_experience <= %s", int),
+}
+
+CAREGIVER_FILTERS = {**LOCATION_FILTER, **GENDER_FILTER, **HOURLYCHARGE_FILTERS,
+                     **AGE_FILTERS, **EXPERIENCE_FILTERS}
+
+CARENEEDER_FILTERS = {**LOCATION_FILTER, **HOURLYCHARGE_FILTERS}
+
+ANIMAL_PROFILE_FILTERS = {**LOCATION_FILTER, **GENDER_FILTER,
+                          **AGE_FILTERS, **EXPERIENCE_FILTERS}
+
+
+def _parse(args, name, cast):
+    try:
+        return cast(args[name])
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for {name}")
+
+
+def _filter_conditions(filters, args):
+    conditions = []
+    params = []
+    for name, (condition, cast) in filters.items():
+        if args.get(name, "") == "":
+            continue
+        conditions.append(condition)
+        params.append(_parse(args, name, cast))
+    return conditions, params
+
+
+def page_limit(args):
+    limit = DEFAULT_PAGE_LIMIT
+    if args.get("limit", "") != "":
+        limit = _parse(args, "limit", int)
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_LIMIT}")
+    return limit
+
+
+def page_query(table, filters, args, columns=None):
+    # Returns (query, params, limit). limit is None when the request did not
+    # ask for paging, in which case the query returns every matching row.
+    # columns limits the select list (id must be among them for the cursor).
+    # Raises ValueError for malformed parameters.
+    paged = any(name in args for name in ("limit", "after_id", *filters))
+
+    conditions, params = _filter_conditions(filters, args)
+
+    limit = None
+    if paged:
+        limit = page_limit(args)
+
+        if args.get("after_id", "") != "":
+            conditions.append("id < %s")
+            params.append(_parse(args, "after_id", int))
+
+    query = f"SELECT {', '.join(columns) if columns else '*'} FROM {table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id DESC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    return query, params, limit
+
+
+def page_window(args):
+    # (limit, after_id) for endpoints that are always paged, same parameters
+    # as page_query. after_id is None on the first page. Raises ValueError
+    # for malformed parameters.
+    limit = page_limit(args)
+
+    after_id = None
+    if args.get("after_id", "") != "":
+        after_id = _parse(args, "after_id", int)
+    return limit, after_id
+
+
+def set_next_cursor(response, rows, limit):
+    # A full page means there may be more rows after the last id we returned
+    if limit is not None and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(rows[-1]["id"])
+    return response
+
+
+# Location search for the /search endpoints, over the columns kept from
+# location by migrations/009_profile_locations.sql:
+#
+#   district=<codes or names>    profiles in any of these districts, paged
+#                                like the listings
+#   lat=<deg>&lng=<deg>          the `limit` profiles nearest to the point
+#   [&radius_km=<km>]            within radius_km (default SEARCH_RADIUS_KM),
+#                                nearest first, each with its distance_km
+#
+# Both can be combined, and with the listing's other filters.
+SEARCH_RADIUS_KM = float(os.environ.get("SEARCH_RADIUS_KM", 5))
+MAX_SEARCH_RADIUS_KM = float(os.environ.get("MAX_SEARCH_RADIUS_KM", 50))
+
+# Columns added to the listing fields in search results
+LOCATION_FIELDS = ["district_codes", "lat", "lng"]
+
+KM_PER_DEGREE = 111.32
+
+
+def search_query(table, filters, args, columns):
+    # Returns (query, params, limit, nearest). nearest is True for the
+    # search around a point, whose results have no next page cursor. Raises
+    # ValueError for malformed or missing parameters.
+    columns = [*columns, *LOCATION_FIELDS]
+    if args.get("lat", "") == "" and args.get("lng", "") == "":
+        if args.get("district", "") == "":
+            raise ValueError("district, or lat and lng, is required")
+        return (*page_query(table, filters, args, columns), False)
+
+    if "after_id" in args:
+        raise ValueError("after_id can not be combined with lat and lng")
+    lat = _parse(args, "lat", float)
+    lng = _parse(args, "lng", float)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("lat or lng out of range")
+    radius = SEARCH_RADIUS_KM
+    if args.get("radius_km", "") != "":
+        radius = _parse(args, "radius_km", float)
+    if not 0 < radius <= MAX_SEARCH_RADIUS_KM:
+        raise ValueError(f"radius_km must be between 0 and {MAX_SEARCH_RADIUS_KM:g}")
+    limit = page_limit(args)
+
+    # The bounding box of the circle narrows the rows through the index on
+    # geo, the exact distance is only computed for those
+    lat_delta = radius / KM_PER_DEGREE
+    lng_delta = radius / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    distance = "distance_km(lat, lng, %s, %s)"
+    conditions, params = _filter_conditions(filters, args)
+    query = (f"SELECT {', '.join(columns)}, {distance} AS distance_km FROM {table} "
+             "WHERE geo <@ box(point(%s, %s), point(%s, %s)) "
+             f"AND {distance} <= %s")
+    params = [lat, lng, lng - lng_delta, lat - lat_delta, lng + lng_delta, lat + lat_delta,
+              lat, lng, radius, *params]
+    if conditions:
+        query += " AND " + " AND ".join(conditions)
+    query += " ORDER BY distance_km, id DESC LIMIT %s"
+    params.append(limit)
+
+    return query, params, limit, True
+
+
+# Message windows for the chat endpoints. Without any of the parameters below
+# the whole conversation is returned, as before. Otherwise at most `limit`
+# messages (default MESSAGE_PAGE_LIMIT), always oldest first:
+#
+#   since_id=<id>    messages newer than id, for polling. When the page is
+#                    full X-Next-Since-Id holds the id to poll from next.
+#   since_ts=<time>  same, by creation time (ISO 8601, a trailing Z
+#                    included). createtime holds UTC times without a zone,
+#                    so times with an offset are converted to UTC and times
+#                    without one are taken as UTC.
+#   before_id=<id>   the messages right before id, for scrolling back. When
+#                    the page is full X-Next-Before-Id holds the id to pass
+#                    for the page before it.
+#   limit=<n> alone  the latest messages, then scroll back with before_id
+MESSAGE_PAGE_LIMIT = 100
+MAX_MESSAGE_PAGE_LIMIT = 500
+
+NEXT_SINCE_HEADER = "X-Next-Since-Id"
+NEXT_BEFORE_HEADER = "X-Next-Before-Id"
+
+
+def _timestamp(value):
+    # datetime.fromisoformat only accepts Z from Python 3.11
+    if value[-1:] in ("Z", "z"):
+        value = value[:-1] + "+00:00"
+    ts = datetime.fromisoformat(value)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def message_query(select, params, args, default_order):
+    # select is a "SELECT ... WHERE ..." over messages without ORDER BY.
+    # Returns (query, params, limit, backwards); limit is None when no window
+    # was asked for, backwards is True when the rows come newest first and
+    # have to be reversed. Raises ValueError for malformed parameters.
+    if not any(name in args for name in ("limit", "since_id", "since_ts", "before_id")):
+        return f"{select} ORDER BY {default_order}", list(params), None, False
+
+    if "before_id" in args and ("since_id" in args or "since_ts" in args):
+        raise ValueError("before_id can not be combined with since_id or since_ts")
+
+    params = list(params)
+    limit = MESSAGE_PAGE_LIMIT
+    if args.get("limit", "") != "":
+        limit = _parse(args, "limit", int)
+    if not 1 <= limit <= MAX_MESSAGE_PAGE_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_MESSAGE_PAGE_LIMIT}")
+
+    if args.get("since_id", "") != "":
+        select += " AND id > %s"
+        params.append(_parse(args, "since_id", int))
+        order, backwards = "id ASC", False
+    elif args.get("since_ts", "") != "":
+        select += " AND createtime > %s"
+        params.append(_parse(args, "since_ts", _timestamp))
+        order, backwards = "createtime ASC, id ASC", False
+    else:
+        if args.get("before_id", "") != "":
+            select += " AND id < %s"
+            params.append(_parse(args, "before_id", int))
+        order, backwards = "id DESC", True
+
+    params.append(limit)
+    return f"{select} ORDER BY {order} LIMIT %s", params, limit, backwards
+
+
+def set_message_cursor(response, rows, limit, backwards):
+    # rows are in the order they are returned to the client, oldest first
+    if limit is not None and len(rows) == limit:
+        if backwards:
+            response.headers[NEXT_BEFORE_HEADER] = str(rows[0]["id"])
+        else:
+            response.headers[NEXT_SINCE_HEADER] = str(rows[-1]["id"])
+    return response
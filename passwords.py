@@ -0,0 +1,150 @@
+# passwords.py
+# bcrypt verification runs on a small dedicated process pool so that a burst
+# of logins costs the pool's CPUs instead of blocking every request thread.
+# The number of verifications in flight (running + queued) is bounded; when
+# the bound is reached verify_password fails fast with VerifierBusy and the
+# caller answers 503 instead of letting the queue grow. A slot is held until
+# its job is done or cancelled, not until the caller gives up waiting, so
+# timed out jobs still count. A pool whose worker died is replaced.
+import bcrypt
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+VERIFY_WORKERS = int(os.environ.get("BCRYPT_WORKERS", 2))
+# Verifications allowed to wait for a free worker
+VERIFY_MAX_QUEUE = int(os.environ.get("BCRYPT_MAX_QUEUE", 16))
+# Seconds to wait for a result before giving up
+VERIFY_TIMEOUT = float(os.environ.get("BCRYPT_TIMEOUT", 5))
+
+# Upper bounds (ms) of the buckets of the latency histograms
+LATENCY_BUCKETS_MS = [50, 100, 200, 300, 500, 1000, 2000]
+
+
+class VerifierBusy(Exception):
+    pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(VERIFY_WORKERS + VERIFY_MAX_QUEUE)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "verified": 0,
+    "rejected_busy": 0,
+    "timeouts": 0,
+    "pool_restarts": 0,
+    "queue_ms": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+    "verify_ms": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+}
+
+
+def _checkpw(passcode, hashed_passcode):
+    # Runs in a worker process. Wall clock times so the parent can tell how
+    # long the job waited in the queue.
+    started = time.time()
+    valid = bcrypt.checkpw(passcode, hashed_passcode)
+    return valid, started, time.time() - started
+
+
+def _get_executor():
+    # Created lazily so that each gunicorn worker gets its own pool after the
+    # fork. spawn because the parent already runs threads (db pool workers).
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=VERIFY_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _replace_executor(broken):
+    # Drops broken so that the next verification starts a new pool, unless
+    # another thread already did
+    global _executor
+    with _executor_lock:
+        if _executor is not broken:
+            return
+        _executor = None
+    broken.shutdown(wait=False)
+    with _stats_lock:
+        _stats["pool_restarts"] += 1
+
+
+def _release_slot(future):
+    _slots.release()
+
+
+def _observe(histogram, ms):
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if ms <= bound:
+            histogram[i] += 1
+            return
+    histogram[-1] += 1
+
+
+def verify_password(passcode, hashed_passcode):
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats["rejected_busy"] += 1
+        raise VerifierBusy("Too many password verifications in progress")
+
+    submitted = time.time()
+    executor = _get_executor()
+    try:
+        future = executor.submit(
+            _checkpw, passcode.encode('utf-8'), hashed_passcode.encode('utf-8'))
+    except BrokenProcessPool:
+        _slots.release()
+        _replace_executor(executor)
+        raise VerifierBusy("Password verification is restarting")
+    except BaseException:
+        _slots.release()
+        raise
+    # Called at once when the job already finished
+    future.add_done_callback(_release_slot)
+
+    try:
+        valid, started, duration = future.result(timeout=VERIFY_TIMEOUT)
+    except FutureTimeoutError:
+        # Only stops the job if it has not started yet; a running one keeps
+        # its slot until it ends
+        future.cancel()
+        with _stats_lock:
+            _stats["timeouts"] += 1
+        raise VerifierBusy("Password verification timed out")
+    except BrokenProcessPool:
+        _replace_executor(executor)
+        raise VerifierBusy("Password verification is restarting")
+
+    with _stats_lock:
+        _stats["verified"] += 1
+        _observe(_stats["queue_ms"], max(started - submitted, 0) * 1000)
+        _observe(_stats["verify_ms"], duration * 1000)
+
+    return valid
+
+
+def get_password_stats():
+    def histogram(counts):
+        return {
+            **{f"<={bound}ms": count for bound, count in zip(LATENCY_BUCKETS_MS, counts)},
+            f">{LATENCY_BUCKETS_MS[-1]}ms": counts[-1],
+        }
+
+    with _stats_lock:
+        return {
+            "workers": VERIFY_WORKERS,
+            "max_queue": VERIFY_MAX_QUEUE,
+            "verified": _stats["verified"],
+            "rejected_busy": _stats["rejected_busy"],
+            "timeouts": _stats["timeouts"],
+            "pool_restarts": _stats["pool_restarts"],
+            "queue_ms_histogram": histogram(_stats["queue_ms"]),
+            "verify_ms_histogram": histogram(_stats["verify_ms"]),
+        }
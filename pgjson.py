@@ -0,0 +1,49 @@
+# pgjson.py
+# Listings whose response body is built by Postgres. With PG_JSON_LISTINGS=1
+# the largest listings (all_careneeders, all_animal_careneeders_details) have
+# their query return the whole JSON array, made with row_to_json over exactly
+# the fields the Python path returns, and the bytes go to the client as they
+# are: no row tuples, no dicts, no encoder.
+#
+# The body holds the same values as the Python path (keys in sorted order,
+# numeric columns as strings like jsonify sends Decimal); only the
+# whitespace inside nested objects differs. Date and time columns would come
+# out as ISO 8601 instead of HTTP dates, so listings returning one have to
+# stay on the Python path.
+import os
+
+from flask import current_app
+
+from pagination import NEXT_CURSOR_HEADER
+
+PG_JSON_LISTINGS = os.environ.get("PG_JSON_LISTINGS", "0") == "1"
+
+
+def json_column(column):
+    return (f"CASE WHEN pg_typeof({column}) = 'numeric'::regtype "
+            f"THEN to_json({column}::text) ELSE to_json({column}) END AS {column}")
+
+
+def json_columns(fields, computed=None):
+    # Select list for `fields` plus the `computed` {name: SQL expression}
+    # ones, in jsonify's key order. id is kept as it is, the cursor needs it.
+    computed = computed or {}
+    return [f"{computed[name]} AS {name}" if name in computed
+            else name if name == "id" else json_column(name)
+            for name in sorted([*fields, *computed])]
+
+
+def aggregate_query(query):
+    # Wraps a query ordered by id DESC into one returning a single row:
+    # (its rows as a JSON array in UTF-8, number of rows, last id)
+    return ("SELECT convert_to('[' || coalesce(string_agg(row_to_json(r)::text, ',' "
+            "ORDER BY r.id DESC), '') || ']', 'UTF8'), count(*), min(r.id) "
+            f"FROM ({query}) AS r")
+
+
+def json_body_response(body, count, last_id, limit):
+    # Same paging header as pagination.set_next_cursor
+    response = current_app.response_class(body, mimetype="application/json")
+    if limit is not None and count == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(last_id)
+    return response
@@ -0,0 +1,154 @@
+# presence.py
+# Who is online, answered from memory. Every process keeps the last time each
+# user was seen; sign in, POST /api/heartbeat and open Socket.IO connections
+# feed it, and /api/usersstatus only reads it.
+#
+# A background thread flushes what changed every PRESENCE_FLUSH_INTERVAL
+# seconds: one batched UPDATE of accounts.last_seen, plus a NOTIFY on
+# PRESENCE_CHANNEL so the other processes and pods merge the same sightings
+# (see notifications.py). The recent last_seen values are loaded whenever the
+# listening connection (re)connects. Entries older than PRESENCE_TTL are
+# dropped.
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import notifications
+from db import db_pool
+
+logger = logging.getLogger(__name__)
+
+# Seen within this many seconds means online
+PRESENCE_TTL = int(os.environ.get("PRESENCE_TTL", 10 * 60))
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get("PRESENCE_FLUSH_INTERVAL", 5))
+PRESENCE_CHANNEL = os.environ.get("PRESENCE_CHANNEL", "presence")
+
+# Sightings per NOTIFY, keeps the payload under the 8000 bytes limit
+NOTIFY_BATCH = 100
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+FLUSH_QUERY = """UPDATE accounts SET last_seen = v.seen
+               FROM unnest(%s::text[], %s::timestamp[]) AS v (phone, seen)
+               WHERE accounts.phone = v.phone AND (accounts.last_seen IS NULL OR accounts.last_seen < v.seen)"""
+
+_lock = threading.Lock()
+_last_seen = {}
+_dirty = {}
+# phone -> number of open sockets in this process
+_connected = {}
+_started = False
+
+
+def _record(phone, seen, dirty):
+    # Caller holds _lock
+    if _last_seen.get(phone, datetime.min) < seen:
+        _last_seen[phone] = seen
+        if dirty:
+            _dirty[phone] = seen
+
+
+def touch(phone):
+    _start()
+    with _lock:
+        _record(phone, datetime.now(), True)
+
+
+def connected(phone):
+    # Users with an open socket are seen again at every flush
+    _start()
+    with _lock:
+        _connected[phone] = _connected.get(phone, 0) + 1
+        _record(phone, datetime.now(), True)
+
+
+def disconnected(phone):
+    with _lock:
+        count = _connected.pop(phone, 0) - 1
+        if count > 0:
+            _connected[phone] = count
+        _record(phone, datetime.now(), True)
+
+
+def statuses(phones):
+    # {phone: online} for each phone, from memory only
+    _start()
+    online_since = datetime.now() - timedelta(seconds=PRESENCE_TTL)
+    with _lock:
+        return {phone: _last_seen.get(phone, datetime.min) >= online_since for phone in phones}
+
+
+def _flush():
+    now = datetime.now()
+    with _lock:
+        for phone in _connected:
+            _record(phone, now, True)
+        dirty = list(_dirty.items())
+        _dirty.clear()
+
+        # Expire entries nobody refreshed within the TTL
+        expired = now - timedelta(seconds=PRESENCE_TTL)
+        for phone in [phone for phone, seen in _last_seen.items() if seen < expired]:
+            del _last_seen[phone]
+
+    if not dirty:
+        return
+
+    try:
+        with db_pool.connection() as conn:
+            conn.execute(FLUSH_QUERY, ([phone for phone, _ in dirty],
+                                       [seen for _, seen in dirty]), prepare=True)
+            for i in range(0, len(dirty), NOTIFY_BATCH):
+                payload = json.dumps({phone: seen.strftime(TIME_FORMAT)
+                                      for phone, seen in dirty[i:i + NOTIFY_BATCH]})
+                notifications.publish(conn, PRESENCE_CHANNEL, payload)
+    except Exception:
+        logger.error("Flushing presence failed", exc_info=True)
+        # Keep them for the next flush
+        with _lock:
+            for phone, seen in dirty:
+                if _dirty.get(phone, datetime.min) < seen:
+                    _dirty[phone] = seen
+
+
+def _flush_loop():
+    while True:
+        time.sleep(PRESENCE_FLUSH_INTERVAL)
+        _flush()
+
+
+def _load_recent(conn):
+    # Sightings from before this process started (or while it was not
+    # listening)
+    rows = conn.execute("SELECT phone, last_seen FROM accounts WHERE last_seen > %s",
+                        (datetime.now() - timedelta(seconds=PRESENCE_TTL),)).fetchall()
+    with _lock:
+        for phone, seen in rows:
+            _record(phone, seen, False)
+
+
+def _merge(payload):
+    sightings = json.loads(payload)
+    with _lock:
+        for phone, seen in sightings.items():
+            _record(phone, datetime.strptime(seen, TIME_FORMAT), False)
+
+
+notifications.subscribe(PRESENCE_CHANNEL, _merge, on_connect=_load_recent)
+
+
+def _start():
+    # Threads are started on first use so that each gunicorn worker gets its
+    # own after the fork
+    global _started
+    if _started:
+        return
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_flush_loop, name="presence-flush", daemon=True).start()
+    notifications.start()
@@ -0,0 +1,148 @@
+# realtime.py
+# Push of new chat messages over Socket.IO, so chat windows no longer have to
+# poll /api/fetch_messages*.
+#
+# Clients connect to /socket.io, served alone by socket_app (the realtime
+# service of deployment.yaml) or next to the async endpoints by asgi.py, with
+# auth={"token": <socket_token>} (or ?token=), the token /api/signin returns,
+# and receive a "new_message" event for every message sent to the phone it
+# was issued for. An open connection also keeps the user online (see
+# presence.py).
+#
+# Postgres LISTEN/NOTIFY is the backplane between the replicas: every pod with
+# connected clients listens on SOCKETIO_CHANNEL and emits what arrives there
+# to the sockets it holds, whichever pod handled the message. NOTIFY is
+# transactional, handle_message publishes inside its transaction and the push
+# goes out only once the message is committed.
+import asyncio
+import json
+import logging
+import os
+from urllib.parse import parse_qs
+
+import psycopg
+import socketio
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from socketio.asyncio_pubsub_manager import AsyncPubSubManager
+
+import presence
+from db import db_config
+
+logger = logging.getLogger(__name__)
+
+SOCKETIO_CHANNEL = os.environ.get("SOCKETIO_CHANNEL", "socketio")
+
+# NOTIFY payloads are limited to 8000 bytes
+MAX_NOTIFY_BYTES = 7900
+
+NEW_MESSAGE_EVENT = "new_message"
+
+# Seconds before listening again after the connection to Postgres was lost
+RECONNECT_DELAY = 1
+
+# Signs the socket tokens; must be the same on the backend and realtime pods.
+# Without it no token is issued and every connection is refused.
+SOCKET_TOKEN_SECRET = os.environ.get("SOCKET_TOKEN_SECRET")
+# Seconds a socket token is accepted for after sign in
+SOCKET_TOKEN_MAX_AGE = int(os.environ.get("SOCKET_TOKEN_MAX_AGE", 30 * 24 * 3600))
+
+if not SOCKET_TOKEN_SECRET:
+    logger.warning("SOCKET_TOKEN_SECRET is not set, Socket.IO connections will be refused")
+
+
+def user_room(phone):
+    return f"user:{phone}"
+
+
+def _token_serializer():
+    return URLSafeTimedSerializer(SOCKET_TOKEN_SECRET, salt="socket")
+
+
+def socket_token(phone):
+    # Token for the Socket.IO connection of phone, None without a secret
+    if not SOCKET_TOKEN_SECRET:
+        return None
+    return _token_serializer().dumps(phone)
+
+
+def token_phone(token):
+    # The phone a socket token was issued for, None when it is forged,
+    # expired or missing
+    if not SOCKET_TOKEN_SECRET or not token:
+        return None
+    try:
+        return _token_serializer().loads(token, max_age=SOCKET_TOKEN_MAX_AGE)
+    except BadSignature:
+        return None
+
+
+def notify_query(room, event, data):
+    # (query, params) that publish an emit of `event` to `room` on every pod.
+    # The payload is what python-socketio's pub/sub managers exchange. A
+    # message too big for NOTIFY is pushed without its content; the client
+    # then fetches it with since_id.
+    message = {"method": "emit", "event": event, "data": data, "namespace": "/",
+               "room": room, "skip_sid": None, "callback": None, "host_id": None}
+    payload = json.dumps(message, default=str)
+    if len(payload.encode("utf-8")) > MAX_NOTIFY_BYTES and "content" in data:
+        message["data"] = {**{k: v for k, v in data.items() if k != "content"},
+                           "truncated": True}
+        payload = json.dumps(message, default=str)
+    return "SELECT pg_notify(%s, %s)", (SOCKETIO_CHANNEL, payload)
+
+
+class PostgresManager(AsyncPubSubManager):
+    # python-socketio client manager using LISTEN/NOTIFY as its message queue
+
+    name = "postgres"
+
+    async def _publish(self, data):
+        # Only used for emits made by the server itself (handle_message
+        # publishes with notify_query), which are rare enough for a short
+        # lived connection
+        async with await psycopg.AsyncConnection.connect(**db_config, autocommit=True) as conn:
+            await conn.execute("SELECT pg_notify(%s, %s)",
+                               (self.channel, json.dumps(data, default=str)))
+
+    async def _listen(self):
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(**db_config, autocommit=True)
+                async with conn:
+                    await conn.execute(f'LISTEN "{self.channel}"')
+                    async for notify in conn.notifies():
+                        yield notify.payload
+            except psycopg.Error:
+                logger.warning("Lost the Socket.IO backplane connection, reconnecting",
+                               exc_info=True)
+                await asyncio.sleep(RECONNECT_DELAY)
+
+
+sio = socketio.AsyncServer(async_mode="asgi", client_manager=PostgresManager(SOCKETIO_CHANNEL),
+                           cors_allowed_origins="*")
+
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    # The room is the phone the token was signed for, never one the client
+    # names itself
+    token = (auth or {}).get("token")
+    if not token:
+        token = parse_qs(environ.get("QUERY_STRING", "")).get("token", [None])[0]
+    phone = token_phone(token)
+    if not phone:
+        return False
+    await sio.save_session(sid, {"phone": phone})
+    sio.enter_room(sid, user_room(phone))
+    presence.connected(phone)
+
+
+@sio.event
+async def disconnect(sid):
+    session = await sio.get_session(sid)
+    presence.disconnected(session["phone"])
+
+
+# The Socket.IO server on its own:
+#   gunicorn -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8000 realtime:socket_app
+socket_app = socketio.ASGIApp(sio)
@@ -0,0 +1,96 @@
+# serialization.py
+# JSON encoding of the responses. Flask's default provider runs the stdlib
+# encoder, which dominates the time of the big listings; this one uses orjson
+# when it is installed and falls back to the stdlib otherwise.
+#
+# The output keeps jsonify's conventions, so clients (and cached bodies) see
+# the same values: keys sorted, dates and datetimes as HTTP dates, Decimal
+# and UUID as strings. The only visible difference is that non-ASCII text is
+# written as UTF-8 instead of \u escapes.
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date, datetime, timezone
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+               | orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def _http_date(o):
+    # werkzeug.http.http_date without going through email.utils, which is
+    # most of the encoding time of rows with timestamps. Naive values are
+    # taken as UTC, like werkzeug does.
+    if not isinstance(o, datetime):
+        o = datetime(o.year, o.month, o.day)
+    elif o.tzinfo is not None:
+        o = o.astimezone(timezone.utc)
+    if not 1 <= o.year <= 9999:
+        return http_date(o)
+    return (f"{WEEKDAYS[o.weekday()]}, {o.day:02d} {MONTHS[o.month - 1]} {o.year:04d} "
+            f"{o.hour:02d}:{o.minute:02d}:{o.second:02d} GMT")
+
+
+def _default(o):
+    # Same as flask.json.provider._default
+    if isinstance(o, date):
+        return _http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj, indent=None):
+    separators = None if indent else (",", ":")
+    return json.dumps(obj, default=_default, sort_keys=True, ensure_ascii=False,
+                      indent=indent, separators=separators).encode("utf-8")
+
+
+def dumps(obj, indent=False):
+    # obj as UTF-8 encoded JSON bytes. Lists of dict_row rows go straight to
+    # the encoder, there is no need to copy them into new dicts first.
+    if orjson is None:
+        return _stdlib_dumps(obj, 2 if indent else None)
+    try:
+        return orjson.dumps(obj, default=_default,
+                            option=(OPTIONS | orjson.OPT_INDENT_2) if indent else OPTIONS)
+    except orjson.JSONEncodeError:
+        # Integers beyond 64 bits and the like
+        return _stdlib_dumps(obj, 2 if indent else None)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # flask_app.json, used by jsonify and request.get_json
+
+    def dumps(self, obj, **kwargs):
+        # Explicit encoder arguments are only honoured by the stdlib
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(dumps(obj, indent) + b"\n", mimetype=self.mimetype)
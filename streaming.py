@@ -0,0 +1,96 @@
+# streaming.py
+# Streamed (chunked) bodies for the full-table listings. With stream=json the
+# usual JSON array is sent, with stream=ndjson one JSON object per line.
+# Either way the rows are read through a server-side cursor (db.RowStream)
+# and written out a batch at a time, so a worker never holds the whole table
+# however large it grows. Streamed responses keep their ETag but are not
+# stored in the response cache.
+import logging
+from functools import wraps
+
+from flask import current_app, jsonify, request
+from psycopg.rows import dict_row
+from werkzeug.wsgi import ClosingIterator
+
+from db import RowStream
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# stream parameter -> content type
+STREAM_FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+NO_STORE = "no-store, no-cache, must-revalidate, post-check=0, pre-check=0"
+
+
+def stream_format(args):
+    # None when the request did not ask for a stream. Raises ValueError for
+    # unknown formats.
+    fmt = args.get("stream", "")
+    if fmt == "":
+        return None
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"stream must be one of {', '.join(STREAM_FORMATS)}")
+    return fmt
+
+
+def _body(rows, fmt):
+    # Runs after the request is over, so it logs through its own logger
+    try:
+        if fmt == "ndjson":
+            for batch in rows:
+                yield b"".join(dumps(row) + b"\n" for row in batch)
+            return
+
+        separator = b"["
+        for batch in rows:
+            # One encoder call per batch, without its brackets
+            yield separator + dumps(batch)[1:-1]
+            separator = b","
+        yield b"]\n"
+    except Exception:
+        # Too late for an error status, the client gets a truncated body
+        logger.error("Streaming a response failed", exc_info=True)
+        raise
+
+
+def stream_query(query, fmt, params=None):
+    # Streamed response with the rows of query, None when there are none
+    rows = RowStream(query, params, dict_row)
+    if not rows.first:
+        rows.close()
+        return None
+    return current_app.response_class(ClosingIterator(_body(rows, fmt), rows.close),
+                                      mimetype=STREAM_FORMATS[fmt])
+
+
+def streamable(query):
+    # For GET views returning every row of `query`: the stream parameter gets
+    # the same rows streamed. Empty results are left to the view, which
+    # answers them as usual.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                fmt = stream_format(request.args)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if fmt is None:
+                return view(*args, **kwargs)
+
+            try:
+                response = stream_query(query, fmt)
+            except Exception:
+                current_app.logger.error(f"Error streaming {request.path}", exc_info=True)
+                return jsonify({"error": "Failed to stream the data"}), 500
+            if response is None:
+                return view(*args, **kwargs)
+
+            response.headers["Cache-Control"] = NO_STORE
+            response.headers["Pragma"] = "no-cache"
+            return response
+        return wrapper
+    return decorator
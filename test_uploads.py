@@ -0,0 +1,129 @@
+# Upload paths of uploads.py against moto's in-memory S3. uploads.s3 is
+# replaced by a client made under the mock with test credentials.
+import hashlib
+import io
+import os
+
+import boto3
+import pytest
+import requests
+from moto import mock_aws
+
+import uploads
+
+BOUNDARY = "test-boundary"
+
+
+def multipart_body(filename, content, content_type="image/jpeg"):
+    return io.BytesIO(
+        (f"--{BOUNDARY}\r\n"
+         f'Content-Disposition: form-data; name="other"\r\n\r\nignored\r\n'
+         f"--{BOUNDARY}\r\n"
+         f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+         f"Content-Type: {content_type}\r\n\r\n").encode("latin-1")
+        + content + f"\r\n--{BOUNDARY}--\r\n".encode("latin-1"))
+
+
+def upload(filename, content, content_type="image/jpeg"):
+    return uploads.stream_upload(f"multipart/form-data; boundary={BOUNDARY}",
+                                 multipart_body(filename, content, content_type))
+
+
+def keys(prefix=""):
+    listing = uploads.s3.list_objects_v2(Bucket=uploads.S3_BUCKET, Prefix=prefix)
+    return [item["Key"] for item in listing.get("Contents", [])]
+
+
+@pytest.fixture(autouse=True)
+def bucket(monkeypatch):
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    with mock_aws():
+        monkeypatch.setattr(uploads, "s3", boto3.client("s3", region_name=uploads.S3_REGION))
+        uploads.s3.create_bucket(
+            Bucket=uploads.S3_BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": uploads.S3_REGION})
+        yield
+
+
+def test_single_part_upload():
+    content = os.urandom(100 * 1024)
+    key, content_type = upload("avatar.JPG", content)
+
+    assert key == f"images/{hashlib.sha256(content).hexdigest()}.jpg"
+    assert content_type == "image/jpeg"
+    stored = uploads.s3.get_object(Bucket=uploads.S3_BUCKET, Key=key)
+    assert stored["Body"].read() == content
+    assert stored["ContentType"] == "image/jpeg"
+
+
+def test_multipart_upload():
+    content = os.urandom(2 * uploads.PART_SIZE + 12345)
+    key, content_type = upload("large.png", content, "image/png")
+
+    assert key == f"images/{hashlib.sha256(content).hexdigest()}.png"
+    stored = uploads.s3.get_object(Bucket=uploads.S3_BUCKET, Key=key)
+    assert stored["Body"].read() == content
+    assert content_type == stored["ContentType"] == "image/png"
+    # The staging object and the multipart upload are gone
+    assert keys(uploads.STAGING_PREFIX) == []
+    assert uploads.s3.list_multipart_uploads(Bucket=uploads.S3_BUCKET).get("Uploads", []) == []
+
+
+def test_identical_content_is_stored_once():
+    small = os.urandom(1024)
+    large = os.urandom(uploads.PART_SIZE + 1)
+
+    assert upload("a.jpg", small)[0] == upload("b.jpg", small)[0]
+    assert upload("a.jpg", large)[0] == upload("c.jpg", large)[0]
+    assert len(keys(uploads.OBJECT_PREFIX)) == 2
+    assert keys(uploads.STAGING_PREFIX) == []
+
+
+def test_bodies_without_a_file_are_rejected():
+    with pytest.raises(uploads.UploadError):
+        uploads.stream_upload("application/json", io.BytesIO(b"{}"))
+    with pytest.raises(uploads.UploadError):
+        uploads.stream_upload(f"multipart/form-data; boundary={BOUNDARY}",
+                              io.BytesIO(f"--{BOUNDARY}--\r\n".encode("latin-1")))
+
+
+def test_presigned_put_upload_is_verified():
+    content = os.urandom(2048)
+    presigned = uploads.presign_upload("image/png", len(content), method="PUT")
+    assert presigned["key"].startswith(uploads.INCOMING_PREFIX)
+
+    response = requests.put(presigned["url"], data=content, headers=presigned["headers"])
+    assert response.status_code == 200
+    assert uploads.verify_upload(presigned["key"], "image/png") == len(content)
+
+
+def test_presigned_post_upload_is_verified():
+    content = os.urandom(2048)
+    presigned = uploads.presign_upload("image/webp")
+
+    response = requests.post(presigned["url"], data=presigned["fields"],
+                             files={"file": ("image.webp", content)})
+    assert response.status_code in (200, 204)
+    assert uploads.verify_upload(presigned["key"], "image/webp") == len(content)
+
+
+def test_upload_not_matching_its_constraints_is_deleted():
+    presigned = uploads.presign_upload("image/png", 10, method="PUT")
+    uploads.s3.put_object(Bucket=uploads.S3_BUCKET, Key=presigned["key"], Body=b"x" * 10,
+                          ContentType="text/html")
+
+    with pytest.raises(uploads.UploadError):
+        uploads.verify_upload(presigned["key"], "image/png")
+    assert keys(presigned["key"]) == []
+    with pytest.raises(uploads.UploadError):
+        uploads.verify_upload(presigned["key"], "image/png")
+
+
+def test_presign_rejects_other_types_and_sizes():
+    with pytest.raises(uploads.UploadError):
+        uploads.presign_upload("text/html")
+    with pytest.raises(uploads.UploadError):
+        uploads.presign_upload("image/png", uploads.MAX_IMAGE_SIZE + 1)
+    with pytest.raises(uploads.UploadError):
+        uploads.presign_upload("image/png", method="PUT")
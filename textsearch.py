@@ -0,0 +1,138 @@
+# textsearch.py
+# Full-text search over the ads of the four blueprints (/api/search_ads).
+#
+# Postgres' parsers do not split Chinese, Japanese or Korean text into words,
+# so ads are indexed as the overlapping character bigrams of their CJK runs,
+# plus their other words in lower case: "長者護理 Nurse" becomes
+# "長者 者護 護理 nurse". Single characters are indexed too, so that one
+# character queries match. cjk_tokens() in migrations/010_ad_search.sql does
+# this in the database. The ad_search table it creates holds every ad with
+# its search_vector (title weighted over description) under one GIN index,
+# kept current by triggers on the ads tables.
+#
+# A query matches the ads holding all of its tokens, best ts_rank_cd first,
+# then newest first. Pages are keyed on (rank, id, ad_type): a full page
+# carries X-Next-Search-After, pass it back as `after` for the next one.
+import html
+import os
+import re
+
+from pagination import page_limit
+
+# ad_type parameter -> ads table
+AD_TYPES = {
+    "caregiver": "caregiverads",
+    "careneeder": "careneederads",
+    "animalcaregiver": "animalcaregiverads",
+    "animalcareneeder": "animalcareneederads",
+}
+
+MAX_QUERY_LENGTH = 200
+SNIPPET_LENGTH = int(os.environ.get("SEARCH_SNIPPET_LENGTH", 120))
+
+NEXT_SEARCH_HEADER = "X-Next-Search-After"
+
+# Must match the character classes of cjk_tokens()
+CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_CJK_RUN = re.compile(f"([{CJK}]+)")
+_CJK_CHAR = re.compile(f"[{CJK}]")
+_SEPARATORS = re.compile(f"[^0-9a-z\u00c0-\u024f{CJK}]+")
+
+AD_SEARCH_QUERY = """SELECT ad_type, ad_id AS id, profile_id, title, description, rank FROM (
+        SELECT s.*, ts_rank_cd(s.search_vector, q.query) AS rank
+        FROM ad_search s, plainto_tsquery('simple', cjk_tokens(%s)) q(query)
+        WHERE s.search_vector @@ q.query AND s.ad_type = ANY(%s)
+    ) r"""
+
+
+def tokens(text):
+    # The tokens of a query, as cjk_tokens(text) returns them
+    result = []
+    for word in _SEPARATORS.split(_CJK_RUN.sub(r" \1 ", text.lower())):
+        if not word:
+            continue
+        if _CJK_CHAR.match(word):
+            result.extend(word[i:i + 2] for i in range(max(len(word) - 1, 1)))
+        else:
+            result.append(word)
+    return result
+
+
+def _after(value):
+    try:
+        rank, ad_id, ad_type = value.split(":", 2)
+        return float(rank), int(ad_id), ad_type
+    except ValueError:
+        raise ValueError("Invalid value for after")
+
+
+def search_query(args):
+    # Returns (query, params, limit, terms); terms are the tokens of the query
+    # for highlight(). Raises ValueError for malformed parameters.
+    text = args.get("q", "").strip()
+    if not text:
+        raise ValueError("q is required")
+    if len(text) > MAX_QUERY_LENGTH:
+        raise ValueError(f"q is limited to {MAX_QUERY_LENGTH} characters")
+    terms = tokens(text)
+    if not terms:
+        raise ValueError("q must contain letters or digits")
+
+    ad_types = list(AD_TYPES)
+    if args.get("ad_type", "") != "":
+        ad_types = [name.strip() for name in args["ad_type"].split(",")]
+        unknown = [name for name in ad_types if name not in AD_TYPES]
+        if unknown:
+            raise ValueError(f"ad_type must be among {', '.join(AD_TYPES)}")
+
+    query = AD_SEARCH_QUERY
+    params = [text, ad_types]
+    if args.get("after", "") != "":
+        query += " WHERE (rank, ad_id, ad_type) < (%s::real, %s, %s)"
+        params.extend(_after(args["after"]))
+    query += " ORDER BY rank DESC, ad_id DESC, ad_type DESC LIMIT %s"
+    limit = page_limit(args)
+    params.append(limit)
+
+    return query, params, limit, terms
+
+
+def highlight(text, terms, length=None):
+    # text, HTML escaped, with the matches of terms in <mark> tags. With
+    # length, only about that many characters around the first match.
+    if not text:
+        return text
+    pattern = "|".join(re.escape(term) for term in sorted(set(terms), key=len, reverse=True))
+    spans = []
+    for match in re.finditer(pattern, text, re.IGNORECASE):
+        if spans and match.start() <= spans[-1][1]:
+            spans[-1][1] = match.end()
+        else:
+            spans.append([match.start(), match.end()])
+
+    start, end = 0, len(text)
+    if length is not None and len(text) > length:
+        if spans:
+            start = max(min(spans[0][0] - length // 4, len(text) - length), 0)
+        end = start + length
+
+    parts = ["…"] if start > 0 else []
+    position = start
+    for span_start, span_end in spans:
+        if span_end <= start or span_start >= end:
+            continue
+        span_start, span_end = max(span_start, start), min(span_end, end)
+        parts.append(html.escape(text[position:span_start]))
+        parts.append(f"<mark>{html.escape(text[span_start:span_end])}</mark>")
+        position = span_end
+    parts.append(html.escape(text[position:end]))
+    if end < len(text):
+        parts.append("…")
+    return "".join(parts)
+
+
+def set_search_cursor(response, rows, limit):
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers[NEXT_SEARCH_HEADER] = f"{last['rank']!r}:{last['id']}:{last['ad_type']}"
+    return response
@@ -0,0 +1,182 @@
+# thumbnails.py
+# Resized variants of the uploaded profile images, so that listings can show
+# small avatars instead of the multi-megabyte originals.
+#
+# Every image stored under one of the managed prefixes gets a WebP and a JPEG
+# variant per width in THUMBNAIL_WIDTHS, at a key derived from its own key:
+#
+#   images/<sha256>.jpg -> thumbnails/images/<sha256>/256.webp
+#
+# so the listings can compute the URLs without a lookup. Variants are made by
+# a small background pool after the upload finishes; until they exist the URLs
+# answer 404 and clients fall back to imageurl.
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from uploads import INCOMING_PREFIX, OBJECT_PREFIX, S3_BUCKET, S3_PUBLIC_URL, public_url, s3
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTHS = [int(width) for width in
+                    os.environ.get("THUMBNAIL_WIDTHS", "128,256,512").split(",")]
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", 80))
+# Pillow releases the GIL while decoding, resizing and encoding, so threads
+# are enough
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", 2))
+# Images allowed to wait for a worker; more than that are dropped and logged
+THUMBNAIL_MAX_QUEUE = int(os.environ.get("THUMBNAIL_MAX_QUEUE", 64))
+
+THUMBNAIL_PREFIX = "thumbnails/"
+MANAGED_PREFIXES = (OBJECT_PREFIX, INCOMING_PREFIX)
+
+# format -> (file extension, content type)
+FORMATS = {
+    "webp": (".webp", "image/webp"),
+    "jpeg": (".jpg", "image/jpeg"),
+}
+
+# Upper bounds (ms) of the buckets of the processing time histogram
+PROCESS_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000]
+
+_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+_slots = threading.BoundedSemaphore(THUMBNAIL_WORKERS + THUMBNAIL_MAX_QUEUE)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "processed": 0,
+    "failed": 0,
+    "dropped": 0,
+    "source_bytes": 0,
+    # format -> width -> total bytes of the variants
+    "variant_bytes": {fmt: {width: 0 for width in THUMBNAIL_WIDTHS} for fmt in FORMATS},
+    "process_ms": [0] * (len(PROCESS_BUCKETS_MS) + 1),
+}
+
+
+def thumbnail_key(key, width, fmt):
+    stem = os.path.splitext(key)[0]
+    return f"{THUMBNAIL_PREFIX}{stem}/{width}{FORMATS[fmt][0]}"
+
+
+def thumbnail_urls(imageurl):
+    # {"128": {"webp": url, "jpeg": url}, ...} for images we generate
+    # variants for, {} for anything else (older uploads, external URLs)
+    prefix = f"{S3_PUBLIC_URL}/"
+    if not imageurl or not imageurl.startswith(prefix):
+        return {}
+    key = imageurl[len(prefix):]
+    if not key.startswith(MANAGED_PREFIXES):
+        return {}
+    return {
+        str(width): {fmt: public_url(thumbnail_key(key, width, fmt)) for fmt in FORMATS}
+        for width in THUMBNAIL_WIDTHS
+    }
+
+
+def thumbnails_column(column="imageurl"):
+    # (SQL expression, params) computing thumbnail_urls(column) in Postgres,
+    # see migrations/006_image_thumbnails.sql
+    return (f"image_thumbnails({column}, %s, %s, %s)",
+            [S3_PUBLIC_URL, list(MANAGED_PREFIXES), THUMBNAIL_WIDTHS])
+
+
+def _encode(image, fmt):
+    out = io.BytesIO()
+    if fmt == "jpeg":
+        image.convert("RGB").save(out, "JPEG", quality=THUMBNAIL_QUALITY,
+                                  optimize=True, progressive=True)
+    else:
+        image.save(out, "WEBP", quality=THUMBNAIL_QUALITY, method=4)
+    return out.getvalue()
+
+
+def make_thumbnails(key):
+    # Builds and stores every variant of one image. Returns the number of
+    # bytes of the original and {fmt: {width: bytes}} of the variants.
+    original = s3.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read()
+
+    with Image.open(io.BytesIO(original)) as source:
+        # Phone pictures are usually stored sideways with an EXIF rotation
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        sizes = {fmt: {} for fmt in FORMATS}
+        # Largest first so that each step shrinks the previous result
+        for width in sorted(THUMBNAIL_WIDTHS, reverse=True):
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                     Image.LANCZOS)
+            for fmt, (_, content_type) in FORMATS.items():
+                body = _encode(image, fmt)
+                s3.put_object(Bucket=S3_BUCKET, Key=thumbnail_key(key, width, fmt), Body=body,
+                              ContentType=content_type,
+                              CacheControl="public, max-age=31536000, immutable")
+                sizes[fmt][width] = len(body)
+
+    return len(original), sizes
+
+
+def _run(key):
+    try:
+        started = time.monotonic()
+        source_bytes, sizes = make_thumbnails(key)
+        elapsed_ms = (time.monotonic() - started) * 1000
+
+        with _stats_lock:
+            _stats["processed"] += 1
+            _stats["source_bytes"] += source_bytes
+            for fmt, widths in sizes.items():
+                for width, size in widths.items():
+                    _stats["variant_bytes"][fmt][width] += size
+            for i, bound in enumerate(PROCESS_BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    _stats["process_ms"][i] += 1
+                    break
+            else:
+                _stats["process_ms"][-1] += 1
+    except Exception:
+        with _stats_lock:
+            _stats["failed"] += 1
+        logger.error(f"Generating thumbnails for {key} failed", exc_info=True)
+    finally:
+        _slots.release()
+
+
+def schedule_thumbnails(key):
+    # Queues the variants of a freshly uploaded image, never blocks the caller
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats["dropped"] += 1
+        logger.warning(f"Thumbnail queue full, skipping {key}")
+        return
+    _executor.submit(_run, key)
+
+
+def get_thumbnail_stats():
+    with _stats_lock:
+        processed = _stats["processed"]
+        return {
+            "processed": processed,
+            "failed": _stats["failed"],
+            "dropped": _stats["dropped"],
+            "avg_source_bytes": _stats["source_bytes"] // processed if processed else 0,
+            # Average size of each variant, compare with avg_source_bytes for
+            # the bytes a client saves by using it
+            "avg_variant_bytes": {
+                fmt: {str(width): total // processed if processed else 0
+                      for width, total in widths.items()}
+                for fmt, widths in _stats["variant_bytes"].items()
+            },
+            "process_ms_histogram": {
+                **{f"<={bound}ms": count
+                   for bound, count in zip(PROCESS_BUCKETS_MS, _stats["process_ms"])},
+                f">{PROCESS_BUCKETS_MS[-1]}ms": _stats["process_ms"][-1],
+            },
+        }
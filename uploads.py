@@ -0,0 +1,312 @@
+# uploads.py
+# Streams multipart/form-data uploads straight into S3. The request body is
+# parsed incrementally and cut into parts that are uploaded in parallel, so
+# memory stays bounded by PART_SIZE * (UPLOAD_CONCURRENCY + 1) whatever the
+# size of the file, and nothing is written to the local disk.
+#
+# Objects are stored under the sha256 of their content: two uploads with the
+# same filename can no longer overwrite each other and identical files are
+# stored once. Point S3_ENDPOINT_URL at MinIO (or a moto server) to run against
+# a local S3.
+#
+# Clients can also skip the API servers entirely: presign_upload hands out a
+# presigned POST (or PUT) for a fresh key under incoming/, the client sends the
+# image to S3 itself and then reports the key back, which verify_upload checks
+# against the bucket before the upload is recorded as complete.
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import NEED_DATA, Data, Epilogue, File, MultipartDecoder
+from werkzeug.utils import secure_filename
+
+S3_BUCKET = os.environ.get("S3_BUCKET", "alex-chen-images")
+S3_REGION = os.environ.get("S3_REGION", "ap-east-1")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+# Base of the URLs handed back to the clients
+S3_PUBLIC_URL = os.environ.get(
+    "S3_PUBLIC_URL", f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com").rstrip("/")
+
+# S3 needs every part but the last one to be at least 5 MiB
+PART_SIZE = max(int(os.environ.get("UPLOAD_PART_SIZE", 8 * 1024 * 1024)), 5 * 1024 * 1024)
+# Parts of one upload sent to S3 at the same time
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", 4))
+# Size of the reads from the request body
+READ_SIZE = 64 * 1024
+
+# Content addressed objects live under this prefix, in-progress uploads under
+# the staging one until their hash is known
+OBJECT_PREFIX = "images/"
+STAGING_PREFIX = "staging/"
+# Direct uploads from the clients
+INCOMING_PREFIX = "incoming/"
+
+# Constraints signed into the presigned uploads
+PRESIGN_EXPIRES = int(os.environ.get("UPLOAD_URL_EXPIRES", 15 * 60))
+MAX_IMAGE_SIZE = int(os.environ.get("MAX_IMAGE_SIZE", 10 * 1024 * 1024))
+IMAGE_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+}
+
+s3 = boto3.client(
+    "s3", region_name=S3_REGION, endpoint_url=S3_ENDPOINT_URL,
+    config=Config(max_pool_connections=max(10, UPLOAD_CONCURRENCY * 4)))
+
+_part_executor = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY * 4,
+                                    thread_name_prefix="s3-part")
+
+
+class UploadError(ValueError):
+    pass
+
+
+def public_url(key):
+    return f"{S3_PUBLIC_URL}/{key}"
+
+
+def _object_exists(key):
+    try:
+        s3.head_object(Bucket=S3_BUCKET, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def _content_key(digest, filename):
+    ext = os.path.splitext(secure_filename(filename))[1].lower()
+    return f"{OBJECT_PREFIX}{digest}{ext}"
+
+
+class _MultipartWriter:
+    # Collects the bytes of one file and ships them to S3. Files that fit in a
+    # single part are sent with one put_object once their hash is known; bigger
+    # ones go through a multipart upload to a staging key that is copied to the
+    # content addressed key at the end.
+
+    def __init__(self, filename, content_type):
+        self.filename = filename
+        self.content_type = content_type
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.buffer = bytearray()
+        self.staging_key = None
+        self.upload_id = None
+        self.futures = []
+        # At most UPLOAD_CONCURRENCY parts in flight, reading the request body
+        # waits for a free slot
+        self.slots = threading.BoundedSemaphore(UPLOAD_CONCURRENCY)
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        self.buffer += data
+        while len(self.buffer) >= PART_SIZE:
+            self._send_part(bytes(self.buffer[:PART_SIZE]))
+            del self.buffer[:PART_SIZE]
+
+    def _start(self):
+        self.staging_key = f"{STAGING_PREFIX}{uuid.uuid4().hex}"
+        response = s3.create_multipart_upload(
+            Bucket=S3_BUCKET, Key=self.staging_key, ContentType=self.content_type)
+        self.upload_id = response["UploadId"]
+
+    def _upload_part(self, number, body):
+        try:
+            response = s3.upload_part(Bucket=S3_BUCKET, Key=self.staging_key,
+                                      UploadId=self.upload_id, PartNumber=number, Body=body)
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            self.slots.release()
+
+    def _send_part(self, body):
+        if self.upload_id is None:
+            self._start()
+        self.slots.acquire()
+        number = len(self.futures) + 1
+        self.futures.append(_part_executor.submit(self._upload_part, number, body))
+
+    def finish(self):
+        key = _content_key(self.sha256.hexdigest(), self.filename)
+
+        if self.upload_id is None:
+            # Small file, already entirely in memory
+            if not _object_exists(key):
+                s3.put_object(Bucket=S3_BUCKET, Key=key, Body=bytes(self.buffer),
+                              ContentType=self.content_type)
+            return key
+
+        if self.buffer:
+            self._send_part(bytes(self.buffer))
+            self.buffer.clear()
+        parts = [future.result() for future in self.futures]
+        s3.complete_multipart_upload(Bucket=S3_BUCKET, Key=self.staging_key,
+                                     UploadId=self.upload_id, MultipartUpload={"Parts": parts})
+        self.upload_id = None
+
+        try:
+            if not _object_exists(key):
+                s3.copy({"Bucket": S3_BUCKET, "Key": self.staging_key}, S3_BUCKET, key,
+                        ExtraArgs={"ContentType": self.content_type,
+                                   "MetadataDirective": "REPLACE"})
+        finally:
+            s3.delete_object(Bucket=S3_BUCKET, Key=self.staging_key)
+        return key
+
+    def abort(self):
+        for future in self.futures:
+            future.cancel()
+        if self.upload_id is not None:
+            # Let the parts already submitted finish so that nothing is left
+            # behind once the upload is aborted
+            for future in self.futures:
+                if not future.cancelled():
+                    future.exception()
+            s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=self.staging_key,
+                                      UploadId=self.upload_id)
+            self.upload_id = None
+
+
+def stream_upload(content_type, stream, field="file"):
+    # Uploads the file sent in the `field` form field of a multipart/form-data
+    # body read from `stream` and returns its object key and content type.
+    # Other fields are skipped. Raises UploadError when the body has no usable
+    # file.
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get("boundary")
+    if mimetype != "multipart/form-data" or not boundary:
+        raise UploadError("No file part")
+
+    decoder = MultipartDecoder(boundary.encode("latin-1"))
+    writer = None
+    in_file = False
+    ended = False
+    key = None
+
+    try:
+        while key is None:
+            event = decoder.next_event()
+
+            if event is NEED_DATA:
+                if ended:
+                    raise UploadError("No file part" if writer is None else "Incomplete upload")
+                chunk = stream.read(READ_SIZE)
+                ended = not chunk
+                decoder.receive_data(chunk or None)
+            elif isinstance(event, File) and event.name == field and writer is None:
+                if not event.filename:
+                    raise UploadError("No selected file")
+                in_file = True
+                writer = _MultipartWriter(
+                    event.filename,
+                    event.headers.get("Content-Type", "application/octet-stream"))
+            elif isinstance(event, Data) and in_file:
+                writer.write(event.data)
+                if not event.more_data:
+                    key = writer.finish()
+            elif isinstance(event, Epilogue):
+                raise UploadError("No file part")
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    return key, writer.content_type
+
+
+def presign_upload(content_type, size=None, method="POST"):
+    # Returns what the client needs to send one image directly to the bucket.
+    # POST uploads carry the size limit in their policy; PUT uploads sign the
+    # exact size, so the client has to announce it.
+    if content_type not in IMAGE_TYPES:
+        raise UploadError("Unsupported content type")
+    if size is not None:
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError("Invalid value for size")
+        if not 0 < size <= MAX_IMAGE_SIZE:
+            raise UploadError(f"size must be between 1 and {MAX_IMAGE_SIZE}")
+
+    key = f"{INCOMING_PREFIX}{uuid.uuid4().hex}{IMAGE_TYPES[content_type]}"
+
+    if method == "PUT":
+        if size is None:
+            raise UploadError("size is required for PUT uploads")
+        url = s3.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": S3_BUCKET, "Key": key,
+                    "ContentType": content_type, "ContentLength": size},
+            ExpiresIn=PRESIGN_EXPIRES)
+        return {"key": key, "method": "PUT", "url": url,
+                "headers": {"Content-Type": content_type}, "expires_in": PRESIGN_EXPIRES}
+
+    if method != "POST":
+        raise UploadError("method must be POST or PUT")
+
+    post = s3.generate_presigned_post(
+        S3_BUCKET, key,
+        Fields={"Content-Type": content_type},
+        Conditions=[{"Content-Type": content_type},
+                    ["content-length-range", 1, size or MAX_IMAGE_SIZE]],
+        ExpiresIn=PRESIGN_EXPIRES)
+    return {"key": key, "method": "POST", "url": post["url"], "fields": post["fields"],
+            "expires_in": PRESIGN_EXPIRES}
+
+
+def verify_upload(key, content_type):
+    # Checks that a direct upload really landed in the bucket and still obeys
+    # the constraints it was presigned with. Returns its size.
+    try:
+        head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            raise UploadError("Upload not found")
+        raise
+
+    if head["ContentLength"] > MAX_IMAGE_SIZE or head.get("ContentType") != content_type:
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+        raise UploadError("Upload does not match its constraints")
+    return head["ContentLength"]
+
+
+def image_urls(cursor, items):
+    # The url of every image_key of items that belongs to a completed upload,
+    # read in one query, for resolve_image_key over a whole batch
+    keys = {item.get("image_key") for item in items if isinstance(item, dict)}
+    keys = [key for key in keys if isinstance(key, str) and key]
+    if not keys:
+        return {}
+    cursor.execute("SELECT key, url FROM uploads WHERE key = ANY(%s) AND status = 'complete'",
+                   (keys,))
+    return dict(cursor.fetchall())
+
+
+def resolve_image_key(cursor, data, urls=None):
+    # Lets the create handlers take the `image_key` of a completed upload in
+    # place of an `imageurl`. Fills in data["imageurl"]; raises UploadError for
+    # keys that do not belong to a completed upload. Batches pass the urls
+    # of image_urls instead of querying once per item.
+    key = data.get("image_key")
+    if not key:
+        return
+    if urls is not None:
+        url = urls.get(key) if isinstance(key, str) else None
+    else:
+        cursor.execute("SELECT url FROM uploads WHERE key = %s AND status = 'complete'",
+                       (key,), prepare=True)
+        row = cursor.fetchone()
+        url = row[0] if row is not None else None
+    if url is None:
+        raise UploadError("Unknown image_key")
+    data["imageurl"] = url